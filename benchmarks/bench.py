@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+# Benchmarks the cartographer CLI against a local mock API server.
+#
+# Runs each scenario several times in a fresh process and reports latency
+# percentiles, output throughput and peak memory (RSS). With --micro it
+# also times the building blocks in-process: create_url, fetch.get, JSON
+# decoding/encoding and output writing.
+#
+#     python benchmarks/bench.py --records 20000 --latency 5 --runs 10
+#     python benchmarks/bench.py --filter survey --json
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script = os.path.join(root, "bin", "cartographer")
+mock_server = os.path.join(root, "benchmarks", "mock_server.py")
+sys.path.insert(0, root)
+
+scenarios = [
+    ("version", ["version"]),
+    ("workspace read", ["workspace", "read", "workspace-1"]),
+    ("workspace read --cache", ["--cache", "workspace", "read", "workspace-1"]),
+    ("survey search", ["survey", "search", "mrsMorph", "--limit", "100"]),
+    ("survey search --all", ["survey", "search", "mrsMorph", "--all"]),
+    (
+        "survey search --all ndjson",
+        ["survey", "search", "mrsMorph", "--all", "--output", "ndjson"],
+    ),
+    ("user search", ["user", "search"]),
+    ("user search ndjson", ["user", "search", "--output", "ndjson"]),
+    ("feature search", ["feature", "search", "mrsMorph"]),
+    ("feature search ndjson", ["feature", "search", "mrsMorph", "--output", "ndjson"]),
+    ("feature search csv", ["feature", "search", "mrsMorph", "-f", "csv"]),
+    ("feature tile", ["feature", "tile", "mrsMorph", "10", "511", "340"]),
+    (
+        "feature tiles",
+        [
+            "feature",
+            "tiles",
+            "mrsMorph",
+            "--bbox=-1,50,1,52",
+            "--max-zoom",
+            "9",
+            "--archive",
+            "{tmp}/tiles.zip",
+        ],
+    ),
+]
+
+
+# Statistics ------------------------------------
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = int(round(pct / 100.0 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+def max_rss_mb(usage):
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere:
+    if sys.platform == "darwin":
+        return usage.ru_maxrss / (1024.0 * 1024.0)
+    else:
+        return usage.ru_maxrss / 1024.0
+
+
+# Server ----------------------------------------
+
+
+def start_server(args):
+    # The server runs in its own process so its memory use
+    # doesn't show up in the peak RSS of the commands we fork:
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            mock_server,
+            "--port",
+            "0",
+            "--records",
+            str(args.records),
+            "--record-size",
+            str(args.record_size),
+            "--tile-size",
+            str(args.tile_size),
+            "--latency",
+            str(args.latency),
+        ],
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    line = process.stdout.readline()
+    return (process, int(line.strip().rsplit(":", 1)[1]))
+
+
+# Scenarios -------------------------------------
+
+
+def setup_home(port):
+    home = tempfile.mkdtemp(prefix="cartographer-bench-")
+    config = os.path.join(home, ".config", "cartographer")
+    os.makedirs(config)
+    with open(os.path.join(config, "credentials"), "w") as file:
+        file.write("[default]\n")
+        file.write("scheme=http\n")
+        file.write("host=127.0.0.1:{}\n".format(port))
+        file.write("email=bench@example.com\n")
+        file.write("password=bench\n")
+    return home
+
+
+def run_once(argv, home):
+    # Each run starts cold, without the caller's caches or daemon:
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["CARTOGRAPHER_NO_DAEMON"] = "1"
+    env.pop("CARTOGRAPHER_SOCKET", None)
+    env.pop("XDG_CACHE_HOME", None)
+    env["PYTHONPATH"] = os.pathsep.join([root, env.get("PYTHONPATH", "")])
+
+    with open(os.devnull, "w") as devnull:
+        start = time.time()
+        process = subprocess.Popen(
+            [sys.executable, script] + argv,
+            stdout=subprocess.PIPE,
+            stderr=devnull,
+            cwd=home,
+            env=env,
+        )
+        size = 0
+        while True:
+            chunk = process.stdout.read(64 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+        process.stdout.close()
+        (_, status, usage) = os.wait4(process.pid, 0)
+        elapsed = time.time() - start
+        process.returncode = status
+
+    if status != 0:
+        raise RuntimeError("cartographer {} failed".format(" ".join(argv)))
+    return (elapsed, size, max_rss_mb(usage))
+
+
+def run_scenario(name, argv, runs, home):
+    argv = [arg.replace("{tmp}", home) for arg in argv]
+    # Warm up (logs in and fills caches):
+    run_once(argv, home)
+    results = [run_once(argv, home) for _ in range(runs)]
+    times = [elapsed for (elapsed, size, rss) in results]
+    total_bytes = sum(size for (elapsed, size, rss) in results)
+    return {
+        "scenario": name,
+        "runs": runs,
+        "p50_ms": percentile(times, 50) * 1000.0,
+        "p90_ms": percentile(times, 90) * 1000.0,
+        "p99_ms": percentile(times, 99) * 1000.0,
+        "runs_per_s": runs / sum(times),
+        "mb_per_s": total_bytes / sum(times) / (1024.0 * 1024.0),
+        "output_bytes": total_bytes // runs,
+        "peak_rss_mb": max(rss for (elapsed, size, rss) in results),
+    }
+
+
+# Micro-benchmarks ------------------------------
+
+
+def time_per_call(func, count):
+    start = time.time()
+    for _ in range(count):
+        func()
+    return (time.time() - start) / count * 1e6
+
+
+def run_micro(port):
+    import cartographer
+    import cartographer.fetch as fetch
+
+    fetch.set_client(fetch.Client())
+    host = "127.0.0.1:{}".format(port)
+    query = {"workspace": "w", "q": "query", "skip": 100, "limit": 100}
+    url = fetch.create_url("http", host, "/v1/survey/mrsMorph", query)
+    headers = fetch.create_headers()
+    body = fetch.get(url, None, headers).content
+    data = json.loads(body.decode("utf-8"))
+    text = fetch.format_json(data)
+
+    def create_url():
+        fetch.create_url("http", host, "/v1/survey/mrsMorph", query)
+
+    def get():
+        fetch.get(url, None, headers).content
+
+    def decode():
+        json.loads(body.decode("utf-8"))
+
+    def encode():
+        fetch.format_json(data)
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+
+        def write():
+            cartographer.write_output(text)
+
+        write_us = time_per_call(write, 200)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+    return [
+        ("create_url", time_per_call(create_url, 10000)),
+        ("fetch.get (100 records)", time_per_call(get, 200)),
+        ("json decode (100 records)", time_per_call(decode, 200)),
+        ("format_json (100 records)", time_per_call(encode, 200)),
+        ("write_output (100 records)", write_us),
+    ]
+
+
+# Main ------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cartographer CLI")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per scenario")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument(
+        "--record-size", type=int, default=500, help="Padding bytes per record"
+    )
+    parser.add_argument("--tile-size", type=int, default=2000, help="Bytes per tile")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Server latency in milliseconds"
+    )
+    parser.add_argument("--filter", help="Only run scenarios containing this text")
+    parser.add_argument("--micro", action="store_true", help="Run micro-benchmarks")
+    parser.add_argument("--json", action="store_true", help="Write results as JSON")
+    args = parser.parse_args()
+
+    (server, port) = start_server(args)
+    home = setup_home(port)
+
+    results = []
+    try:
+        for (name, argv) in scenarios:
+            if args.filter and args.filter not in name:
+                continue
+            result = run_scenario(name, argv, args.runs, home)
+            results.append(result)
+            if not args.json:
+                if len(results) == 1:
+                    print(
+                        "{:28} {:>9} {:>9} {:>9} {:>9} {:>10}".format(
+                            "scenario", "p50 ms", "p90 ms", "p99 ms", "MB/s", "RSS MB"
+                        )
+                    )
+                print(
+                    "{scenario:28} {p50_ms:9.1f} {p90_ms:9.1f} {p99_ms:9.1f} "
+                    "{mb_per_s:9.2f} {peak_rss_mb:10.1f}".format(**result)
+                )
+
+        micro = run_micro(port) if args.micro else []
+    finally:
+        server.terminate()
+        server.wait()
+        shutil.rmtree(home)
+
+    if args.json:
+        print(
+            json.dumps(
+                {"scenarios": results, "micro_us": dict(micro)},
+                indent=2,
+                sort_keys=True,
+            )
+        )
+    elif micro:
+        print("")
+        for (name, micros) in micro:
+            print("{:28} {:9.1f} us".format(name, micros))
+
+
+if __name__ == "__main__":
+    main()
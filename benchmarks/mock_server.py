@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+
+# A stand-in for the Cartographer API, for benchmarking without a network.
+#
+# Serves generated data for the survey, user, map, tile, attachment, workspace,
+# auth and version endpoints, with configurable payload sizes and latency:
+#
+#     python benchmarks/mock_server.py --port 8000 --records 10000 --latency 20
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+
+
+class Options(object):
+    def __init__(
+        self,
+        records=1000,
+        record_size=500,
+        latency=0.0,
+        tile_size=2000,
+        attachment_size=1000,
+        ranges=True,
+    ):
+        self.records = records
+        self.record_size = record_size
+        self.latency = latency
+        self.tile_size = tile_size
+        self.attachment_size = attachment_size
+        # Whether attachment downloads honour Range headers:
+        self.ranges = ranges
+
+
+def survey(index, size):
+    return {
+        "id": "survey-{:08d}".format(index),
+        "workspace": "workspace-{}".format(index % 5),
+        "timestamp": "2020-01-01T00:00:{:02d}Z".format(index % 60),
+        "updated": "2020-{:02d}-01T00:00:00Z".format(index % 12 + 1),
+        "data": {"index": index, "notes": "x" * size},
+    }
+
+
+def user(index, size):
+    # Roles are "role:workspace", or just "role" for site-wide roles:
+    roles = ["{}:workspace-{}".format(["admin", "member"][index % 2], index % 5)]
+    if index % 3 == 0:
+        roles.append("viewer")
+    return {
+        "id": "user-{:08d}".format(index),
+        "email": "user{}@example.com".format(index),
+        "roles": roles,
+        "notes": "x" * size,
+    }
+
+
+def has_role(user, role):
+    # As the API matches `role`: exactly, or with any workspace:
+    return any(r == role or r.startswith(role + ":") for r in user["roles"])
+
+
+def feature(index, size):
+    rand = random.Random(index)
+    return {
+        "type": "Feature",
+        "id": "feature-{:08d}".format(index),
+        "geometry": {
+            "type": "Point",
+            "coordinates": [rand.uniform(-5.0, 2.0), rand.uniform(50.0, 55.0)],
+        },
+        "properties": {"index": index, "notes": "x" * size},
+    }
+
+
+def attachment(survey, index, size):
+    # Different bytes for each of a survey's attachments:
+    block = hashlib.sha1("{}/{}".format(survey, index).encode("utf-8")).hexdigest()
+    return (block.encode("utf-8") * (size // len(block) + 1))[:size]
+
+
+def attachments(survey, size, port):
+    # Two files with the same name, and one linked from another host
+    # (the same server, as "localhost" rather than 127.0.0.1):
+    items = []
+    for (index, name) in enumerate(["photo.jpg", "photo.jpg", "notes.txt"]):
+        items.append(
+            {
+                "id": index,
+                "filename": name,
+                "url": "/v1/attachment/{}/{}".format(survey, index),
+                "size": size,
+                "md5": hashlib.md5(attachment(survey, index, size)).hexdigest(),
+            }
+        )
+    items[2]["url"] = "http://localhost:{}{}".format(port, items[2]["url"])
+    return items
+
+
+def window(query, total):
+    skip = int(query.get("skip", 0))
+    limit = int(query.get("limit", total))
+    return range(skip, min(skip + limit, total))
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    options = Options()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, content_type="application/json", headers={}):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_attachment(self, data):
+        # Answers "Range: bytes=N-" with the rest of the file, if enabled:
+        self.server.attachment_requests.append(
+            (self.path, self.headers.get("Range"), self.headers.get("Authorization"))
+        )
+        match = re.match(r"^bytes=(\d+)-$", self.headers.get("Range") or "")
+        if match is None or not self.options.ranges:
+            self.send_body(200, data, "application/octet-stream")
+            return
+        start = int(match.group(1))
+        if start >= len(data):
+            content_range = "bytes */{}".format(len(data))
+            self.send_body(416, b"", headers={"Content-Range": content_range})
+        else:
+            content_range = "bytes {}-{}/{}".format(start, len(data) - 1, len(data))
+            self.send_body(
+                206,
+                data[start:],
+                "application/octet-stream",
+                {"Content-Range": content_range},
+            )
+
+    def send_json_cached(self, data):
+        body = json.dumps(data).encode("utf-8")
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+        if self.headers.get("If-None-Match") == etag:
+            self.send_body(304, b"", headers={"ETag": etag})
+        else:
+            self.send_body(200, body, headers={"ETag": etag})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.startswith("/v1/auth/login"):
+            self.send_body(200, {"token": "benchmark-token"})
+        else:
+            self.send_body(404, {"error": "Not found"})
+
+    def do_GET(self):
+        options = self.options
+        if options.latency:
+            time.sleep(options.latency / 1000.0)
+
+        url = urlparse(self.path)
+        query = dict((key, values[0]) for (key, values) in parse_qs(url.query).items())
+        path = [part for part in url.path.split("/") if part]
+        size = options.record_size
+
+        if path == ["v1", "version"]:
+            self.send_body(200, {"version": "0.0.0-benchmark"})
+        elif path == ["v1", "workspace"]:
+            self.send_body(200, [{"id": "workspace-{}".format(i)} for i in range(5)])
+        elif path[:2] == ["v1", "workspace"]:
+            self.send_json_cached({"id": path[2], "name": "Workspace " + path[2]})
+        elif path[:3] == ["v1", "survey", "module"]:
+            self.send_json_cached({"id": path[-1], "name": "Module"})
+        elif path[:2] == ["v1", "survey"] and path[-1] == "blank":
+            self.send_json_cached(survey(0, size))
+        elif path[:2] == ["v1", "survey"] and len(path) in (3, 4):
+            indices = window(query, options.records)
+            self.send_body(200, [survey(i, size) for i in indices])
+        elif path == ["v1", "user"] and "role" in query:
+            users = [user(i, size) for i in range(options.records)]
+            users = [u for u in users if has_role(u, query["role"])]
+            self.send_body(200, [users[i] for i in window(query, len(users))])
+        elif path == ["v1", "user"]:
+            indices = window(query, options.records)
+            self.send_body(200, [user(i, size) for i in indices])
+        elif path == ["v1", "attachment"]:
+            port = self.server.server_address[1]
+            items = attachments(query["survey"], options.attachment_size, port)
+            self.send_body(200, items)
+        elif path[:2] == ["v1", "attachment"] and len(path) == 4:
+            size = options.attachment_size
+            self.send_attachment(attachment(path[2], int(path[3]), size))
+        elif path[:2] == ["v1", "map"] and "tile" in path:
+            tile = "/".join(path[-3:]).encode("utf-8")
+            body = (tile * (options.tile_size // len(tile) + 1))[: options.tile_size]
+            self.send_body(200, body, "application/x-protobuf")
+        elif path == ["v1", "map", "layer"]:
+            self.send_body(200, [{"id": "layer-{}".format(i)} for i in range(5)])
+        elif path[:3] == ["v1", "map", "layer"]:
+            self.send_json_cached({"id": path[-1]})
+        elif path[:2] == ["v1", "map"] and len(path) == 3:
+            features = [feature(i, size) for i in range(options.records)]
+            if query.get("format") == "csv":
+                lines = ["id,index,notes"] + [
+                    "{},{},{}".format(f["id"], i, f["properties"]["notes"])
+                    for (i, f) in enumerate(features)
+                ]
+                self.send_body(200, "\n".join(lines).encode("utf-8"), "text/csv")
+            else:
+                collection = {"type": "FeatureCollection", "features": features}
+                self.send_body(200, collection, "application/geo+json")
+        else:
+            self.send_body(404, {"error": "Not found"})
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients closing keep-alive connections isn't worth a traceback:
+        if not issubclass(sys.exc_info()[0], (IOError, OSError)):
+            HTTPServer.handle_error(self, request, client_address)
+
+
+def start_server(options, port=0):
+    # Starts a server in a background thread. Returns the server,
+    # whose `server_address` gives the port it is listening on:
+    class ConfiguredHandler(Handler):
+        pass
+
+    ConfiguredHandler.options = options
+    server = Server(("127.0.0.1", port), ConfiguredHandler)
+    # (path, Range, Authorization) for each attachment download:
+    server.attachment_requests = []
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Cartographer API server")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port")
+    parser.add_argument("--records", type=int, default=1000)
+    parser.add_argument(
+        "--record-size", type=int, default=500, help="Padding bytes per record"
+    )
+    parser.add_argument("--tile-size", type=int, default=2000, help="Bytes per tile")
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Milliseconds to wait per request"
+    )
+    args = parser.parse_args()
+
+    options = Options(args.records, args.record_size, args.latency, args.tile_size)
+    server = start_server(options, args.port)
+    port = server.server_address[1]
+    sys.stdout.write("Listening on http://127.0.0.1:{}\n".format(port))
+    sys.stdout.flush()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
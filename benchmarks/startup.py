@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+# Startup benchmark for the cartographer CLI.
+#
+# Runs the CLI for --help and for `version` (against the mock server)
+# and checks that:
+#
+# - none of the heavy modules (requests, sqlite3, ...) are imported,
+#   other than any that a bare interpreter already imports and those
+#   the command itself needs (e.g. `requests` for `version`);
+# - the median time over the bare interpreter stays under a threshold
+#   (a higher one for `version`, which loads `requests` and makes a request).
+#
+# Exits with a non-zero status if either check fails, so it can be run
+# as a regression guard:
+#
+#     python benchmarks/startup.py --runs 20 --max-overhead-ms 100
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+script = os.path.join(root, "bin", "cartographer")
+sys.path.insert(0, root)
+
+from benchmarks.bench import setup_home
+from benchmarks.mock_server import Options, start_server
+
+heavy_modules = [
+    "requests",
+    "urllib3",
+    "sqlite3",
+    "zipfile",
+    "multiprocessing",
+    "asyncio",
+    "cartographer.fetch",
+    "cartographer.commands",
+    "cartographer.daemon",
+    "cartographer.mirror",
+    "cartographer.tiles",
+    "cartographer.columnar",
+]
+
+# Each command line, with the modules it needs along with everything
+# they import. Running a command (rather than --help) also loads
+# `cartographer.commands`, but not necessarily what that imports:
+cases = [
+    (["--help"], []),
+    (["version", "--help"], []),
+    (["survey", "search", "--help"], []),
+    (["feature", "tiles", "--help"], []),
+    (["batch", "--help"], []),
+    (["version"], ["cartographer.client"]),
+]
+
+probe = """
+import json
+import sys
+
+(argv, needs, out) = (json.loads(sys.argv[1]), json.loads(sys.argv[2]), sys.argv[3])
+for name in needs:
+    __import__(name)
+if argv is not None:
+    sys.argv = ["cartographer"] + argv
+    import cartographer
+
+    try:
+        cartographer.main()
+    except SystemExit:
+        pass
+
+with open(out, "w") as file:
+    file.write(json.dumps(sorted(sys.modules)))
+"""
+
+
+def environment(home):
+    # A profile for the mock server, without the caller's caches or daemon:
+    env = dict(os.environ)
+    env["HOME"] = home
+    env["CARTOGRAPHER_NO_DAEMON"] = "1"
+    env.pop("XDG_CACHE_HOME", None)
+    env["PYTHONPATH"] = os.pathsep.join([root, env.get("PYTHONPATH", "")])
+    env["PYTHONDONTWRITEBYTECODE"] = ""
+    return env
+
+
+def run_quietly(command, home):
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(command, stdout=devnull, env=environment(home))
+
+
+def imported_modules(home, argv=None, needs=()):
+    # The modules loaded after importing `needs` and running the CLI
+    # with `argv`, or by the bare interpreter if neither is given:
+    (fd, path) = tempfile.mkstemp()
+    os.close(fd)
+    try:
+        command = [sys.executable, "-c", probe, json.dumps(argv), json.dumps(needs)]
+        run_quietly(command + [path], home)
+        with open(path) as file:
+            return json.load(file)
+    finally:
+        os.remove(path)
+
+
+def median_ms(command, runs, home):
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        run_quietly(command, home)
+        times.append((time.time() - start) * 1000.0)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def print_importtime(argv, home, limit=15):
+    if sys.version_info < (3, 7):
+        print("(-X importtime needs Python 3.7+)")
+        return
+    command = [sys.executable, "-X", "importtime", script] + argv
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=environment(home),
+        universal_newlines=True,
+    )
+    (_, stderr) = process.communicate()
+    rows = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            (_, cumulative, name) = line[len("import time:") :].split("|")
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.rstrip()))
+    rows.sort(reverse=True)
+    print("Slowest imports for: cartographer {}".format(" ".join(argv)))
+    for (cumulative, name) in rows[:limit]:
+        print("  {:8.1f} ms {}".format(cumulative / 1000.0, name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup time")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per command")
+    parser.add_argument(
+        "--max-overhead-ms",
+        type=float,
+        default=100.0,
+        help="Maximum median startup time over a bare interpreter",
+    )
+    parser.add_argument(
+        "--max-command-overhead-ms",
+        type=float,
+        default=250.0,
+        help="The same, for commands that make a request",
+    )
+    parser.add_argument(
+        "--importtime",
+        action="store_true",
+        help="Show the slowest imports (Python 3.7+)",
+    )
+    args = parser.parse_args()
+
+    server = start_server(Options(records=10))
+    home = setup_home(server.server_address[1])
+
+    failures = []
+    try:
+        baseline = median_ms([sys.executable, "-c", "pass"], args.runs, home)
+        print("Python startup: {:.1f} ms".format(baseline))
+        # Site startup (e.g. .pth files) can import some of them before we do:
+        preloaded = set(imported_modules(home))
+        already = [name for name in heavy_modules if name in preloaded]
+        if already:
+            print("Already imported by Python: {}".format(", ".join(already)))
+
+        for (argv, needs) in cases:
+            label = "cartographer {}".format(" ".join(argv))
+            expected = preloaded.union(imported_modules(home, needs=needs))
+            if needs:
+                expected.add("cartographer.commands")
+            heavy = [
+                name
+                for name in imported_modules(home, argv)
+                if name in heavy_modules and name not in expected
+            ]
+            command = [sys.executable, script] + argv
+            overhead = median_ms(command, args.runs, home) - baseline
+            limit = args.max_command_overhead_ms if needs else args.max_overhead_ms
+            print("{:40} {:8.1f} ms".format(label, overhead))
+            if heavy:
+                failures.append("{} imports {}".format(label, ", ".join(heavy)))
+            if overhead > limit:
+                failures.append(
+                    "{} takes {:.1f} ms (limit {:.1f} ms)".format(
+                        label, overhead, limit
+                    )
+                )
+
+        if args.importtime:
+            print_importtime(cases[0][0], home)
+    finally:
+        server.shutdown()
+        shutil.rmtree(home)
+
+    for failure in failures:
+        print("FAIL: {}".format(failure))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,461 +1,136 @@
-import requests
-import json
-import functools
-import semver
 import sys
 import os
-import base64
 
-from cartographer.args import read_args
-from cartographer.profile import read_profile
-import cartographer.fetch as fetch
 
+# Library ---------------------------------------
 
-commands = {}
 
+def __getattr__(name):
+    # `cartographer.CartographerClient` is imported on first use, so the CLI
+    # doesn't load `requests` before it needs it. (This needs Python 3.7+;
+    # on older versions use `from cartographer.client import CartographerClient`.)
+    if name == "CartographerClient":
+        from cartographer.client import CartographerClient
 
-def register_command(command, subcommand=None):
-    def wrapped(func):
-        if subcommand is None:
-            commands[command] = func
-        else:
-            if command not in commands:
-                commands[command] = {}
-            commands[command][subcommand] = func
-        return func
-
-    return wrapped
-
-
-# Commands --------------------------------------
-
-
-@register_command("auth", "login")
-def auth_login(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-
-    body = {
-        "email": email,
-        "password": password,
-    }
-
-    url = fetch.create_url(scheme, host, "/v1/auth/login", {})
-    headers = fetch.create_headers()
-    response = fetch.post(url, None, headers, body)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("workspace", "search")
-def workspace_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-
-    url = fetch.create_url(scheme, host, "/v1/workspace", {})
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("workspace", "read")
-def workspace_read(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    workspace = params["workspace"]
-
-    url = fetch.create_url(scheme, host, "/v1/workspace/{}".format(workspace))
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("module", "search")
-def module_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    workspace = params["workspace"]
-    email = params["email"]
-    password = params["password"]
-
-    url = fetch.create_url(scheme, host, "/v1/survey/module", {"workspace": workspace})
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("module", "read")
-def module_read(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    id = params["id"]
+        return CartographerClient
+    raise AttributeError("module 'cartographer' has no attribute '{}'".format(name))
 
-    url = fetch.create_url(scheme, host, "/v1/survey/module/{}".format(id))
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("survey", "search")
-def survey_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    workspace = params["workspace"]
-    module = params["module"]
-    order = params["order"]
-    skip = params["skip"]
-    limit = params["limit"]
-    q = params["query"]
-    format = params["format"]
-
-    url = fetch.create_url(
-        scheme,
-        host,
-        "/v1/survey/{}".format(module),
-        {
-            "workspace": workspace,
-            "q": q,
-            "order": order,
-            "skip": skip,
-            "limit": limit,
-            "format": format,
-        },
-    )
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("survey", "summaries")
-def survey_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    workspace = params["workspace"]
-    module = params["module"]
-    order = params["order"]
-    skip = params["skip"]
-    limit = params["limit"]
-    q = params["query"]
-    format = params["format"]
-
-    url = fetch.create_url(
-        scheme,
-        host,
-        "/v1/survey/{}/summary".format(module),
-        {
-            "workspace": workspace,
-            "q": q,
-            "order": order,
-            "skip": skip,
-            "limit": limit,
-            "format": format,
-        },
-    )
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("survey", "blank")
-def survey_blank(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    module = params["module"]
-    workspace = params["workspace"]
-    format = params["format"]
-
-    url = fetch.create_url(
-        scheme,
-        host,
-        "/v1/survey/{}/blank".format(module),
-        {"format": format, "workspace": workspace},
-    )
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("survey", "read")
-def survey_read(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    module = params["module"]
-    id = params["id"]
-    format = params["format"]
-
-    url = fetch.create_url(
-        scheme, host, "/v1/survey/{}/{}".format(module, id), {"format": format}
-    )
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("user", "search")
-def user_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    workspace = params["workspace"]
-    email = params["email"]
-    password = params["password"]
-    q = params["query"]
-    role = params["role"]
-    order = params["order"]
-    skip = params["skip"]
-    limit = params["limit"]
-
-    url = fetch.create_url(
-        scheme,
-        host,
-        "/v1/user",
-        {
-            "workspace": workspace,
-            "q": q,
-            "role": role,
-            "order": order,
-            "skip": skip,
-            "limit": limit,
-        },
-    )
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("user", "read")
-def user_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    workspace = params["workspace"]
-    email = params["email"]
-    password = params["password"]
-    id = params["id"]
-
-    url = fetch.create_url(scheme, host, "/v1/user/{}".format(id))
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers(workspace)
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("layer", "search")
-def layer_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    workspace = params["workspace"]
-    email = params["email"]
-    password = params["password"]
-
-    url = fetch.create_url(scheme, host, "/v1/map/layer", {"workspace": workspace})
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
-
-@register_command("layer", "read")
-def layer_read(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    layer = params["layer"]
-
-    url = fetch.create_url(scheme, host, "/v1/map/layer/{}".format(layer))
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
 
+# Main ------------------------------------------
 
-@register_command("feature", "search")
-def feature_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    workspace = params["workspace"]
-    email = params["email"]
-    password = params["password"]
-    layer = params["layer"]
-    simplify = params["simplify"]
-    format = params["format"]
+# The commands and their dependencies (e.g. `requests`) are only imported
+# once the arguments have been parsed, so `--help` and usage errors
+# don't pay for them. Commands handed to `cartographer serve` don't even
+# parse their arguments here.
 
-    url = fetch.create_url(
-        scheme,
-        host,
-        "/v1/map/{}".format(layer),
-        {"workspace": workspace, "simplify": simplify, "format": format},
-    )
 
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
+def create_client(params, shared=False):
+    # `shared` is for a client that runs many commands (`cartographer serve`):
+    import cartographer.cache as cache
+    import cartographer.fetch as fetch
 
-    if format is None or format == "geojson" or format == "legacy":
-        return fetch.format_json(response.json())
+    pool_size = params.get("pool_size", None) or 10
+    if params.get("engine", None) == "asyncio":
+        # Tasks are cheap, so --concurrency can be far higher than
+        # the number of connections we want to open to one host:
+        if sys.version_info[0] < 3:
+            sys.exit("--engine asyncio requires Python 3")
     else:
-        return response.content
-
-
-@register_command("feature", "tile")
-def feature_tile(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    workspace = params["workspace"]
-    email = params["email"]
-    password = params["password"]
-    layer = params["layer"]
-    z = params["z"]
-    x = params["x"]
-    y = params["y"]
-    simplify = params["simplify"]
-
-    url = fetch.create_url(
-        scheme,
-        host,
-        "/v1/map/{}/tile/{}/{}/{}".format(layer, z, x, y),
-        {"workspace": workspace, "simplify": simplify},
-    )
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return response.content
-
-
-@register_command("feature", "reset")
-def feature_reset(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    layer = params.get("layer", None)
-
-    if layer:
-        path = "/v1/map/{}/reset".format(layer)
+        pool_size = max(pool_size, params.get("concurrency") or 0)
+
+    if params.get("cache", None):
+        ttl = params.get("cache_ttl", None)
+        size = params.get("cache_size", None)
+        response_cache = cache.ResponseCache(
+            cache.cache_dir("http"),
+            ttl=300 if ttl is None else ttl,
+            max_size=(100 if size is None else size) * 1024 * 1024,
+        )
     else:
-        path = "/v1/map/reset"
-
-    url = fetch.create_url(scheme, host, path, {})
-
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
-
-    return fetch.format_json(response.json())
-
+        response_cache = None
 
-@register_command("attachment", "search")
-def attachment_search(params):
-    scheme = params["scheme"]
-    host = params["host"]
-    email = params["email"]
-    password = params["password"]
-    module = params["module"]
-    survey = params["survey"]
-    folder = params["folder"]
+    memo_size = params.get("memo_size", None)
+    if memo_size is None:
+        # Identical requests are only likely when a run makes many
+        # different ones, so other commands don't share responses:
+        many = params.get("command", None) == "batch" or params.get("all_workspaces")
+        memo_size = 32 if shared or many else 0
 
-    url = fetch.create_url(
-        scheme,
-        host,
-        "/v1/attachment",
-        {"module": module, "survey": survey, "folder": folder},
+    if params.get("token_cache", None) and not params.get("no_token_cache", None):
+        tokens = cache.TokenStore(cache.cache_dir("tokens.json"))
+    else:
+        tokens = None
+
+    return fetch.Client(
+        pool_size=pool_size,
+        keep_alive=params.get("keep_alive", True) and not params.get("no_keep_alive"),
+        connect_timeout=params.get("connect_timeout", None),
+        read_timeout=params.get("read_timeout", None),
+        cache=response_cache,
+        tokens=tokens,
+        profile=params.get("profile", None),
+        retries=params.get("retries", None),
+        rate_limit=params.get("rate_limit", None),
+        memo_size=memo_size * 1024 * 1024,
+        compression=params.get("compression", True)
+        and not params.get("no_compression", None),
+        gzip_uploads=params.get("gzip_uploads", None),
     )
 
-    auth = fetch.basic_auth(email, password)
-    headers = fetch.create_headers()
-    response = fetch.get(url, auth, headers)
 
-    return fetch.format_json(response.json())
+def write_output(data):
+    if not isinstance(data, bytes):
+        data = data.encode("utf-8")
+    while data:
+        data = data[os.write(sys.stdout.fileno(), data) :]
 
 
-@register_command("version")
-def version(params):
-    scheme = params["scheme"]
-    host = params["host"]
+def run(params, write=write_output):
+    # Runs the command in `params` with the current `fetch` client,
+    # passing its output to `write`:
+    import cartographer.commands as commands
 
-    url = fetch.create_url(scheme, host, "/v1/version")
-    headers = {}
-    response = fetch.get(url, None, headers)
+    if params.get("trace", None):
+        import cartographer.trace as trace
 
-    return fetch.format_json(response.json())
+        recorder = trace.start(params["trace"])
+    else:
+        recorder = None
 
+    try:
+        ans = commands.run_command(params)
 
-# Main ------------------------------------------
+        if isinstance(ans, (str, bytes)):
+            write(ans)
+        else:
+            for chunk in ans:
+                write(chunk)
+    finally:
+        if recorder is not None:
+            trace.finish(recorder)
 
 
 def main():
-    args = read_args()
-    profile = read_profile(args["profile"])
-    params = {}
+    # Hand the command to `cartographer serve` if it's running
+    # and $CARTOGRAPHER_DAEMON is set:
+    if os.getenv("CARTOGRAPHER_DAEMON", "") not in ("", "0"):
+        import cartographer.daemon as daemon
 
-    for key in profile:
-        params[key] = profile.get(key, None)
+        if daemon.enabled() and daemon.should_forward(sys.argv[1:]):
+            status = daemon.forward(sys.argv[1:])
+            if status is not None:
+                sys.exit(status)
 
-    for key in args:
-        params[key] = args.get(key, None) or profile.get(key, None)
+    from cartographer.args import read_args
+    from cartographer.profile import build_params, read_profile
 
-    cmd_name = params.get("command", None)
-    sub_name = params.get("subcommand", None)
+    args = read_args()
+    profile = read_profile(args["profile"])
+    params = build_params(args, profile)
 
-    if cmd_name in commands:
-        cmd = commands[cmd_name]
+    import cartographer.fetch as fetch
 
-        if callable(cmd):
-            ans = cmd(params)
-        elif sub_name in cmd:
-            sub = cmd[sub_name]
-            ans = sub(params)
-        else:
-            sys.stderr.write("Command not found: {} {}".format(cmd_name, sub_name))
-
-        os.write(sys.stdout.fileno(), ans)
-    else:
-        sys.stderr.write("Command not found: {} {}".format(cmd_name, sub_name))
+    fetch.set_client(create_client(params))
+    run(params)
 
     return
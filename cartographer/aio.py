@@ -0,0 +1,375 @@
+# An asyncio engine for bulk downloads (`--engine asyncio`).
+#
+# Threads plus blocking `requests` calls get expensive once thousands of
+# requests are in flight, so this module speaks HTTP/1.1 directly over
+# asyncio streams. Requests are still prepared by the `requests` session
+# of the shared `fetch.Client`, so auth, session tokens, default headers,
+# retries and the rate limiter all behave the same as with threads.
+#
+# Python 3 only: nothing imports this module unless --engine asyncio is used.
+
+import asyncio
+import collections
+import concurrent.futures
+import ssl
+import time
+from urllib.parse import urlsplit
+
+import requests
+
+import cartographer.fetch as fetch
+from cartographer.stream import chunk_size
+
+
+class ResponseError(IOError):
+    pass
+
+
+async def within(awaitable, timeout):
+    # Like urllib3's read timeout, `timeout` applies to each read,
+    # so a large body can take as long as it needs while data is arriving:
+    if timeout is None:
+        return await awaitable
+    return await asyncio.wait_for(awaitable, timeout)
+
+
+class Connection(object):
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class Engine(object):
+    # Keeps up to `limit_per_host` keep-alive connections open per host:
+    def __init__(self, client, limit_per_host):
+        self.client = client
+        self.limit_per_host = max(1, limit_per_host or 1)
+        self.idle = collections.defaultdict(list)
+        self.slots = {}
+        self.ssl_context = None
+        self.executor = None
+
+    # Connections -------------------------------
+
+    def origin(self, url):
+        parts = urlsplit(url)
+        default_port = 443 if parts.scheme == "https" else 80
+        return (parts.scheme, parts.hostname, parts.port or default_port)
+
+    def slot(self, origin):
+        if origin not in self.slots:
+            self.slots[origin] = asyncio.Semaphore(self.limit_per_host)
+        return self.slots[origin]
+
+    async def connect(self, origin, phases, reuse=True):
+        if reuse and self.idle[origin]:
+            return self.idle[origin].pop()
+        (scheme, host, port) = origin
+        if scheme == "https":
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context(cafile=fetch.cert)
+            context = self.ssl_context
+        else:
+            context = None
+        (connect_timeout, read_timeout) = self.client.timeout
+        start = time.time()
+        (reader, writer) = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context), connect_timeout
+        )
+        # For tracing. This covers DNS, TCP and TLS:
+        phases["connect"] = time.time() - start
+        return Connection(reader, writer)
+
+    async def close(self):
+        for connections in self.idle.values():
+            for connection in connections:
+                connection.close()
+        self.idle.clear()
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+    async def log_in(self, auth):
+        # Logging in is a blocking `requests` call, so it runs on a thread
+        # instead of stalling every request in flight:
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(1)
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, auth.current_token)
+
+    # HTTP --------------------------------------
+
+    async def exchange(self, connection, prepared, phases, timeout):
+        parts = urlsplit(prepared.url)
+        target = parts.path or "/"
+        if parts.query:
+            target += "?" + parts.query
+
+        headers = dict(prepared.headers)
+        headers["Host"] = parts.netloc
+        body = prepared.body or b""
+        if not isinstance(body, bytes):
+            body = body.encode("utf-8")
+        if body or prepared.method in ("POST", "PUT"):
+            headers["Content-Length"] = str(len(body))
+
+        lines = ["{} {} HTTP/1.1".format(prepared.method, target)]
+        lines.extend("{}: {}".format(key, val) for (key, val) in headers.items())
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        start = time.time()
+        connection.writer.write(head + body)
+        await within(connection.writer.drain(), timeout)
+
+        reader = connection.reader
+        status_line = await within(reader.readline(), timeout)
+        if not status_line:
+            raise ResponseError("Connection closed by server")
+        (version, status, reason) = (
+            status_line.decode("latin-1").rstrip("\r\n") + " "
+        ).split(" ", 2)
+
+        response_headers = requests.structures.CaseInsensitiveDict()
+        while True:
+            line = await within(reader.readline(), timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            (key, val) = line.decode("latin-1").split(":", 1)
+            key = key.strip()
+            val = val.strip()
+            if key in response_headers:
+                val = response_headers[key] + ", " + val
+            response_headers[key] = val
+
+        headers_received = time.time()
+        phases["wait"] = headers_received - start
+
+        status = int(status)
+        keep_alive = version == "HTTP/1.1" and (
+            response_headers.get("Connection", "").lower() != "close"
+        )
+        # Compressed bodies are decompressed a chunk at a time as they arrive:
+        decoder = fetch.content_decoder(response_headers.get("Content-Encoding"))
+        chunks = []
+        wire_size = 0
+
+        def take(data):
+            nonlocal wire_size
+            wire_size += len(data)
+            chunks.append(decoder.decompress(data) if decoder else data)
+
+        if prepared.method == "HEAD" or status in (204, 304) or status < 200:
+            pass
+        elif response_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            while True:
+                line = await within(reader.readline(), timeout)
+                size = int(line.split(b";")[0].strip(), 16)
+                if size == 0:
+                    while True:
+                        line = await within(reader.readline(), timeout)
+                        if line in (b"\r\n", b"\n", b""):
+                            break
+                    break
+                while size:
+                    data = await within(reader.read(min(size, chunk_size)), timeout)
+                    if not data:
+                        raise asyncio.IncompleteReadError(b"", size)
+                    size -= len(data)
+                    take(data)
+                await within(reader.readexactly(2), timeout)
+        elif "Content-Length" in response_headers:
+            remaining = int(response_headers["Content-Length"])
+            while remaining:
+                data = await within(reader.read(min(remaining, chunk_size)), timeout)
+                if not data:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(data)
+                take(data)
+        else:
+            while True:
+                data = await within(reader.read(chunk_size), timeout)
+                if not data:
+                    break
+                take(data)
+            keep_alive = False
+        if decoder is not None and wire_size:
+            chunks.append(decoder.flush())
+        content = b"".join(chunks)
+        phases["download"] = time.time() - headers_received
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason.strip()
+        response.headers = response_headers
+        response._content = content
+        response.wire_size = wire_size
+        response.url = prepared.url
+        response.request = prepared
+        response.encoding = requests.utils.get_encoding_from_headers(response_headers)
+        return (response, keep_alive)
+
+    async def send(self, prepared, phases):
+        origin = self.origin(prepared.url)
+        (connect_timeout, read_timeout) = self.client.timeout
+        async with self.slot(origin):
+            # A pooled connection may have been closed by the server
+            # while it was idle, so try a new one (not another pooled one,
+            # which may be just as stale) if the first fails:
+            for fresh in (False, True):
+                reused = bool(self.idle[origin]) and not fresh
+                connection = await self.connect(origin, phases, reuse=not fresh)
+                try:
+                    (response, keep_alive) = await self.exchange(
+                        connection, prepared, phases, read_timeout
+                    )
+                except (OSError, EOFError, ResponseError, asyncio.IncompleteReadError):
+                    connection.close()
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    connection.close()
+                    raise
+                if keep_alive:
+                    self.idle[origin].append(connection)
+                else:
+                    connection.close()
+                return response
+
+    async def request(self, method, url, auth, headers, data=None):
+        # The asyncio counterpart of `fetch.Client.send`: retries and
+        # rate limiting as described there, returning unchecked responses:
+        client = self.client
+        trace = fetch.request_trace(method, url, data, False)
+        idempotent = method in fetch.idempotent_methods
+        retry = 0
+        relogged = False
+        while True:
+            wait = client.limiter.reserve()
+            while wait > 0:
+                trace.wait("throttle", wait)
+                await asyncio.sleep(wait)
+                wait = client.limiter.reserve()
+
+            if isinstance(auth, fetch.SessionAuth) and auth.needs_login():
+                await self.log_in(auth)
+            # Nothing else runs until we've prepared the request,
+            # so its token can't have expired in between:
+            prepared = client.session.prepare_request(
+                requests.Request(method, url, headers=headers, auth=auth, data=data)
+            )
+            phases = {}
+            start = time.time()
+            try:
+                response = await self.send(prepared, phases)
+            except (
+                OSError,
+                EOFError,
+                ResponseError,
+                asyncio.IncompleteReadError,
+                asyncio.TimeoutError,
+            ) as error:
+                trace.record(phases, time.time() - start)
+                if not idempotent or retry >= client.retries:
+                    trace.finish(retry, error=error)
+                    raise requests.ConnectionError(error, request=prepared)
+                delay = fetch.backoff(retry)
+                trace.wait("backoff", delay)
+                await asyncio.sleep(delay)
+                retry += 1
+                continue
+            trace.record(phases, time.time() - start)
+
+            if response.status_code == 401 and isinstance(auth, fetch.SessionAuth):
+                if not relogged and auth.expire(prepared):
+                    relogged = True
+                    continue
+
+            status = response.status_code
+            if (
+                retry >= client.retries
+                or status not in fetch.retry_statuses
+                or not (idempotent or status in fetch.unprocessed_statuses)
+            ):
+                trace.finish(retry, response)
+                return response
+
+            delay = fetch.retry_after(response)
+            if delay is None:
+                delay = fetch.backoff(retry)
+            if status == 429:
+                client.limiter.pause(delay)
+            trace.wait("backoff", delay)
+            await asyncio.sleep(delay)
+            retry += 1
+
+
+# Bridging to synchronous code ==================
+
+
+def imap_get(url_for, items, auth, headers, concurrency, ordered=False, client=None):
+    # Fetches `url_for(item)` for each item with up to `concurrency` requests
+    # in flight, yielding `(item, response)` pairs as they complete (or in
+    # input order if `ordered`). Responses are not checked for HTTP errors.
+    # Like `workers.imap_ordered`, `items` is only read as fast as we need it.
+    # Closing the generator (or Ctrl-C) cancels any requests still running:
+    concurrency = max(1, concurrency or 1)
+    client = client or fetch.get_client()
+    loop = asyncio.new_event_loop()
+    engine = Engine(client, client.pool_size)
+    items = iter(items)
+    # Tasks in flight, in the order they started (dicts keep insertion order):
+    pending = {}
+    # When unordered, finished tasks and a future to wake us when the next
+    # one finishes (calling `asyncio.wait` on everything would be quadratic):
+    completed = collections.deque()
+    wakeup = []
+
+    async def fetch_item(item):
+        response = await engine.request("GET", url_for(item), auth, headers)
+        return (item, response)
+
+    def finished(task):
+        if not ordered:
+            completed.append(task)
+        while wakeup:
+            future = wakeup.pop()
+            if not future.done():
+                future.set_result(None)
+
+    def start_next():
+        for item in items:
+            task = loop.create_task(fetch_item(item))
+            task.add_done_callback(finished)
+            pending[task] = item
+            return True
+        return False
+
+    try:
+        while len(pending) < concurrency and start_next():
+            pass
+
+        while pending:
+            if ordered:
+                task = next(iter(pending))
+                if not task.done():
+                    loop.run_until_complete(task)
+            else:
+                if not completed:
+                    wakeup.append(loop.create_future())
+                    loop.run_until_complete(wakeup[-1])
+                task = completed.popleft()
+
+            del pending[task]
+            start_next()
+            yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            loop.run_until_complete(
+                asyncio.gather(*list(pending), return_exceptions=True)
+            )
+        loop.run_until_complete(engine.close())
+        loop.close()
@@ -1,317 +1,952 @@
 import argparse
+import sys
 
-parser = argparse.ArgumentParser(prog="cartographer")
 
+class GlobalParser(argparse.ArgumentParser):
+    # Raises ValueError rather than exiting if the arguments are invalid:
+    def error(self, message):
+        raise ValueError(message)
 
-def read_args():
-    return vars(parser.parse_args())
+
+# The options that go before the command. `parser` (below) reads them along
+# with the command, and `command_parser` on their own:
+global_parser = argparse.ArgumentParser(prog="cartographer", add_help=False)
+
+
+def read_args(argv=None, defaults=None):
+    # `defaults` (e.g. the global options of a batch) are used for
+    # any options that `argv` leaves out:
+    if argv is None:
+        argv = sys.argv[1:]
+    argv = trace_to_stderr(argv)
+    build_group(command_name(argv))
+    namespace = argparse.Namespace(**defaults) if defaults else None
+    return vars(parser.parse_args(argv, namespace))
+
+
+def global_options():
+    # The names of the options that go before the command:
+    return [action.dest for action in global_parser._actions]
+
+
+def trace_to_stderr(argv):
+    # `--trace survey search ...` means trace to stderr,
+    # not to a file called "survey":
+    argv = list(argv)
+    for (index, arg) in enumerate(argv[:-1]):
+        if arg == "--trace" and argv[index + 1] in group_names():
+            argv[index] = "--trace=-"
+    return argv
 
 
 # Global options ================================
 
-parser.add_argument(
+global_parser.add_argument(
     "-p", "--profile", help="The configuration profile to use", default="default"
 )
 
-parser.add_argument(
+global_parser.add_argument(
     "-U",
     "--email",
     "--username",
     help="The username or email address to use to authenticate with",
 )
 
-parser.add_argument("-P", "--password", help="The password to use to authenticate")
+global_parser.add_argument(
+    "-P", "--password", help="The password to use to authenticate"
+)
 
-parsers = parser.add_subparsers(dest="command")
+global_parser.add_argument(
+    "--pool-size",
+    type=int,
+    help="Maximum number of pooled connections to keep open per host",
+)
 
+global_parser.add_argument(
+    "--connect-timeout", type=float, help="Seconds to wait when opening a connection"
+)
 
-# Auth ==========================================
+global_parser.add_argument(
+    "--read-timeout", type=float, help="Seconds to wait for the server to respond"
+)
 
-auth_parsers = parsers.add_parser(
-    "auth", help="Commands related to authentication"
-).add_subparsers(dest="subcommand")
+global_parser.add_argument(
+    "--no-keep-alive",
+    help="Close the connection after every request",
+    action="store_true",
+)
 
-# Auth login ------------------------------------
+global_parser.add_argument(
+    "--cache",
+    help="Cache read-only responses (workspaces, modules, layers, blank surveys)",
+    action="store_true",
+)
 
-auth_login = auth_parsers.add_parser(
-    "login", help="Log in and retrieve a session token"
+global_parser.add_argument(
+    "--cache-ttl",
+    type=float,
+    help="Seconds to use cached responses before revalidating them (default 300)",
 )
 
+global_parser.add_argument(
+    "--cache-size", type=int, help="Maximum size of the response cache in MB"
+)
 
-# Workspaces ====================================
+global_parser.add_argument(
+    "--memo-size",
+    type=int,
+    help="MB of responses to share between identical requests in one run"
+    " (default 32 for batch, --all-workspaces and serve, otherwise 0)",
+)
 
-workspace_parsers = parsers.add_parser(
-    "workspace", help="Commands related to workspaces"
-).add_subparsers(dest="subcommand")
+global_parser.add_argument(
+    "--no-token-cache",
+    help="Send the email and password with every request instead of logging in once",
+    action="store_true",
+)
 
-# Workspace search ------------------------------
+global_parser.add_argument(
+    "--no-compression",
+    help="Ask the server not to compress responses (e.g. when they're already small)",
+    action="store_true",
+)
 
-workspace_search = workspace_parsers.add_parser(
-    "search", help="Search the workspaces on the API server"
+global_parser.add_argument(
+    "--gzip-uploads",
+    type=int,
+    metavar="BYTES",
+    help="Gzip request bodies of at least BYTES (off by default,"
+    " as the server has to support it)",
 )
 
-# Workspace read --------------------------------
+global_parser.add_argument(
+    "--retries",
+    type=int,
+    help="Times to retry throttled, failed or dropped requests (default 0)",
+)
 
-workspace_read = workspace_parsers.add_parser(
-    "read", help="Read data on a specific workspace"
+global_parser.add_argument(
+    "--rate-limit",
+    type=float,
+    help="Maximum requests per second, shared by all concurrent downloads",
 )
 
-workspace_read.add_argument(
-    "workspace", help="The ID or subdomain of the workspace to read"
+global_parser.add_argument(
+    "--engine",
+    help="How bulk commands (feature tiles, paged searches) run requests at once:"
+    " a pool of threads, or asyncio for thousands in flight (Python 3 only)",
+    choices=["threads", "asyncio"],
 )
 
+global_parser.add_argument(
+    "--pretty",
+    help="Indent JSON output (otherwise responses are written as the server sent them)",
+    action="store_true",
+)
 
-# Modules =======================================
+global_parser.add_argument(
+    "--trace",
+    help="Write timings for every request as lines of JSON to FILE"
+    " (or stderr), with a summary at the end",
+    nargs="?",
+    const="-",
+    metavar="FILE",
+)
 
-module_parsers = parsers.add_parser(
-    "module", help="Commands related to module data"
-).add_subparsers(dest="subcommand")
+global_parser.add_argument(
+    "--no-daemon",
+    help="Run the command in this process even if `cartographer serve` is running",
+    action="store_true",
+)
 
-# Module search ---------------------------------
+parser = argparse.ArgumentParser(prog="cartographer", parents=[global_parser])
 
-module_search = module_parsers.add_parser(
-    "search", help="Search modules in a particular workspace/module"
+# Like the subcommands in `parser`, everything from the command on is left
+# for the command, even if it looks like a global option:
+command_parser = GlobalParser(
+    prog="cartographer", add_help=False, parents=[global_parser]
 )
+command_parser.add_argument("argv", nargs=argparse.REMAINDER)
 
-module_search.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+parsers = parser.add_subparsers(dest="command")
+
+
+# Shared arguments ==============================
+
+
+def add_all_workspaces_arguments(search):
+    search.add_argument(
+        "--all-workspaces",
+        help="Run the search in every workspace, writing NDJSON tagged by workspace",
+        action="store_true",
+    )
+
+    search.add_argument(
+        "--workspace-concurrency",
+        type=int,
+        help="Number of workspaces to search at once when using --all-workspaces",
+    )
+
+    search.add_argument(
+        "--ordered",
+        help="With --all-workspaces, write workspaces in the order they are listed"
+        " rather than as they finish",
+        action="store_true",
+    )
+
+
+# Auth ==========================================
+
+
+def add_auth_parsers(auth_parser):
+    auth_parsers = auth_parser.add_subparsers(dest="subcommand")
+
+    # Auth login ------------------------------------
+
+    auth_login = auth_parsers.add_parser(
+        "login", help="Log in and retrieve a session token"
+    )
+
+
+# Workspaces ====================================
 
-# Module read -----------------------------------
 
-module_read = module_parsers.add_parser("read", help="Read data on a specific module")
+def add_workspace_parsers(workspace_parser):
+    workspace_parsers = workspace_parser.add_subparsers(dest="subcommand")
 
-module_read.add_argument("id", help="The ID of the module to read")
+    # Workspace search ------------------------------
+
+    workspace_search = workspace_parsers.add_parser(
+        "search", help="Search the workspaces on the API server"
+    )
+
+    # Workspace read --------------------------------
+
+    workspace_read = workspace_parsers.add_parser(
+        "read", help="Read data on a specific workspace"
+    )
+
+    workspace_read.add_argument(
+        "workspace", help="The ID or subdomain of the workspace to read"
+    )
+
+
+# Modules =======================================
+
+
+def add_module_parsers(module_parser):
+    module_parsers = module_parser.add_subparsers(dest="subcommand")
+
+    # Module search ---------------------------------
+
+    module_search = module_parsers.add_parser(
+        "search", help="Search modules in a particular workspace/module"
+    )
+
+    module_search.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    add_all_workspaces_arguments(module_search)
+
+    # Module read -----------------------------------
+
+    module_read = module_parsers.add_parser(
+        "read", help="Read data on a specific module"
+    )
+
+    module_read.add_argument("id", help="The ID of the module to read")
 
 
 # Surveys =======================================
 
-survey_parsers = parsers.add_parser(
-    "survey", help="Commands related to survey data"
-).add_subparsers(dest="subcommand")
 
-# Survey search ---------------------------------
+def add_survey_parsers(survey_parser):
+    survey_parsers = survey_parser.add_subparsers(dest="subcommand")
 
-survey_search = survey_parsers.add_parser(
-    "search", help="Search surveys in a particular workspace/module"
-)
+    # Survey search ---------------------------------
 
-survey_search.add_argument("module", help="The module to search")
+    survey_search = survey_parsers.add_parser(
+        "search", help="Search surveys in a particular workspace/module"
+    )
 
-survey_search.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+    survey_search.add_argument("module", help="The module to search")
 
-survey_search.add_argument("-q", "--query", help="Search string")
+    survey_search.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
 
-survey_search.add_argument("-o", "--order", help="Result order")
+    add_all_workspaces_arguments(survey_search)
 
-survey_search.add_argument("--skip", type=int, help="Skip the first N results")
+    survey_search.add_argument("-q", "--query", help="Search string")
 
-survey_search.add_argument(
-    "--limit", type=int, help="Fetch the first N results (after skip count)"
-)
+    survey_search.add_argument("-o", "--order", help="Result order")
 
-survey_search.add_argument(
-    "--format", default=None, help='Set to "legacy" to receive old-style survey JSON'
-)
+    survey_search.add_argument("--skip", type=int, help="Skip the first N results")
 
-# Survey summaries ---------------------------------
+    survey_search.add_argument(
+        "--limit", type=int, help="Fetch the first N results (after skip count)"
+    )
 
-survey_summaries = survey_parsers.add_parser(
-    "summaries", help="Search surveys in a particular workspace/module"
-)
+    survey_search.add_argument(
+        "--format",
+        default=None,
+        help='Set to "legacy" to receive old-style survey JSON',
+    )
 
-survey_summaries.add_argument("module", help="The module to search")
+    survey_search.add_argument(
+        "--all",
+        help="Fetch every page of results (after skip count)",
+        action="store_true",
+    )
 
-survey_summaries.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+    survey_search.add_argument(
+        "--page-size", type=int, help="Number of results per page when using --all"
+    )
 
-survey_summaries.add_argument("-q", "--query", help="Search string")
+    survey_search.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of pages to fetch at once when using --all",
+    )
 
-survey_summaries.add_argument("-o", "--order", help="Result order")
+    survey_search.add_argument(
+        "--output",
+        help="Output format (ndjson writes one record per line as it is downloaded,"
+        " columnar writes a typed column file to --out)",
+        choices=["json", "ndjson", "columnar"],
+        default=None,
+    )
 
-survey_summaries.add_argument("--skip", type=int, help="Skip the first N results")
+    survey_search.add_argument(
+        "--out", help="Write the results to a file instead of stdout", default=None
+    )
 
-survey_summaries.add_argument(
-    "--limit", type=int, help="Fetch the first N results (after skip count)"
-)
+    survey_search.add_argument(
+        "--local",
+        help="Answer from the local mirror instead of the API (see `mirror surveys`)",
+        action="store_true",
+    )
 
-survey_summaries.add_argument(
-    "--format", default=None, help='Set to "legacy" to receive old-style survey JSON'
-)
+    survey_search.add_argument(
+        "--db", help="The mirror database file (default ~/.local/share/cartographer)"
+    )
 
-# Survey blank ----------------------------------
+    # Survey summaries ---------------------------------
 
-survey_blank = survey_parsers.add_parser("blank", help="Get a blank survey")
+    survey_summaries = survey_parsers.add_parser(
+        "summaries", help="Search surveys in a particular workspace/module"
+    )
 
-survey_blank.add_argument("module", help="The survey module")
+    survey_summaries.add_argument("module", help="The module to search")
 
-survey_blank.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+    survey_summaries.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
 
-survey_blank.add_argument(
-    "--format", default=None, help='Set to "legacy" to receive old-style survey JSON'
-)
+    survey_summaries.add_argument("-q", "--query", help="Search string")
 
-# Survey read -----------------------------------
+    survey_summaries.add_argument("-o", "--order", help="Result order")
 
-survey_read = survey_parsers.add_parser("read", help="Read data on a specific survey")
+    survey_summaries.add_argument("--skip", type=int, help="Skip the first N results")
 
-survey_read.add_argument("module", help="The survey module")
+    survey_summaries.add_argument(
+        "--limit", type=int, help="Fetch the first N results (after skip count)"
+    )
 
-survey_read.add_argument("id", help="The ID of the survey to read")
+    survey_summaries.add_argument(
+        "--format",
+        default=None,
+        help='Set to "legacy" to receive old-style survey JSON',
+    )
+
+    survey_summaries.add_argument(
+        "--all",
+        help="Fetch every page of results (after skip count)",
+        action="store_true",
+    )
+
+    survey_summaries.add_argument(
+        "--page-size", type=int, help="Number of results per page when using --all"
+    )
+
+    survey_summaries.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of pages to fetch at once when using --all",
+    )
+
+    survey_summaries.add_argument(
+        "--output",
+        help="Output format (ndjson writes one record per line as it is downloaded,"
+        " columnar writes a typed column file to --out)",
+        choices=["json", "ndjson", "columnar"],
+        default=None,
+    )
+
+    survey_summaries.add_argument(
+        "--out", help="Write the results to a file instead of stdout", default=None
+    )
+
+    # Survey blank ----------------------------------
+
+    survey_blank = survey_parsers.add_parser("blank", help="Get a blank survey")
+
+    survey_blank.add_argument("module", help="The survey module")
+
+    survey_blank.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    survey_blank.add_argument(
+        "--format",
+        default=None,
+        help='Set to "legacy" to receive old-style survey JSON',
+    )
+
+    # Survey read -----------------------------------
+
+    survey_read = survey_parsers.add_parser(
+        "read", help="Read data on a specific survey"
+    )
+
+    survey_read.add_argument("module", help="The survey module")
+
+    survey_read.add_argument("id", help="The ID of the survey to read")
+
+    survey_read.add_argument(
+        "--format",
+        default=None,
+        help='Set to "legacy" to receive old-style survey JSON',
+    )
 
-survey_read.add_argument(
-    "--format", default=None, help='Set to "legacy" to receive old-style survey JSON'
-)
 
 # Users =========================================
 
-user_parsers = parsers.add_parser(
-    "user", help="Commands related to user data"
-).add_subparsers(dest="subcommand")
 
-# User search -----------------------------------
+def add_user_parsers(user_parser):
+    user_parsers = user_parser.add_subparsers(dest="subcommand")
 
-user_search = user_parsers.add_parser(
-    "search", help="Search users in a particular workspace/module"
-)
+    # User search -----------------------------------
 
-user_search.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+    user_search = user_parsers.add_parser(
+        "search", help="Search users in a particular workspace/module"
+    )
 
-user_search.add_argument("-q", "--query", help="Search string")
+    user_search.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
 
-user_search.add_argument("-r", "--role", help="Search for users with a particular role")
+    add_all_workspaces_arguments(user_search)
 
-user_search.add_argument("-o", "--order", help="Result order")
+    user_search.add_argument("-q", "--query", help="Search string")
 
-user_search.add_argument("--skip", type=int, help="Skip the first N results")
+    user_search.add_argument(
+        "-r", "--role", help="Search for users with a particular role"
+    )
 
-user_search.add_argument(
-    "--limit", type=int, help="Fetch the first N results (after skip count)"
-)
+    user_search.add_argument("-o", "--order", help="Result order")
 
-# User read -------------------------------------
+    user_search.add_argument("--skip", type=int, help="Skip the first N results")
 
-user_read = user_parsers.add_parser("read", help="Read data on a specific user")
+    user_search.add_argument(
+        "--limit", type=int, help="Fetch the first N results (after skip count)"
+    )
 
-user_read.add_argument(
-    "-w",
-    "--workspace",
-    help='Workspace name, or "*" to search all workspaces',
-    default="*",
-)
+    user_search.add_argument(
+        "--output",
+        help="Output format (ndjson writes one record per line as it is downloaded)",
+        choices=["json", "ndjson"],
+        default=None,
+    )
+
+    user_search.add_argument(
+        "--local",
+        help="Answer from the local mirror instead of the API (see `mirror users`)",
+        action="store_true",
+    )
+
+    user_search.add_argument(
+        "--db", help="The mirror database file (default ~/.local/share/cartographer)"
+    )
 
-user_read.add_argument("id", help="The ID of the user to read")
+    # User read -------------------------------------
+
+    user_read = user_parsers.add_parser("read", help="Read data on a specific user")
+
+    user_read.add_argument(
+        "-w",
+        "--workspace",
+        help='Workspace name, or "*" to search all workspaces',
+        default="*",
+    )
+
+    user_read.add_argument("id", help="The ID of the user to read")
 
 
 # Map layers ======================================
 
-layer_parsers = parsers.add_parser(
-    "layer", help="Commands related to map layer metadata"
-).add_subparsers(dest="subcommand")
 
-# Map layer search --------------------------------
+def add_layer_parsers(layer_parser):
+    layer_parsers = layer_parser.add_subparsers(dest="subcommand")
 
-layer_search = layer_parsers.add_parser(
-    "search", help="Search users in a particular workspace/module"
-)
+    # Map layer search --------------------------------
 
-layer_search.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+    layer_search = layer_parsers.add_parser(
+        "search", help="Search users in a particular workspace/module"
+    )
 
-# Map layer read ---------------------------------
+    layer_search.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
 
-layer_read = layer_parsers.add_parser("read", help="Read map layer")
+    add_all_workspaces_arguments(layer_search)
+
+    layer_search.add_argument(
+        "--output",
+        help="Output format (ndjson writes one record per line as it is downloaded)",
+        choices=["json", "ndjson"],
+        default=None,
+    )
+
+    layer_search.add_argument(
+        "--out", help="Write the results to a file instead of stdout", default=None
+    )
+
+    # Map layer read ---------------------------------
+
+    layer_read = layer_parsers.add_parser("read", help="Read map layer")
+
+    layer_read.add_argument("layer", help="The layer ID")
 
-layer_read.add_argument("layer", help="The layer ID")
 
 # Features ======================================
 
-feature_parsers = parsers.add_parser(
-    "feature", help="Commands related to feature data"
-).add_subparsers(dest="subcommand")
 
-# Feature search --------------------------------
+def add_feature_parsers(feature_parser):
+    feature_parsers = feature_parser.add_subparsers(dest="subcommand")
 
-feature_search = feature_parsers.add_parser(
-    "search", help="Search users in a particular workspace/module"
-)
+    # Feature search --------------------------------
 
-feature_search.add_argument("layer", help="The layer to search")
+    feature_search = feature_parsers.add_parser(
+        "search", help="Search users in a particular workspace/module"
+    )
 
-feature_search.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+    feature_search.add_argument("layer", help="The layer to search")
 
-feature_search.add_argument(
-    "-s", "--simplify", help="Simplify geometry", action="store_true"
-)
+    feature_search.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
 
+    feature_search.add_argument(
+        "-s", "--simplify", help="Simplify geometry", action="store_true"
+    )
 
-feature_search.add_argument(
-    "-f",
-    "--format",
-    help="Response format (defaults to geojson)",
-    choices=["geojson", "kml", "csv", "legacy"],
-    default=None,
-)
+    feature_search.add_argument(
+        "-f",
+        "--format",
+        help="Response format (defaults to geojson)",
+        choices=["geojson", "kml", "csv", "legacy"],
+        default=None,
+    )
 
-# Feature tile ----------------------------------
+    feature_search.add_argument(
+        "--out", help="Write the results to a file instead of stdout", default=None
+    )
 
-feature_tile = feature_parsers.add_parser(
-    "tile", help="tile users in a particular workspace/module"
-)
+    feature_search.add_argument(
+        "--output",
+        help="Output format (ndjson writes one record per line as it is downloaded,"
+        " columnar writes a typed column file to --out)",
+        choices=["json", "ndjson", "columnar"],
+        default=None,
+    )
 
-feature_tile.add_argument("layer", help="The layer to tile")
-feature_tile.add_argument("z", help="The zoom")
-feature_tile.add_argument("x", help="The x position of the tile")
-feature_tile.add_argument("y", help="The y position of the tile")
+    feature_search.add_argument(
+        "--local",
+        help="Answer from the local mirror instead of the API (see `mirror features`)",
+        action="store_true",
+    )
 
-feature_tile.add_argument(
-    "-w", "--workspace", help="Workspace ID or subdomain", default=None
-)
+    feature_search.add_argument(
+        "--db", help="The mirror database file (default ~/.local/share/cartographer)"
+    )
 
-feature_tile.add_argument(
-    "-s", "--simplify", help="Simplify geometry", action="store_true"
-)
+    # Feature query ---------------------------------
 
+    feature_query = feature_parsers.add_parser(
+        "query",
+        help="Find the features in a bounding box or at a point, using a local index",
+    )
 
-# Feature reset ---------------------------------
+    feature_query.add_argument("layer", help="The layer to query")
+
+    feature_query.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    feature_query_area = feature_query.add_mutually_exclusive_group(required=True)
 
-feature_reset = feature_parsers.add_parser(
-    "reset", help="Reset (recalculate) feature data"
-)
+    feature_query_area.add_argument(
+        "-b",
+        "--bbox",
+        help="Find features intersecting WEST,SOUTH,EAST,NORTH (in degrees)",
+    )
+
+    feature_query_area.add_argument(
+        "--point", help="Find features containing LONGITUDE,LATITUDE (in degrees)"
+    )
+
+    feature_query.add_argument(
+        "--no-refresh",
+        help="Use the indexed copy of the layer without checking for changes",
+        action="store_true",
+    )
+
+    feature_query.add_argument(
+        "--output",
+        help="Output format (ndjson writes one feature per line,"
+        " columnar writes a typed column file to --out)",
+        choices=["json", "ndjson", "columnar"],
+        default=None,
+    )
+
+    feature_query.add_argument(
+        "--out", help="Write the results to a file instead of stdout", default=None
+    )
+
+    feature_query.add_argument(
+        "--db", help="The index database file (default ~/.local/share/cartographer)"
+    )
+
+    # Feature tile ----------------------------------
+
+    feature_tile = feature_parsers.add_parser(
+        "tile", help="tile users in a particular workspace/module"
+    )
+
+    feature_tile.add_argument("layer", help="The layer to tile")
+    feature_tile.add_argument("z", help="The zoom")
+    feature_tile.add_argument("x", help="The x position of the tile")
+    feature_tile.add_argument("y", help="The y position of the tile")
+
+    feature_tile.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    feature_tile.add_argument(
+        "-s", "--simplify", help="Simplify geometry", action="store_true"
+    )
+
+    feature_tile.add_argument(
+        "--out", help="Write the tile to a file instead of stdout", default=None
+    )
+
+    # Feature tiles ---------------------------------
+
+    feature_tiles = feature_parsers.add_parser(
+        "tiles", help="Download every tile of a layer within a bounding box"
+    )
+
+    feature_tiles.add_argument("layer", help="The layer to tile")
+
+    feature_tiles.add_argument(
+        "-b",
+        "--bbox",
+        help="Bounding box to download, as WEST,SOUTH,EAST,NORTH in degrees",
+        required=True,
+    )
+
+    feature_tiles.add_argument(
+        "--min-zoom", type=int, help="The lowest zoom to download (default 0)"
+    )
+
+    feature_tiles.add_argument(
+        "--max-zoom", type=int, help="The highest zoom to download", required=True
+    )
+
+    feature_tiles.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    feature_tiles.add_argument(
+        "-s", "--simplify", help="Simplify geometry", action="store_true"
+    )
+
+    feature_tiles.add_argument(
+        "--extension",
+        help="File extension for tiles (defaults to one based on the content type)",
+    )
+
+    feature_tiles.add_argument(
+        "--concurrency",
+        type=int,
+        help="Number of tiles to download at once (default 8)",
+    )
+
+    feature_tiles_output = feature_tiles.add_mutually_exclusive_group(required=True)
+
+    feature_tiles_output.add_argument(
+        "-d", "--directory", help="Write tiles to a Z/X/Y directory tree"
+    )
+
+    feature_tiles_output.add_argument(
+        "-a", "--archive", help="Write tiles to a single zip archive"
+    )
+
+    feature_tiles_output.add_argument(
+        "-m",
+        "--mbtiles",
+        help="Write tiles to an MBTiles (SQLite) file, storing identical tiles once",
+    )
+
+    # Feature reset ---------------------------------
 
-feature_reset.add_argument("-l", "--layer", help="The layer to reset", default=None)
+    feature_reset = feature_parsers.add_parser(
+        "reset", help="Reset (recalculate) feature data"
+    )
+
+    feature_reset.add_argument("-l", "--layer", help="The layer to reset", default=None)
 
 
 # Attachments ===================================
 
-attachment_parsers = parsers.add_parser(
-    "attachment", help="Commands related to attachmented files"
-).add_subparsers(dest="subcommand")
 
-# attachment search ---------------------------------
+def add_attachment_parsers(attachment_parser):
+    attachment_parsers = attachment_parser.add_subparsers(dest="subcommand")
+
+    # attachment search ---------------------------------
+
+    attachment_search = attachment_parsers.add_parser(
+        "search", help="Search attachments in a particular survey"
+    )
+
+    attachment_search.add_argument("module", help="The survey module")
+
+    attachment_search.add_argument("survey", help="The survey")
+
+    attachment_search.add_argument("-f", "--folder", help="Optional folder to search")
+
+    # attachment download -------------------------------
+
+    attachment_download = attachment_parsers.add_parser(
+        "download", help="Download the attachments for every survey in a module"
+    )
+
+    attachment_download.add_argument("module", help="The survey module")
+
+    attachment_download.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    attachment_download.add_argument(
+        "--surveys",
+        help='Only these surveys: output from `survey search`, or "-" for stdin',
+    )
+
+    attachment_download.add_argument(
+        "-f", "--folder", help="Optional folder to download"
+    )
+
+    attachment_download.add_argument(
+        "-d", "--out", help="Directory to download to (default .)", default=None
+    )
+
+    attachment_download.add_argument(
+        "--concurrency", type=int, help="Number of files to download at once"
+    )
+
+
+# Mirror ========================================
+
+
+def add_mirror_parsers(mirror_parser):
+    mirror_parsers = mirror_parser.add_subparsers(dest="subcommand")
+
+    # Mirror surveys --------------------------------
+
+    mirror_surveys = mirror_parsers.add_parser(
+        "surveys", help="Copy new and updated surveys into a local SQLite database"
+    )
+
+    mirror_surveys.add_argument("module", help="The module to mirror")
+
+    mirror_surveys.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    mirror_surveys.add_argument(
+        "--db", help="The database file (default ~/.local/share/cartographer)"
+    )
+
+    mirror_surveys.add_argument(
+        "-o",
+        "--order",
+        help="A result order listing recently updated surveys first"
+        ' (e.g. "updated-desc"). With any other, every survey is fetched'
+        " on each run",
+    )
+
+    mirror_surveys.add_argument(
+        "--timestamp-field",
+        help='Field holding the last-updated time (default "updated")',
+    )
+
+    mirror_surveys.add_argument(
+        "--id-field", help='Field holding the survey ID (default "id")'
+    )
+
+    mirror_surveys.add_argument(
+        "--full", help="Fetch every survey, ignoring the last sync", action="store_true"
+    )
+
+    mirror_surveys.add_argument(
+        "--page-size", type=int, help="Number of surveys to fetch per request"
+    )
+
+    mirror_surveys.add_argument(
+        "--concurrency", type=int, help="Number of pages to fetch at once"
+    )
+
+    mirror_surveys.add_argument(
+        "--format",
+        default=None,
+        help='Set to "legacy" to receive old-style survey JSON',
+    )
+
+    # Mirror users ----------------------------------
+
+    mirror_users = mirror_parsers.add_parser(
+        "users", help="Copy a workspace's users into a local SQLite database"
+    )
+
+    mirror_users.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    mirror_users.add_argument(
+        "--db", help="The database file (default ~/.local/share/cartographer)"
+    )
+
+    mirror_users.add_argument(
+        "--page-size", type=int, help="Number of users to fetch per request"
+    )
+
+    mirror_users.add_argument(
+        "--concurrency", type=int, help="Number of pages to fetch at once"
+    )
+
+    # Mirror features -------------------------------
+
+    mirror_features = mirror_parsers.add_parser(
+        "features", help="Copy a layer's features into a local SQLite database"
+    )
+
+    mirror_features.add_argument("layer", help="The layer to mirror")
+
+    mirror_features.add_argument(
+        "-w", "--workspace", help="Workspace ID or subdomain", default=None
+    )
+
+    mirror_features.add_argument(
+        "--db", help="The database file (default ~/.local/share/cartographer)"
+    )
 
-attachment_search = attachment_parsers.add_parser(
-    "search", help="Search attachments in a particular survey"
-)
 
-attachment_search.add_argument("module", help="The survey module")
+# Batch =========================================
 
-attachment_search.add_argument("survey", help="The survey")
 
-attachment_search.add_argument("-f", "--folder", help="Optional folder to search")
+def add_batch_arguments(batch):
+    batch.add_argument(
+        "file",
+        nargs="?",
+        default="-",
+        help='File of commands, one per line, or "-" to read from stdin',
+    )
+
+
+# Serve =========================================
+
+
+def add_serve_arguments(serve):
+    serve.add_argument(
+        "--socket",
+        help="Unix socket to listen on"
+        " (default $CARTOGRAPHER_SOCKET or ~/.cache/cartographer/daemon.sock)",
+    )
+
+    serve.add_argument(
+        "--idle-timeout",
+        type=float,
+        help="Exit after this many seconds without a command (default never)",
+    )
+
+
+# Command groups ================================
+
+# The parsers for each group of commands are only built when that group
+# is used, so we don't construct the whole tree just to run one command:
+
+command_groups = [
+    ("auth", "Commands related to authentication", add_auth_parsers),
+    ("workspace", "Commands related to workspaces", add_workspace_parsers),
+    ("module", "Commands related to module data", add_module_parsers),
+    ("survey", "Commands related to survey data", add_survey_parsers),
+    ("user", "Commands related to user data", add_user_parsers),
+    ("layer", "Commands related to map layer metadata", add_layer_parsers),
+    ("feature", "Commands related to feature data", add_feature_parsers),
+    ("attachment", "Commands related to attachmented files", add_attachment_parsers),
+    ("mirror", "Keep a local copy of Cartographer data", add_mirror_parsers),
+    ("version", "Get server version", None),
+    (
+        "batch",
+        "Run many commands in one process, writing results as NDJSON",
+        add_batch_arguments,
+    ),
+    (
+        "serve",
+        "Run commands in a background process that keeps connections warm",
+        add_serve_arguments,
+    ),
+]
+
+group_parsers = {}
+built_groups = set()
 
+for name, help, build in command_groups:
+    group_parsers[name] = parsers.add_parser(name, help=help)
 
-# Version =======================================
 
+def build_group(name):
+    if name in group_parsers and name not in built_groups:
+        built_groups.add(name)
+        for group, help, build in command_groups:
+            if group == name and build is not None:
+                build(group_parsers[name])
+
+
+def group_names():
+    return [name for (name, help, build) in command_groups]
 
-version = parsers.add_parser("version", help="Get server version")
+
+def read_global_args(argv):
+    # The global options in `argv` (after `trace_to_stderr`), read as
+    # `parser` would, and the arguments from the command on. None if the
+    # global options are invalid:
+    try:
+        (options, unknown) = command_parser.parse_known_args(argv)
+    except ValueError:
+        return None
+    options = vars(options)
+    return (options, unknown + options.pop("argv"))
+
+
+def command_name(argv):
+    # The command (or group) in `argv`, if any:
+    global_args = read_global_args(argv)
+    if global_args is None:
+        return None
+    for arg in global_args[1]:
+        if not arg.startswith("-"):
+            return arg
+    return None
@@ -0,0 +1,236 @@
+import hashlib
+import json
+import os
+import re
+import sys
+
+import requests
+
+import cartographer.fetch as fetch
+from cartographer.stream import chunk_size
+
+checksum_pattern = re.compile(r"^[0-9a-fA-F]{32}$")
+content_range_pattern = re.compile(r"^bytes (\d+)-\d+/(\d+|\*)$")
+
+
+# Enumerating ===================================
+
+
+def read_survey_ids(path):
+    # Reads the output of `survey search` (a JSON array, or NDJSON
+    # from --output ndjson or --all-workspaces) and returns the survey IDs:
+    if path == "-":
+        text = sys.stdin.read()
+    else:
+        with open(path) as file:
+            text = file.read()
+
+    text = text.strip()
+    if text.startswith("["):
+        records = json.loads(text)
+    else:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    ids = []
+    for record in records:
+        if isinstance(record, dict) and "result" in record:
+            record = record["result"]
+        if isinstance(record, dict):
+            ids.append(record["id"])
+        else:
+            ids.append(record)
+    return ids
+
+
+def first(item, keys):
+    for key in keys:
+        value = item.get(key, None)
+        if value is not None:
+            return value
+    return None
+
+
+def filename(item):
+    name = first(item, ["filename", "name", "key", "url"]) or item.get("id")
+    return str(name).rstrip("/").split("/")[-1]
+
+
+def size(item):
+    value = first(item, ["size", "contentLength", "length"])
+    return None if value is None else int(value)
+
+
+def checksum(item):
+    # An MD5 hex digest, if the server gave us one.
+    # Simple (non-multipart) S3 ETags are the MD5 of the file:
+    value = first(item, ["md5", "checksum", "etag", "ETag"])
+    if value is None:
+        return None
+    value = str(value).strip('"')
+    return value.lower() if checksum_pattern.match(value) else None
+
+
+def safe_part(part):
+    # Keep names from the server inside the output directory:
+    part = str(part).replace("/", "_").replace("\\", "_")
+    return "_" if part in ("", ".", "..") else part
+
+
+def local_path(out, survey, item):
+    parts = [out, safe_part(survey)]
+    if item.get("folder", None):
+        parts.append(safe_part(item["folder"]))
+    parts.append(safe_part(filename(item)))
+    return os.path.join(*parts)
+
+
+def local_paths(out, survey, items):
+    # Paths for all of a survey's attachments. Files with the same name in
+    # the same folder would share a path (and ".part" file), so the later
+    # ones get "-2", "-3", ... before the extension, in the server's order:
+    seen = set()
+    paths = []
+    for item in items:
+        path = local_path(out, survey, item)
+        (base, extension) = os.path.splitext(path)
+        number = 1
+        while path in seen:
+            number += 1
+            path = "{}-{}{}".format(base, number, extension)
+        seen.add(path)
+        paths.append(path)
+    return paths
+
+
+def attachment_url(scheme, host, survey, item):
+    # Returns the download URL and whether it is on the API host
+    # (we don't send credentials anywhere else):
+    url = first(item, ["url", "href"])
+    if url is None:
+        parts = [survey, item.get("folder", None), filename(item)]
+        path = "/v1/attachment/" + "/".join(str(p) for p in parts if p)
+        return (fetch.create_url(scheme, host, path), True)
+    elif url.startswith("/"):
+        return (fetch.create_url(scheme, host, url), True)
+    else:
+        return (url, url.startswith("{}://{}/".format(scheme, host)))
+
+
+# Downloading ===================================
+
+
+def file_md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_complete(path, expected_size, expected_checksum):
+    # Files with no size or checksum to compare against are kept as they are:
+    if not os.path.exists(path):
+        return False
+    if expected_size is not None and os.path.getsize(path) != expected_size:
+        return False
+    if expected_checksum is not None and file_md5(path) != expected_checksum:
+        return False
+    return True
+
+
+def content_range_start(response, expected_size):
+    # The offset a 206 response starts at, or None if its Content-Range
+    # (e.g. "bytes 100-199/200") is missing or doesn't fit the attachment:
+    match = content_range_pattern.match(response.headers.get("Content-Range", ""))
+    if match is None:
+        return None
+    (start, total) = (int(match.group(1)), match.group(2))
+    if expected_size is not None and total != "*" and int(total) != expected_size:
+        return None
+    return start
+
+
+def is_resumable(response, offset, expected_size):
+    # We can only append a 206 that starts where the part file ends and
+    # hasn't been compressed (decoding the middle of a gzip stream fails,
+    # or worse, doesn't):
+    if response.status_code != 206:
+        return False
+    if response.headers.get("Content-Encoding", "identity") != "identity":
+        return False
+    return content_range_start(response, expected_size) == offset
+
+
+def download(url, auth, headers, path, expected_size=None, expected_checksum=None):
+    # Streams `url` to `path` via a ".part" file. If an earlier download
+    # was interrupted we ask for the rest of the file with a Range request,
+    # and start again from the beginning if the server doesn't send exactly
+    # that. Returns "skipped", "downloaded" or "resumed":
+    if is_complete(path, expected_size, expected_checksum):
+        return "skipped"
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    part = path + ".part"
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if expected_size is not None and offset > expected_size:
+        offset = 0
+
+    response = None
+    resumed = False
+    if offset > 0:
+        # Byte ranges are of the encoded body, so ask for it unencoded:
+        range_headers = dict(headers)
+        range_headers["Range"] = "bytes={}-".format(offset)
+        range_headers["Accept-Encoding"] = "identity"
+        try:
+            response = fetch.get(url, auth, range_headers, stream=True)
+        except requests.HTTPError as error:
+            # 416 means the part file is already as long as the attachment:
+            if error.response.status_code != 416:
+                raise
+            resumed = True
+        else:
+            resumed = is_resumable(response, offset, expected_size)
+            if not resumed and response.status_code == 206:
+                response.close()
+                response = None
+
+    if response is None and not resumed:
+        response = fetch.get(url, auth, headers, stream=True)
+
+    if response is not None:
+        try:
+            with open(part, "ab" if resumed else "wb") as file:
+                for chunk in response.iter_content(chunk_size):
+                    file.write(chunk)
+        finally:
+            response.close()
+
+    received = os.path.getsize(part)
+    if expected_size is not None and received != expected_size:
+        # A short file may just be a dropped connection, which the next
+        # run can resume; a long one can't be fixed:
+        if received > expected_size:
+            os.remove(part)
+        raise ValueError(
+            "Expected {} bytes downloading {}, got {}".format(
+                expected_size, url, received
+            )
+        )
+
+    if expected_checksum is not None and file_md5(part) != expected_checksum:
+        os.remove(part)
+        raise ValueError("Checksum mismatch downloading {}".format(url))
+
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(part, path)
+
+    return "resumed" if resumed else "downloaded"
@@ -0,0 +1,87 @@
+import base64
+import json
+import shlex
+import sys
+
+import requests
+
+import cartographer.fetch as fetch
+
+
+def read_lines(path):
+    if path is None or path == "-":
+        for line in sys.stdin:
+            yield line
+    else:
+        with open(path) as file:
+            for line in file:
+                yield line
+
+
+def parse_line(line):
+    # Lines are either shell-style arguments or a JSON array of arguments.
+    # Blank lines and comments are skipped:
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    if line.startswith("["):
+        argv = json.loads(line)
+        # On Python 2, JSON strings decode to unicode but argparse wants str:
+        argv = [arg if isinstance(arg, str) else arg.encode("utf-8") for arg in argv]
+    else:
+        argv = shlex.split(line)
+    if argv and argv[0] == "cartographer":
+        argv = argv[1:]
+    return argv
+
+
+def collect_output(ans):
+    if isinstance(ans, (str, bytes)):
+        chunks = [ans]
+    else:
+        chunks = ans
+    return b"".join(
+        chunk if isinstance(chunk, bytes) else chunk.encode("utf-8") for chunk in chunks
+    )
+
+
+def output_fields(data):
+    # Embeds command output in a result line: JSON output as JSON,
+    # other text as a string and anything else as base64:
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return {"output_base64": base64.b64encode(data).decode("ascii")}
+    try:
+        return {"result": json.loads(text)}
+    except ValueError:
+        return {"output": text}
+
+
+def error_fields(error):
+    fields = {"error": str(error)}
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        fields["status"] = response.status_code
+        fields.update(output_fields(response.content))
+    return fields
+
+
+def run_batch(lines, run_argv):
+    for (number, line) in enumerate(lines, 1):
+        try:
+            argv = parse_line(line)
+        except ValueError as error:
+            result = {"error": "Could not parse line: {}".format(error)}
+        else:
+            if argv is None:
+                continue
+            try:
+                result = output_fields(collect_output(run_argv(argv)))
+            except SystemExit as error:
+                result = {"error": "Invalid command ({})".format(error.code)}
+            except Exception as error:
+                result = error_fields(error)
+
+        result["line"] = number
+        yield fetch.format_json(result) + "\n"
@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+
+cached_headers = ["Content-Type", "ETag", "Last-Modified"]
+
+
+def cache_dir(*parts):
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.getenv("HOME"), ".cache")
+    return os.path.join(base, "cartographer", *parts)
+
+
+def ensure_dir(path):
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path, 0o700)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+    return path
+
+
+def write_atomic(path, data):
+    (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.rename(temp, path)
+    except Exception:
+        os.remove(temp)
+        raise
+
+
+class ResponseCache(object):
+    # On-disk cache of GET responses, keyed by URL and user. Entries are
+    # served without a request for `ttl` seconds, then revalidated with
+    # If-None-Match/If-Modified-Since. The least recently used entries are
+    # evicted when the cache grows beyond `max_size` bytes.
+    def __init__(self, path, ttl=300, max_size=100 * 1024 * 1024):
+        self.path = ensure_dir(path)
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def key(self, url, identity):
+        text = u"{}\n{}".format(identity or "", url)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def files(self, key):
+        base = os.path.join(self.path, key)
+        return (base + ".json", base + ".body")
+
+    def load(self, key):
+        (meta_path, body_path) = self.files(key)
+        try:
+            with open(meta_path, "rb") as file:
+                meta = json.loads(file.read().decode("utf-8"))
+            with open(body_path, "rb") as file:
+                body = file.read()
+        except (IOError, OSError, ValueError):
+            return None
+        os.utime(body_path, None)
+        return (meta, body)
+
+    def is_fresh(self, meta):
+        return time.time() - meta["stored"] < self.ttl
+
+    def validators(self, meta):
+        headers = {}
+        if meta["headers"].get("ETag"):
+            headers["If-None-Match"] = meta["headers"]["ETag"]
+        if meta["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+        return headers
+
+    def store(self, key, response):
+        if "no-store" in response.headers.get("Cache-Control", ""):
+            return
+        headers = {}
+        for name in cached_headers:
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        self.save(key, {"headers": headers, "stored": time.time()}, response.content)
+        self.evict()
+
+    def refresh(self, key, meta, body):
+        meta["stored"] = time.time()
+        self.save(key, meta, body)
+
+    def save(self, key, meta, body):
+        (meta_path, body_path) = self.files(key)
+        write_atomic(body_path, body)
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+
+    def evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.path):
+            if name.endswith(".body"):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name[: -len(".body")]))
+                total += stat.st_size
+        entries.sort()
+        for (mtime, size, key) in entries:
+            if total <= self.max_size:
+                break
+            for path in self.files(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def response(self, url, meta, body):
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = "OK"
+        response.url = url
+        response.headers = requests.structures.CaseInsensitiveDict(meta["headers"])
+        response._content = body
+        return response
+
+
+class TokenStore(object):
+    # Session tokens from /v1/auth/login, stored in a private JSON file:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.path, "rb") as file:
+                return json.loads(file.read().decode("utf-8"))
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def write(self, tokens):
+        ensure_dir(os.path.dirname(self.path))
+        write_atomic(self.path, json.dumps(tokens).encode("utf-8"))
+
+    def load(self, key):
+        return self.read().get(key, None)
+
+    def save(self, key, token):
+        with self.lock:
+            tokens = self.read()
+            tokens[key] = token
+            self.write(tokens)
+
+    def remove(self, key):
+        with self.lock:
+            tokens = self.read()
+            if tokens.pop(key, None) is not None:
+                self.write(tokens)
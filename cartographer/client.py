@@ -0,0 +1,373 @@
+import cartographer.fetch as fetch
+import cartographer.stream as stream
+
+
+class CartographerClient(object):
+    # A Python API for Cartographer. Methods return parsed JSON, or iterators
+    # of records/pages/chunks for large results, and every call shares one
+    # connection pool and login session. The CLI commands are a thin layer
+    # over this class. For example:
+    #
+    #     client = CartographerClient.from_profile("default")
+    #     for page in client.survey_search_pages("mrsMorph", workspace="ws"):
+    #         ...
+    #
+    # `http` is the `fetch.Client` to send requests with
+    # (the process-wide client if omitted). With `raw`, methods that return
+    # a single JSON document return the server's bytes as a `fetch.RawJSON`
+    # instead of parsing them, for passing straight through to a file.
+    def __init__(
+        self,
+        scheme="https",
+        host="api.cartographer.io",
+        email=None,
+        password=None,
+        http=None,
+        raw=False,
+    ):
+        self.scheme = scheme
+        self.host = host
+        self.email = email
+        self.password = password
+        self.http = http or fetch.get_client()
+        self.raw = raw
+
+    @classmethod
+    def from_profile(cls, profile="default", **options):
+        # Reads settings from a profile in the credentials file.
+        # `options` override them, e.g. `email=...` or `pool_size=20`:
+        from cartographer import create_client
+        from cartographer.profile import read_profile
+
+        params = read_profile(profile)
+        # Long-lived clients may poll for changes, so they don't share
+        # responses between identical requests unless asked to:
+        params.setdefault("memo_size", 0)
+        params.update(options)
+        return cls(
+            params["scheme"],
+            params["host"],
+            params.get("email", None),
+            params.get("password", None),
+            create_client(params),
+            params.get("raw", False),
+        )
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # Requests ----------------------------------
+
+    def url(self, path, query={}):
+        return fetch.create_url(self.scheme, self.host, path, query)
+
+    def auth(self):
+        return self.http.user_auth(self.scheme, self.host, self.email, self.password)
+
+    def get(self, path, query={}, stream=False, cache=False, headers=None, memo=True):
+        headers = fetch.create_headers() if headers is None else headers
+        url = self.url(path, query)
+        return self.http.get(url, self.auth(), headers, stream, cache, memo)
+
+    def get_json(self, path, query={}, cache=False):
+        return self.read_json(self.get(path, query, cache=cache))
+
+    def read_json(self, response):
+        if self.raw:
+            return fetch.RawJSON(response.content)
+        return fetch.decode_json(response)
+
+    def get_items(self, path, query={}, key=None):
+        # Streams a JSON array (or the array at `key`), parsing one item at a time:
+        return stream.response_items(self.get(path, query, stream=True), key)
+
+    def get_pages(self, path, query, skip, limit, page_size, concurrency, engine):
+        import cartographer.paging as paging
+
+        def page_url(skip, limit):
+            return self.url(path, dict(query, skip=skip, limit=limit))
+
+        return paging.fetch_pages(
+            page_url,
+            self.auth(),
+            fetch.create_headers(),
+            skip,
+            limit,
+            page_size,
+            concurrency,
+            engine,
+            self.http,
+        )
+
+    # Auth --------------------------------------
+
+    def login(self):
+        body = {"email": self.email, "password": self.password}
+        url = self.url("/v1/auth/login", {})
+        response = self.http.request("POST", url, None, fetch.create_headers(), body)
+        data = fetch.decode_json(response)
+        self.http.remember_token(self.scheme, self.host, self.email, data)
+        return data
+
+    # Workspaces --------------------------------
+
+    def workspace_search(self):
+        return self.get_json("/v1/workspace", {})
+
+    def workspace_read(self, workspace):
+        return self.get_json("/v1/workspace/{}".format(workspace), cache=True)
+
+    # Modules -----------------------------------
+
+    def module_search(self, workspace=None):
+        return self.get_json("/v1/survey/module", {"workspace": workspace})
+
+    def module_read(self, id):
+        return self.get_json("/v1/survey/module/{}".format(id), cache=True)
+
+    # Surveys -----------------------------------
+
+    def survey_query(self, workspace, q, order, skip, limit, format):
+        return {
+            "workspace": workspace,
+            "q": q,
+            "order": order,
+            "skip": skip,
+            "limit": limit,
+            "format": format,
+        }
+
+    def survey_search(
+        self,
+        module,
+        workspace=None,
+        q=None,
+        order=None,
+        skip=None,
+        limit=None,
+        format=None,
+    ):
+        query = self.survey_query(workspace, q, order, skip, limit, format)
+        return self.get_json("/v1/survey/{}".format(module), query)
+
+    def survey_search_iter(
+        self,
+        module,
+        workspace=None,
+        q=None,
+        order=None,
+        skip=None,
+        limit=None,
+        format=None,
+    ):
+        query = self.survey_query(workspace, q, order, skip, limit, format)
+        return self.get_items("/v1/survey/{}".format(module), query)
+
+    def survey_search_pages(
+        self,
+        module,
+        workspace=None,
+        q=None,
+        order=None,
+        skip=None,
+        limit=None,
+        format=None,
+        page_size=None,
+        concurrency=None,
+        engine=None,
+    ):
+        # Every page of results (after `skip`, up to `limit`):
+        query = self.survey_query(workspace, q, order, None, None, format)
+        path = "/v1/survey/{}".format(module)
+        return self.get_pages(path, query, skip, limit, page_size, concurrency, engine)
+
+    def survey_summaries(
+        self,
+        module,
+        workspace=None,
+        q=None,
+        order=None,
+        skip=None,
+        limit=None,
+        format=None,
+    ):
+        query = self.survey_query(workspace, q, order, skip, limit, format)
+        return self.get_json("/v1/survey/{}/summary".format(module), query)
+
+    def survey_summaries_iter(
+        self,
+        module,
+        workspace=None,
+        q=None,
+        order=None,
+        skip=None,
+        limit=None,
+        format=None,
+    ):
+        query = self.survey_query(workspace, q, order, skip, limit, format)
+        return self.get_items("/v1/survey/{}/summary".format(module), query)
+
+    def survey_summaries_pages(
+        self,
+        module,
+        workspace=None,
+        q=None,
+        order=None,
+        skip=None,
+        limit=None,
+        format=None,
+        page_size=None,
+        concurrency=None,
+        engine=None,
+    ):
+        query = self.survey_query(workspace, q, order, None, None, format)
+        path = "/v1/survey/{}/summary".format(module)
+        return self.get_pages(path, query, skip, limit, page_size, concurrency, engine)
+
+    def survey_blank(self, module, workspace=None, format=None):
+        path = "/v1/survey/{}/blank".format(module)
+        query = {"format": format, "workspace": workspace}
+        return self.get_json(path, query, cache=True)
+
+    def survey_read(self, module, id, format=None):
+        path = "/v1/survey/{}/{}".format(module, id)
+        return self.get_json(path, {"format": format})
+
+    # Users -------------------------------------
+
+    def user_query(self, workspace, q, role, order, skip, limit):
+        return {
+            "workspace": workspace,
+            "q": q,
+            "role": role,
+            "order": order,
+            "skip": skip,
+            "limit": limit,
+        }
+
+    def user_search(
+        self, workspace=None, q=None, role=None, order=None, skip=None, limit=None
+    ):
+        query = self.user_query(workspace, q, role, order, skip, limit)
+        return self.get_json("/v1/user", query)
+
+    def user_search_iter(
+        self, workspace=None, q=None, role=None, order=None, skip=None, limit=None
+    ):
+        query = self.user_query(workspace, q, role, order, skip, limit)
+        return self.get_items("/v1/user", query)
+
+    def user_search_pages(
+        self,
+        workspace=None,
+        q=None,
+        role=None,
+        order=None,
+        skip=None,
+        limit=None,
+        page_size=None,
+        concurrency=None,
+        engine=None,
+    ):
+        query = self.user_query(workspace, q, role, order, None, None)
+        return self.get_pages(
+            "/v1/user", query, skip, limit, page_size, concurrency, engine
+        )
+
+    def user_read(self, id, workspace=None):
+        # The workspace is sent in the Authorization header, as it always has been:
+        path = "/v1/user/{}".format(id)
+        headers = fetch.create_headers(workspace)
+        return self.read_json(self.get(path, {}, headers=headers))
+
+    # Map layers --------------------------------
+
+    def layer_search(self, workspace=None):
+        return self.get_json("/v1/map/layer", {"workspace": workspace})
+
+    def layer_search_iter(self, workspace=None):
+        return self.get_items("/v1/map/layer", {"workspace": workspace})
+
+    def layer_read(self, layer):
+        return self.get_json("/v1/map/layer/{}".format(layer), cache=True)
+
+    # Features ----------------------------------
+
+    def feature_query(self, workspace, simplify, format):
+        return {"workspace": workspace, "simplify": simplify, "format": format}
+
+    def feature_search(self, layer, workspace=None, simplify=None, format=None):
+        # GeoJSON (the default) or legacy JSON. Use `feature_search_chunks`
+        # for CSV and KML:
+        query = self.feature_query(workspace, simplify, format)
+        return self.get_json("/v1/map/{}".format(layer), query)
+
+    def feature_search_iter(self, layer, workspace=None, simplify=None, format=None):
+        # One feature at a time from a GeoJSON collection or legacy JSON array:
+        if format is None or format == "geojson":
+            key = "features"
+        elif format == "legacy":
+            key = None
+        else:
+            raise ValueError("Features can only be iterated in JSON formats")
+        query = self.feature_query(workspace, simplify, format)
+        return self.get_items("/v1/map/{}".format(layer), query, key)
+
+    def feature_search_chunks(self, layer, workspace=None, simplify=None, format=None):
+        # The raw response in chunks of bytes, in any format:
+        query = self.feature_query(workspace, simplify, format)
+        path = "/v1/map/{}".format(layer)
+        return stream.response_chunks(self.get(path, query, stream=True))
+
+    def feature_search_since(self, layer, workspace=None, etag=None, modified=None):
+        # The GeoJSON response for a layer, or None if it hasn't changed
+        # since an earlier response with this ETag or Last-Modified header:
+        headers = fetch.create_headers()
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if modified is not None:
+            headers["If-Modified-Since"] = modified
+        query = self.feature_query(workspace, None, None)
+        response = self.get("/v1/map/{}".format(layer), query, headers=headers)
+        return None if response.status_code == 304 else response
+
+    def feature_tile_path(self, layer, z, x, y):
+        return "/v1/map/{}/tile/{}/{}/{}".format(layer, z, x, y)
+
+    def feature_tile_chunks(self, layer, z, x, y, workspace=None, simplify=None):
+        path = self.feature_tile_path(layer, z, x, y)
+        query = {"workspace": workspace, "simplify": simplify}
+        return stream.response_chunks(self.get(path, query, stream=True))
+
+    def feature_tile(self, layer, z, x, y, workspace=None, simplify=None):
+        path = self.feature_tile_path(layer, z, x, y)
+        query = {"workspace": workspace, "simplify": simplify}
+        return self.get(path, query, memo=False).content
+
+    def feature_reset(self, layer=None):
+        if layer:
+            path = "/v1/map/{}/reset".format(layer)
+        else:
+            path = "/v1/map/reset"
+        if self.http.memo is not None:
+            # Resetting changes what the memoized GETs would return:
+            self.http.memo.clear()
+        return self.read_json(self.get(path, {}, memo=False))
+
+    # Attachments -------------------------------
+
+    def attachment_search(self, module, survey, folder=None):
+        query = {"module": module, "survey": survey, "folder": folder}
+        return self.get_json("/v1/attachment", query)
+
+    # Server ------------------------------------
+
+    def version(self):
+        url = self.url("/v1/version")
+        return self.read_json(self.http.get(url, None, {}))
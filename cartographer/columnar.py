@@ -0,0 +1,303 @@
+import json
+import mmap
+import os
+import struct
+
+# A compact columnar file for loading search results into analytics tools
+# (`--output columnar`). Records are flattened into columns ("data.name")
+# and each column is stored as typed, little-endian arrays, so a reader can
+# memory-map the file and scan one column without parsing any records:
+#
+#     magic ("CGCOL1\0\0")
+#     buffers, each aligned to 8 bytes
+#     footer (JSON describing the columns and where their buffers are)
+#     footer length (uint64)
+#     magic
+#
+# Every column has a "validity" bitmap (bit i is set if row i isn't null,
+# least significant bit first) and, depending on its type:
+#
+#     int64, float64    "values": one 8-byte number per row (0 if null)
+#     bool              "values": one byte per row
+#     string, json      encoding "plain": "offsets" (n + 1 int64s) into "data"
+#                       (UTF-8), or encoding "dictionary": "indices" (one int32
+#                       per row, -1 if null) into the distinct values, which
+#                       are stored as "offsets" and "data"
+#
+# Lists, mixed types and other values that don't fit a type are written as
+# JSON text. Use `Reader` to read the file back.
+
+magic = b"CGCOL1\0\0"
+alignment = 8
+version = 1
+
+try:
+    string_types = (str, unicode)
+    integer_types = (int, long)
+except NameError:
+    string_types = (str,)
+    integer_types = (int,)
+
+
+# Building columns ==============================
+
+
+def flatten(record, prefix="", row=None):
+    # {"data": {"name": "x"}} => {"data.name": "x"}.
+    # Lists and empty objects are kept whole:
+    row = {} if row is None else row
+    for (key, value) in record.items():
+        name = prefix + key
+        if isinstance(value, dict) and value:
+            flatten(value, name + ".", row)
+        else:
+            row[name] = value
+    return row
+
+
+def collect_columns(records):
+    # Returns ([(name, values)], row count), with columns in the order we
+    # first saw them and None wherever a record didn't have one:
+    columns = []
+    index = {}
+    rows = 0
+    for record in records:
+        if not isinstance(record, dict):
+            record = {"value": record}
+        for (name, value) in flatten(record).items():
+            if name not in index:
+                index[name] = len(columns)
+                columns.append((name, [None] * rows))
+            columns[index[name]][1].append(value)
+        rows += 1
+        for (name, values) in columns:
+            if len(values) < rows:
+                values.append(None)
+    return (columns, rows)
+
+
+def value_type(value):
+    if isinstance(value, bool):
+        return "bool"
+    elif isinstance(value, integer_types):
+        return "int64" if -(2 ** 63) <= value < 2 ** 63 else "json"
+    elif isinstance(value, float):
+        return "float64"
+    elif isinstance(value, string_types):
+        return "string"
+    else:
+        return "json"
+
+
+def column_type(values):
+    types = set(value_type(value) for value in values if value is not None)
+    if not types:
+        return "string"
+    elif len(types) == 1:
+        return types.pop()
+    elif types == set(["int64", "float64"]):
+        return "float64"
+    else:
+        return "json"
+
+
+# Encoding ======================================
+
+
+def validity(values):
+    bitmap = bytearray((len(values) + 7) // 8)
+    for (row, value) in enumerate(values):
+        if value is not None:
+            bitmap[row // 8] |= 1 << (row % 8)
+    return bytes(bitmap)
+
+
+def pack(code, numbers):
+    return struct.pack("<{}{}".format(len(numbers), code), *numbers)
+
+
+def encode_text(value, kind):
+    if kind == "json":
+        value = json.dumps(value, sort_keys=True)
+    return value.encode("utf-8") if not isinstance(value, bytes) else value
+
+
+def text_buffers(texts):
+    # (offsets, data) for a list of byte strings:
+    offsets = [0]
+    for text in texts:
+        offsets.append(offsets[-1] + len(text))
+    return (pack("q", offsets), b"".join(texts))
+
+
+def encode_column(values):
+    # Returns (type, encoding, [(buffer name, bytes)]):
+    kind = column_type(values)
+    buffers = [("validity", validity(values))]
+
+    if kind == "int64":
+        numbers = [0 if value is None else value for value in values]
+        return (kind, None, buffers + [("values", pack("q", numbers))])
+    elif kind == "float64":
+        numbers = [0.0 if value is None else float(value) for value in values]
+        return (kind, None, buffers + [("values", pack("d", numbers))])
+    elif kind == "bool":
+        flags = bytearray(1 if value else 0 for value in values)
+        return (kind, None, buffers + [("values", bytes(flags))])
+
+    texts = [None if value is None else encode_text(value, kind) for value in values]
+    distinct = {}
+    for text in texts:
+        if text is not None and text not in distinct:
+            distinct[text] = len(distinct)
+
+    # Dictionary-encode columns with repeated values (e.g. statuses and names),
+    # but not ones where almost every value is different (e.g. IDs):
+    if len(distinct) * 2 <= len(texts):
+        indices = [-1 if text is None else distinct[text] for text in texts]
+        entries = sorted(distinct, key=distinct.get)
+        (offsets, data) = text_buffers(entries)
+        buffers += [("indices", pack("i", indices)), ("offsets", offsets)]
+        return (kind, "dictionary", buffers + [("data", data)])
+    else:
+        (offsets, data) = text_buffers([text or b"" for text in texts])
+        return (kind, "plain", buffers + [("offsets", offsets), ("data", data)])
+
+
+def write(path, records):
+    # Writes `records` (dicts, e.g. surveys or GeoJSON features) to `path`
+    # and returns a summary:
+    (columns, rows) = collect_columns(records)
+    described = []
+    with open(path, "wb") as file:
+        file.write(magic)
+        offset = len(magic)
+        for (name, values) in columns:
+            (kind, encoding, buffers) = encode_column(values)
+            column = {"name": name, "type": kind, "buffers": {}}
+            if encoding is not None:
+                column["encoding"] = encoding
+            for (buffer_name, data) in buffers:
+                padding = (-offset) % alignment
+                file.write(b"\0" * padding)
+                offset += padding
+                file.write(data)
+                column["buffers"][buffer_name] = [offset, len(data)]
+                offset += len(data)
+            described.append(column)
+
+        footer = json.dumps({"version": version, "rows": rows, "columns": described})
+        footer = footer.encode("utf-8")
+        file.write(footer)
+        file.write(struct.pack("<Q", len(footer)))
+        file.write(magic)
+        size = offset + len(footer) + 8 + len(magic)
+
+    return {"path": path, "rows": rows, "columns": len(described), "bytes": size}
+
+
+# Reading =======================================
+
+
+class Reader(object):
+    # Memory-maps a columnar file. Only the columns you ask for are read:
+    #
+    #     with Reader("surveys.col") as reader:
+    #         names = reader.column("data.name")
+    #
+    # `buffer` returns a column's raw arrays, e.g. for `numpy.frombuffer`.
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.map = None
+        try:
+            self.read_footer(path)
+        except Exception:
+            self.close()
+            raise
+
+    def read_footer(self, path):
+        if os.fstat(self.file.fileno()).st_size == 0:
+            raise ValueError("Not a columnar file: {}".format(path))
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self.map)
+        tail = size - 8 - len(magic)
+        if size < 2 * len(magic) + 8 or self.map[: len(magic)] != magic:
+            raise ValueError("Not a columnar file: {}".format(path))
+        if self.map[tail + 8 :] != magic:
+            raise ValueError("Truncated columnar file: {}".format(path))
+        (footer_size,) = struct.unpack_from("<Q", self.map, tail)
+        footer = json.loads(self.map[tail - footer_size : tail].decode("utf-8"))
+        self.rows = footer["rows"]
+        self.columns = footer["columns"]
+        self.index = dict((column["name"], column) for column in self.columns)
+
+    def names(self):
+        return [column["name"] for column in self.columns]
+
+    def type(self, name):
+        return self.index[name]["type"]
+
+    def buffer(self, name, buffer):
+        # Zero-copy on Python 3 (release the view before closing the reader):
+        (offset, length) = self.index[name]["buffers"][buffer]
+        try:
+            return memoryview(self.map)[offset : offset + length]
+        except TypeError:
+            return self.map[offset : offset + length]
+
+    def unpack(self, name, buffer, code, count):
+        (offset, length) = self.index[name]["buffers"][buffer]
+        return struct.unpack_from("<{}{}".format(count, code), self.map, offset)
+
+    def column(self, name):
+        # The values of one column as a list, with None for nulls:
+        column = self.index[name]
+        kind = column["type"]
+        (offset, length) = column["buffers"]["validity"]
+        bitmap = bytearray(self.map[offset : offset + length])
+        valid = [bool(bitmap[row // 8] & (1 << (row % 8))) for row in range(self.rows)]
+
+        if kind in ("int64", "float64"):
+            code = "q" if kind == "int64" else "d"
+            values = self.unpack(name, "values", code, self.rows)
+        elif kind == "bool":
+            values = [flag != 0 for flag in self.unpack(name, "values", "B", self.rows)]
+        elif column.get("encoding", None) == "dictionary":
+            indices = self.unpack(name, "indices", "i", self.rows)
+            entries = self.texts(name, kind, max(indices) + 1 if indices else 0)
+            values = [entries[i] if i >= 0 else None for i in indices]
+        else:
+            values = self.texts(name, kind, self.rows)
+
+        return [value if ok else None for (value, ok) in zip(values, valid)]
+
+    def texts(self, name, kind, count):
+        offsets = self.unpack(name, "offsets", "q", count + 1)
+        (start, length) = self.index[name]["buffers"]["data"]
+        texts = []
+        for i in range(count):
+            text = self.map[start + offsets[i] : start + offsets[i + 1]].decode("utf-8")
+            # Nulls are stored as empty strings, which aren't valid JSON:
+            texts.append(json.loads(text) if kind == "json" and text else text)
+        return texts
+
+    def records(self):
+        # Rebuilds flattened records ({"data.name": ...}), skipping nulls:
+        columns = [(name, self.column(name)) for name in self.names()]
+        for row in range(self.rows):
+            record = {}
+            for (name, values) in columns:
+                if values[row] is not None:
+                    record[name] = values[row]
+            yield record
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,707 @@
+import sys
+
+from cartographer.args import read_args
+from cartographer.profile import build_params, read_profile
+
+
+commands = {}
+
+
+def register_command(command, subcommand=None):
+    def wrapped(func):
+        if subcommand is None:
+            commands[command] = func
+        else:
+            if command not in commands:
+                commands[command] = {}
+            commands[command][subcommand] = func
+        return func
+
+    return wrapped
+
+
+# Commands --------------------------------------
+
+# Each command reads its arguments from `params`, calls the API through a
+# `CartographerClient` and formats the result for the terminal.
+# Responses we don't transform are written out exactly as the server sent
+# them, without parsing them. Only --pretty, --output ndjson and --all
+# (which reshape the output) need to decode them.
+# Each command imports what it needs itself, so a run only loads the
+# modules of the command it runs.
+
+
+def api_client(params, raw=False):
+    # Shares the process-wide connection pool and session tokens:
+    from cartographer.client import CartographerClient
+    import cartographer.fetch as fetch
+
+    return CartographerClient(
+        params["scheme"],
+        params["host"],
+        params.get("email", None),
+        params.get("password", None),
+        fetch.get_client(),
+        raw and not params.get("pretty", None),
+    )
+
+
+def format_output(data, params):
+    import cartographer.fetch as fetch
+
+    return fetch.format_json(data, 2 if params.get("pretty", None) else None)
+
+
+@register_command("auth", "login")
+def auth_login(params):
+    return format_output(api_client(params).login(), params)
+
+
+@register_command("workspace", "search")
+def workspace_search(params):
+    return format_output(api_client(params, raw=True).workspace_search(), params)
+
+
+@register_command("workspace", "read")
+def workspace_read(params):
+    client = api_client(params, raw=True)
+    return format_output(client.workspace_read(params["workspace"]), params)
+
+
+@register_command("module", "search")
+def module_search(params):
+    client = api_client(params, raw=True)
+    return format_output(client.module_search(params["workspace"]), params)
+
+
+@register_command("module", "read")
+def module_read(params):
+    return format_output(api_client(params, raw=True).module_read(params["id"]), params)
+
+
+@register_command("survey", "search")
+def survey_search(params):
+    import cartographer.stream as stream
+
+    workspace = params["workspace"]
+    module = params["module"]
+    order = params["order"]
+    skip = params["skip"]
+    limit = params["limit"]
+    q = params["query"]
+    format = params["format"]
+    output = params["output"]
+
+    if params["local"]:
+        import cartographer.mirror as mirror
+
+        store = mirror.local_store(params["db"])
+        try:
+            items = store.search_surveys(workspace, module, q, order, skip, limit)
+        finally:
+            store.close()
+        return format_items(items, params)
+
+    client = api_client(params, raw=True)
+
+    if params["all"]:
+        pages = client.survey_search_pages(
+            module,
+            workspace,
+            q,
+            order,
+            skip,
+            limit,
+            format,
+            params["page_size"],
+            params["concurrency"],
+            params["engine"],
+        )
+        return format_pages(pages, params)
+
+    if output in ("ndjson", "columnar"):
+        return format_items(
+            client.survey_search_iter(module, workspace, q, order, skip, limit, format),
+            params,
+        )
+
+    ans = format_output(
+        client.survey_search(module, workspace, q, order, skip, limit, format), params
+    )
+    return stream.redirect(ans, params["out"])
+
+
+@register_command("survey", "summaries")
+def survey_summaries(params):
+    import cartographer.stream as stream
+
+    workspace = params["workspace"]
+    module = params["module"]
+    order = params["order"]
+    skip = params["skip"]
+    limit = params["limit"]
+    q = params["query"]
+    format = params["format"]
+    output = params["output"]
+
+    client = api_client(params, raw=True)
+
+    if params["all"]:
+        pages = client.survey_summaries_pages(
+            module,
+            workspace,
+            q,
+            order,
+            skip,
+            limit,
+            format,
+            params["page_size"],
+            params["concurrency"],
+            params["engine"],
+        )
+        return format_pages(pages, params)
+
+    if output in ("ndjson", "columnar"):
+        return format_items(
+            client.survey_summaries_iter(
+                module, workspace, q, order, skip, limit, format
+            ),
+            params,
+        )
+
+    ans = format_output(
+        client.survey_summaries(module, workspace, q, order, skip, limit, format),
+        params,
+    )
+    return stream.redirect(ans, params["out"])
+
+
+@register_command("survey", "blank")
+def survey_blank(params):
+    client = api_client(params, raw=True)
+    blank = client.survey_blank(params["module"], params["workspace"], params["format"])
+    return format_output(blank, params)
+
+
+@register_command("survey", "read")
+def survey_read(params):
+    client = api_client(params, raw=True)
+    survey = client.survey_read(params["module"], params["id"], params["format"])
+    return format_output(survey, params)
+
+
+@register_command("user", "search")
+def user_search(params):
+    import cartographer.fetch as fetch
+
+    workspace = params["workspace"]
+    q = params["query"]
+    role = params["role"]
+    order = params["order"]
+    skip = params["skip"]
+    limit = params["limit"]
+    output = params["output"]
+
+    if params["local"]:
+        import cartographer.mirror as mirror
+
+        store = mirror.local_store(params["db"])
+        try:
+            items = store.search_users(workspace, q, role, order, skip, limit)
+        finally:
+            store.close()
+        return format_items(items, params)
+
+    client = api_client(params, raw=True)
+
+    if output == "ndjson":
+        return fetch.format_ndjson(
+            client.user_search_iter(workspace, q, role, order, skip, limit)
+        )
+
+    users = client.user_search(workspace, q, role, order, skip, limit)
+    return format_output(users, params)
+
+
+@register_command("user", "read")
+def user_read(params):
+    client = api_client(params, raw=True)
+    return format_output(client.user_read(params["id"], params["workspace"]), params)
+
+
+@register_command("layer", "search")
+def layer_search(params):
+    import cartographer.stream as stream
+
+    if params["output"] == "ndjson":
+        layers = api_client(params).layer_search_iter(params["workspace"])
+        return format_items(layers, params)
+
+    client = api_client(params, raw=True)
+    ans = format_output(client.layer_search(params["workspace"]), params)
+    return stream.redirect(ans, params["out"])
+
+
+@register_command("layer", "read")
+def layer_read(params):
+    client = api_client(params, raw=True)
+    return format_output(client.layer_read(params["layer"]), params)
+
+
+@register_command("feature", "search")
+def feature_search(params):
+    import cartographer.stream as stream
+
+    workspace = params["workspace"]
+    layer = params["layer"]
+    simplify = params["simplify"]
+    format = params["format"]
+    output = params["output"]
+
+    if params["local"]:
+        import cartographer.mirror as mirror
+
+        if format is not None and format != "geojson":
+            sys.exit("--local is only available for geojson")
+
+        store = mirror.local_store(params["db"])
+        try:
+            features = store.read_features(workspace, layer)
+        finally:
+            store.close()
+        return format_features(features, params)
+
+    client = api_client(params)
+
+    if output in ("ndjson", "columnar"):
+        if format not in (None, "geojson", "legacy"):
+            sys.exit("--output {} is only available for JSON formats".format(output))
+        features = client.feature_search_iter(layer, workspace, simplify, format)
+        return format_items(features, params)
+    elif params["pretty"] and format in (None, "geojson", "legacy"):
+        collection = client.feature_search(layer, workspace, simplify, format)
+        ans = format_output(collection, params)
+    else:
+        # Streamed through as it arrives, in any format:
+        ans = client.feature_search_chunks(layer, workspace, simplify, format)
+
+    return stream.redirect(ans, params["out"])
+
+
+@register_command("feature", "query")
+def feature_query(params):
+    import cartographer.mirror as mirror
+    import cartographer.spatial as spatial
+    import cartographer.tiles as tiles
+
+    workspace = params["workspace"]
+    layer = params["layer"]
+
+    # Features are indexed in the mirror database (see `mirror features`):
+    store = mirror.Store(params["db"] or mirror.default_path())
+    try:
+        mirror.sync_features(
+            store, api_client(params), workspace, layer, not params["no_refresh"]
+        )
+        if params["point"]:
+            point = spatial.parse_point(params["point"])
+            features = store.query_features(workspace, layer, point=point)
+        else:
+            box = tiles.parse_bbox(params["bbox"])
+            features = store.query_features(workspace, layer, box=box)
+    finally:
+        store.close()
+
+    return format_features(features, params)
+
+
+@register_command("feature", "tile")
+def feature_tile(params):
+    import cartographer.stream as stream
+
+    client = api_client(params)
+    chunks = client.feature_tile_chunks(
+        params["layer"],
+        params["z"],
+        params["x"],
+        params["y"],
+        params["workspace"],
+        params["simplify"],
+    )
+    return stream.redirect(chunks, params["out"])
+
+
+@register_command("feature", "tiles")
+def feature_tiles(params):
+    import requests
+    import cartographer.fetch as fetch
+    import cartographer.tiles as tiles
+    import cartographer.workers as workers
+
+    workspace = params["workspace"]
+    layer = params["layer"]
+    bbox = tiles.parse_bbox(params["bbox"])
+    min_zoom = params["min_zoom"] or 0
+    max_zoom = params["max_zoom"]
+    simplify = params["simplify"]
+    extension = params["extension"]
+    concurrency = params["concurrency"] or 8
+
+    client = api_client(params)
+    auth = client.auth()
+    headers = fetch.create_headers()
+
+    def tile_url(tile):
+        (z, x, y) = tile
+        return client.url(
+            client.feature_tile_path(layer, z, x, y),
+            {"workspace": workspace, "simplify": simplify},
+        )
+
+    def read_tile(tile, response):
+        content_type = response.headers.get("Content-Type")
+        return (tile, extension or tiles.tile_extension(content_type), response.content)
+
+    def fetch_tile(tile):
+        try:
+            response = fetch.get(tile_url(tile), auth, headers, memo=False)
+        except requests.HTTPError as error:
+            if error.response.status_code == 404:
+                return (tile, None, None)
+            raise
+        return read_tile(tile, response)
+
+    def check_tile(result):
+        (tile, response) = result
+        if response.status_code == 404:
+            return (tile, None, None)
+        fetch.handle_http_errors(response)
+        return read_tile(tile, response)
+
+    if params["mbtiles"]:
+        metadata = {
+            "name": layer,
+            "type": "overlay",
+            "version": "1",
+            "bounds": ",".join(str(edge) for edge in bbox),
+            "minzoom": min_zoom,
+            "maxzoom": max_zoom,
+        }
+        sink = tiles.MBTilesSink(params["mbtiles"], metadata)
+    elif params["archive"]:
+        sink = tiles.ZipSink(params["archive"])
+    else:
+        sink = tiles.DirectorySink(params["directory"])
+
+    progress = tiles.Progress(tiles.count_tiles(bbox, min_zoom, max_zoom))
+
+    try:
+        coords = tiles.enumerate_tiles(bbox, min_zoom, max_zoom)
+        if params["engine"] == "asyncio":
+            import cartographer.aio as aio
+
+            results = (
+                check_tile(result)
+                for result in aio.imap_get(tile_url, coords, auth, headers, concurrency)
+            )
+        else:
+            results = workers.imap_unordered(fetch_tile, coords, concurrency)
+
+        for (tile, ext, data) in results:
+            if data:
+                (z, x, y) = tile
+                sink.write(z, x, y, ext, data)
+            progress.update(len(data or b""))
+    finally:
+        sink.close()
+
+    summary = progress.finish()
+    summary.update(sink.summary())
+
+    return format_output(summary, params)
+
+
+@register_command("feature", "reset")
+def feature_reset(params):
+    client = api_client(params, raw=True)
+    return format_output(client.feature_reset(params.get("layer", None)), params)
+
+
+@register_command("attachment", "search")
+def attachment_search(params):
+    client = api_client(params, raw=True)
+    attachments = client.attachment_search(
+        params["module"], params["survey"], params["folder"]
+    )
+    return format_output(attachments, params)
+
+
+@register_command("attachment", "download")
+def attachment_download(params):
+    import cartographer.attachments as attachments
+    import cartographer.fetch as fetch
+    from cartographer.workers import imap_unordered
+
+    workspace = params["workspace"]
+    module = params["module"]
+    folder = params["folder"]
+    out = params["out"] or "."
+    concurrency = params["concurrency"] or 4
+
+    client = api_client(params)
+    auth = client.auth()
+    headers = fetch.create_headers()
+
+    if params["surveys"] is not None:
+        survey_ids = attachments.read_survey_ids(params["surveys"])
+    else:
+        pages = client.survey_search_pages(
+            module, workspace, concurrency=concurrency, engine=params["engine"]
+        )
+        survey_ids = (survey["id"] for page in pages for survey in page)
+
+    def list_attachments(survey):
+        return (survey, client.attachment_search(module, survey, folder))
+
+    def files():
+        for (survey, items) in imap_unordered(
+            list_attachments, survey_ids, concurrency
+        ):
+            paths = attachments.local_paths(out, survey, items)
+            for (item, path) in zip(items, paths):
+                yield (survey, item, path)
+
+    def download(file):
+        (survey, item, path) = file
+        (url, same_host) = attachments.attachment_url(
+            client.scheme, client.host, survey, item
+        )
+        try:
+            status = attachments.download(
+                url,
+                auth if same_host else None,
+                headers,
+                path,
+                attachments.size(item),
+                attachments.checksum(item),
+            )
+            return (status, path, None)
+        except Exception as error:
+            return ("failed", path, str(error))
+
+    summary = {"downloaded": 0, "resumed": 0, "skipped": 0, "failed": 0}
+    errors = []
+    for (status, path, error) in imap_unordered(download, files(), concurrency):
+        summary[status] += 1
+        if error is not None:
+            errors.append({"path": path, "error": error})
+    summary["errors"] = errors
+
+    return format_output(summary, params)
+
+
+@register_command("mirror", "surveys")
+def mirror_surveys(params):
+    import cartographer.mirror as mirror
+
+    workspace = params["workspace"]
+    module = params["module"]
+    order = params["order"]
+    time_field = params["timestamp_field"] or "updated"
+    incremental = mirror.is_newest_first(order, time_field) and not params["full"]
+
+    client = api_client(params)
+
+    store = mirror.Store(params["db"] or mirror.default_path())
+    try:
+        pages = client.survey_search_pages(
+            module,
+            workspace,
+            order=order,
+            format=params["format"],
+            page_size=params["page_size"],
+            concurrency=params["concurrency"],
+            engine=params["engine"],
+        )
+        summary = mirror.sync_surveys(
+            store,
+            workspace,
+            module,
+            pages,
+            incremental,
+            params["id_field"] or "id",
+            time_field,
+        )
+    finally:
+        store.close()
+
+    return format_output(summary, params)
+
+
+@register_command("mirror", "users")
+def mirror_users(params):
+    import cartographer.mirror as mirror
+
+    workspace = params["workspace"]
+
+    client = api_client(params)
+
+    store = mirror.Store(params["db"] or mirror.default_path())
+    try:
+        pages = client.user_search_pages(
+            workspace,
+            page_size=params["page_size"],
+            concurrency=params["concurrency"],
+            engine=params["engine"],
+        )
+        total = store.replace_users(workspace, pages)
+    finally:
+        store.close()
+
+    return format_output({"workspace": workspace, "total": total}, params)
+
+
+@register_command("mirror", "features")
+def mirror_features(params):
+    import cartographer.mirror as mirror
+
+    workspace = params["workspace"]
+    layer = params["layer"]
+
+    client = api_client(params)
+
+    store = mirror.Store(params["db"] or mirror.default_path())
+    try:
+        summary = mirror.sync_features(store, client, workspace, layer)
+    finally:
+        store.close()
+
+    return format_output(summary, params)
+
+
+@register_command("version")
+def version(params):
+    return format_output(api_client(params, raw=True).version(), params)
+
+
+@register_command("batch")
+def batch_run(params):
+    import cartographer
+    import cartographer.batch as batch
+    from cartographer.args import global_options
+
+    # Global options given to `batch` apply to every line, unless the line
+    # sets them itself. Values that came from the profile aren't passed on,
+    # so a line can use another profile. (The batch's --trace already
+    # records every line.)
+    profile = read_profile(params["profile"])
+    defaults = {}
+    for name in global_options():
+        value = params.get(name, None)
+        if name == "trace" or value is None or value is False:
+            continue
+        if value != profile.get(name, None):
+            defaults[name] = value
+
+    profiles = {}
+
+    def run_argv(argv):
+        args = read_args(argv, defaults)
+        if args["command"] == "batch":
+            raise ValueError("Batches cannot be nested")
+        if find_command(args["command"], args.get("subcommand", None)) is None:
+            raise ValueError("Command not found: {}".format(" ".join(argv)))
+        if args["profile"] not in profiles:
+            profiles[args["profile"]] = read_profile(args["profile"])
+        # As a command on its own would run (e.g. with its own --trace):
+        output = []
+        cartographer.run(build_params(args, profiles[args["profile"]]), output.append)
+        return output
+
+    return batch.run_batch(batch.read_lines(params["file"]), run_argv)
+
+
+@register_command("serve")
+def serve(params):
+    import cartographer.daemon as daemon
+
+    daemon.serve(params["socket"] or daemon.socket_path(), params["idle_timeout"])
+    return b""
+
+
+# Output formats --------------------------------
+
+
+def format_items(items, params):
+    # Writes a list (or iterator) of records as a JSON array, NDJSON
+    # or a columnar file, to --out if given:
+    import cartographer.fetch as fetch
+    import cartographer.stream as stream
+
+    output = params["output"]
+    if output == "columnar":
+        import cartographer.columnar as columnar
+
+        if not params["out"]:
+            sys.exit("--output columnar needs --out FILE")
+        return format_output(columnar.write(params["out"], items), params)
+    elif output == "ndjson":
+        ans = fetch.format_ndjson(items)
+    else:
+        ans = format_output(list(items), params)
+    return stream.redirect(ans, params.get("out", None))
+
+
+def format_pages(pages, params):
+    import cartographer.fetch as fetch
+    import cartographer.stream as stream
+
+    if params["output"] in ("ndjson", "columnar"):
+        return format_items((item for page in pages for item in page), params)
+    ans = fetch.format_json_pages(pages, 2 if params["pretty"] else None)
+    return stream.redirect(ans, params["out"])
+
+
+def format_features(features, params):
+    # Features we've already parsed, as GeoJSON unless asked otherwise:
+    import cartographer.stream as stream
+
+    if params["output"] in ("ndjson", "columnar"):
+        return format_items(features, params)
+    collection = {"type": "FeatureCollection", "features": features}
+    return stream.redirect(format_output(collection, params), params["out"])
+
+
+# Running commands ------------------------------
+
+
+def find_command(cmd_name, sub_name):
+    cmd = commands.get(cmd_name, None)
+    if cmd is None or callable(cmd):
+        return cmd
+    else:
+        return cmd.get(sub_name, None)
+
+
+def run_command(params):
+    cmd_name = params.get("command", None)
+    sub_name = params.get("subcommand", None)
+    cmd = find_command(cmd_name, sub_name)
+
+    if cmd is None:
+        sys.stderr.write("Command not found: {} {}".format(cmd_name, sub_name))
+        return b""
+
+    if params.get("all_workspaces", False):
+        import cartographer.fanout as fanout
+        import cartographer.stream as stream
+
+        if params["workspace"] is not None:
+            sys.exit("--all-workspaces cannot be combined with --workspace")
+        if params.get("output", None) == "columnar":
+            sys.exit("--all-workspaces cannot be combined with --output columnar")
+
+        ans = fanout.run_all_workspaces(params, run_command)
+        return stream.redirect(ans, params.get("out", None))
+
+    return cmd(params)
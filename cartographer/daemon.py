@@ -0,0 +1,419 @@
+import io
+import os
+import struct
+import sys
+import threading
+
+# `cartographer serve` runs commands for the CLI in a long-lived process,
+# so they skip interpreter startup and reuse warm connections, session
+# tokens and caches. If $CARTOGRAPHER_DAEMON is set, the CLI connects to
+# the daemon's Unix socket and sends its working directory, whether stdout
+# and stderr are terminals, the number of environment variables, the
+# variables that affect a command ("NAME=value") and its arguments, all
+# separated by NUL bytes (which can't occur in any of them). The daemon
+# sends back frames (a kind byte, a uint32 length and a payload):
+#
+#     "o" / "e"   output for stdout / stderr
+#     "i"         a request for more of stdin, which the CLI answers
+#                 with an "i" frame (empty at end of file)
+#     "x"         the exit status, which ends the command
+#
+# Commands run one at a time; other clients wait until it's their turn.
+# This module is imported on every run of the CLI, before its arguments are
+# parsed, so it imports as little as it can (`socket` only once there's
+# a daemon to talk to).
+
+header = struct.Struct(">cI")
+input_chunk = 64 * 1024
+
+
+def socket_path():
+    path = os.getenv("CARTOGRAPHER_SOCKET")
+    if path:
+        return path
+    base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.getenv("HOME"), ".cache")
+    return os.path.join(base, "cartographer", "daemon.sock")
+
+
+class Channel(object):
+    # Frames over a connected socket. Sending is thread-safe, since worker
+    # threads can write to stderr while a command runs:
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def send(self, kind, data=b""):
+        with self.lock:
+            self.sock.sendall(header.pack(kind, len(data)) + data)
+
+    def receive(self):
+        # Returns (kind, payload), or (None, None) if the other end hung up:
+        head = self.read_exactly(header.size)
+        if head is None:
+            return (None, None)
+        (kind, length) = header.unpack(head)
+        return (kind, self.read_exactly(length) if length else b"")
+
+    def read_exactly(self, length):
+        data = b""
+        while len(data) < length:
+            chunk = self.sock.recv(length - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
+
+
+# Client ========================================
+
+
+def enabled():
+    # Commands only go to the daemon if you ask for it:
+    if os.getenv("CARTOGRAPHER_NO_DAEMON"):
+        return False
+    return os.getenv("CARTOGRAPHER_DAEMON", "") not in ("", "0")
+
+
+def should_forward(argv):
+    # Everything except `serve` itself goes to the daemon, unless --no-daemon.
+    # (Invalid options are left for this process to report.)
+    from cartographer.args import command_name, read_global_args, trace_to_stderr
+
+    argv = trace_to_stderr(argv)
+    global_args = read_global_args(argv)
+    if global_args is None or global_args[0]["no_daemon"]:
+        return False
+    return command_name(argv) != "serve"
+
+
+def is_forwarded_variable(name):
+    # Variables that change what a command does: where its profile and
+    # caches are, our own settings, and how `requests` connects:
+    return name in forwarded_variables or name.startswith("CARTOGRAPHER_")
+
+
+forwarded_variables = set(
+    [
+        "HOME",
+        "XDG_CACHE_HOME",
+        "XDG_DATA_HOME",
+        "HTTP_PROXY",
+        "HTTPS_PROXY",
+        "NO_PROXY",
+        "ALL_PROXY",
+        "http_proxy",
+        "https_proxy",
+        "no_proxy",
+        "all_proxy",
+        "REQUESTS_CA_BUNDLE",
+        "CURL_CA_BUNDLE",
+        "SSL_CERT_FILE",
+    ]
+)
+
+
+def encode_request(fields):
+    # Arguments are bytes on Python 2 and str on Python 3:
+    return b"\0".join(
+        field if isinstance(field, bytes) else os.fsencode(field) for field in fields
+    )
+
+
+def decode_request(data):
+    fields = data.split(b"\0")
+    if sys.version_info[0] >= 3:
+        fields = [os.fsdecode(field) for field in fields]
+    return fields
+
+
+def write_all(fd, data):
+    while data:
+        data = data[os.write(fd, data) :]
+
+
+def forward(argv):
+    # Runs a command in the daemon and returns its exit status,
+    # or None if no daemon is running:
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+
+    import socket
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+
+    ttys = ["1" if stream.isatty() else "" for stream in (sys.stdout, sys.stderr)]
+    environment = [
+        "{}={}".format(name, value)
+        for (name, value) in sorted(os.environ.items())
+        if is_forwarded_variable(name)
+    ]
+    fields = [os.getcwd()] + ttys + [str(len(environment))] + environment
+    channel = Channel(sock)
+    try:
+        channel.send(b"r", encode_request(fields + list(argv)))
+        while True:
+            (kind, data) = channel.receive()
+            if kind is None:
+                sys.stderr.write("The cartographer daemon stopped unexpectedly\n")
+                return 1
+            elif kind == b"o":
+                write_all(sys.stdout.fileno(), data)
+            elif kind == b"e":
+                write_all(sys.stderr.fileno(), data)
+            elif kind == b"i":
+                channel.send(b"i", os.read(sys.stdin.fileno(), input_chunk))
+            elif kind == b"x":
+                return int(data)
+    finally:
+        sock.close()
+
+
+# Daemon ========================================
+
+# Settings that change how `create_client` builds the HTTP client.
+# Commands with the same settings share one warm client:
+client_settings = [
+    "profile",
+    "pool_size",
+    "concurrency",
+    "engine",
+    "keep_alive",
+    "no_keep_alive",
+    "connect_timeout",
+    "read_timeout",
+    "cache",
+    "cache_ttl",
+    "cache_size",
+    "memo_size",
+    "token_cache",
+    "no_token_cache",
+    "compression",
+    "no_compression",
+    "gzip_uploads",
+    "retries",
+    "rate_limit",
+]
+
+
+class RemoteInput(io.RawIOBase):
+    # The client's stdin, read on demand:
+    def __init__(self, channel):
+        self.channel = channel
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.eof:
+            return 0
+        self.channel.send(b"i")
+        (kind, data) = self.channel.receive()
+        if kind != b"i":
+            raise IOError("The client hung up")
+        self.eof = not data
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class RemoteOutput(object):
+    # Stands in for sys.stdout or sys.stderr while a command runs:
+    def __init__(self, channel, kind, tty):
+        self.channel = channel
+        self.kind = kind
+        self.tty = tty
+
+    def write(self, data):
+        if not isinstance(data, bytes):
+            data = data.encode("utf-8")
+        if data:
+            self.channel.send(self.kind, data)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return self.tty
+
+
+def exit_status(error):
+    # What the interpreter does with an uncaught SystemExit:
+    if error.code is None:
+        return 0
+    elif isinstance(error.code, int):
+        return error.code
+    sys.stderr.write("{}\n".format(error.code))
+    return 1
+
+
+def use_environment(environment):
+    # Replaces the forwarded variables with the client's,
+    # and returns what to restore afterwards:
+    saved = dict(
+        (name, value)
+        for (name, value) in os.environ.items()
+        if is_forwarded_variable(name)
+    )
+    for name in saved:
+        del os.environ[name]
+    os.environ.update(environment)
+    return saved
+
+
+def restore_environment(saved):
+    for name in [name for name in os.environ if is_forwarded_variable(name)]:
+        del os.environ[name]
+    os.environ.update(saved)
+
+
+class Daemon(object):
+    def __init__(self):
+        self.clients = {}
+
+    def client(self, params, environment):
+        # The environment decides e.g. where tokens are cached and which
+        # proxy to use, so clients are only shared with the same one:
+        import cartographer
+
+        key = tuple(params.get(name, None) for name in client_settings)
+        key += tuple(sorted(environment.items()))
+        if key not in self.clients:
+            self.clients[key] = cartographer.create_client(params, shared=True)
+        return self.clients[key]
+
+    def run(self, argv, environment):
+        import cartographer
+        import cartographer.fetch as fetch
+        from cartographer.args import read_args
+        from cartographer.profile import build_params, read_profile
+
+        args = read_args(argv)
+        if args["command"] == "serve":
+            sys.exit("The daemon is already running")
+        params = build_params(args, read_profile(args["profile"]))
+        client = self.client(params, environment)
+        if client.memo is not None:
+            # Each command should see the server's current data:
+            client.memo.clear()
+        fetch.set_client(client)
+        cartographer.run(params, sys.stdout.write)
+        return 0
+
+    def handle(self, channel):
+        import traceback
+
+        import requests
+
+        import cartographer.fetch as fetch
+
+        (kind, data) = channel.receive()
+        if kind != b"r":
+            return
+        fields = decode_request(data)
+        (directory, stdout_tty, stderr_tty, count) = fields[:4]
+        count = int(count)
+        environment = dict(field.split("=", 1) for field in fields[4 : 4 + count])
+        argv = fields[4 + count :]
+
+        (stdin, stdout, stderr) = (sys.stdin, sys.stdout, sys.stderr)
+        cwd = os.getcwd()
+        saved = use_environment(environment)
+        sys.stdin = io.BufferedReader(RemoteInput(channel))
+        if sys.version_info[0] >= 3:
+            sys.stdin = io.TextIOWrapper(sys.stdin, encoding="utf-8")
+        sys.stdout = RemoteOutput(channel, b"o", bool(stdout_tty))
+        sys.stderr = RemoteOutput(channel, b"e", bool(stderr_tty))
+        try:
+            os.chdir(directory)
+            status = self.run(argv, environment)
+        except SystemExit as error:
+            status = exit_status(error)
+        except requests.HTTPError as error:
+            # As bin/cartographer reports them:
+            sys.stdout.write("{}\n".format(error))
+            try:
+                body = fetch.format_json(error.response.json())
+            except ValueError:
+                body = error.response.text
+            sys.stdout.write("{}\n".format(body))
+            status = 0
+        except Exception:
+            sys.stderr.write(traceback.format_exc())
+            status = 1
+        finally:
+            os.chdir(cwd)
+            restore_environment(saved)
+            (sys.stdin, sys.stdout, sys.stderr) = (stdin, stdout, stderr)
+        channel.send(b"x", str(status).encode("ascii"))
+
+
+def listen(path):
+    # Binds the socket, replacing one left behind by a daemon that died:
+    import socket
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory, 0o700)
+    if os.path.exists(path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except socket.error:
+            os.remove(path)
+        else:
+            sys.exit("A daemon is already running on {}".format(path))
+        finally:
+            probe.close()
+
+    # The socket runs commands with our credentials, so it must never be
+    # connectable by anyone else, even for a moment:
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        listener.bind(path)
+    finally:
+        os.umask(umask)
+    os.chmod(path, 0o600)
+    listener.listen(64)
+    return listener
+
+
+def serve(path, idle_timeout=None):
+    # Runs commands from the socket at `path` until interrupted,
+    # or until nothing has connected for `idle_timeout` seconds:
+    import signal
+    import socket
+
+    # Import the commands now, so the first request doesn't pay for it:
+    import cartographer.commands
+
+    listener = listen(path)
+    listener.settimeout(idle_timeout)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    sys.stderr.write("Listening on {}\n".format(path))
+    daemon = Daemon()
+    try:
+        while True:
+            try:
+                (sock, address) = listener.accept()
+            except socket.timeout:
+                break
+            sock.settimeout(None)
+            try:
+                daemon.handle(Channel(sock))
+            except socket.error:
+                # The client went away (e.g. Ctrl-C), so there's no one to tell:
+                pass
+            finally:
+                sock.close()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.remove(path)
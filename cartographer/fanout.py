@@ -0,0 +1,53 @@
+import collections
+
+import cartographer.fetch as fetch
+from cartographer.batch import collect_output, error_fields, output_fields
+from cartographer.workers import imap_ordered, imap_unordered
+
+default_concurrency = 4
+
+
+def list_workspaces(params):
+    from cartographer.commands import api_client
+
+    workspaces = api_client(params).workspace_search()
+    return [workspace.get("alias") or workspace["id"] for workspace in workspaces]
+
+
+def tag(workspace, fields):
+    # Every line starts with the workspace, then the result or error:
+    record = collections.OrderedDict([("workspace", workspace)])
+    record.update(fields)
+    return record
+
+
+def run_all_workspaces(params, run_command):
+    # Runs the command once per workspace and merges the results into
+    # NDJSON, one line per record, tagged with the workspace it came from.
+    # Lines arrive in the order the workspaces finish, or with --ordered
+    # in the order they are listed:
+    workspaces = list_workspaces(params)
+    concurrency = params["workspace_concurrency"] or default_concurrency
+    imap = imap_ordered if params.get("ordered", None) else imap_unordered
+
+    def run(workspace):
+        workspace_params = dict(
+            params, workspace=workspace, all_workspaces=False, output=None, out=None
+        )
+        try:
+            return (
+                workspace,
+                output_fields(collect_output(run_command(workspace_params))),
+            )
+        except SystemExit as error:
+            return (workspace, {"error": "Invalid command ({})".format(error.code)})
+        except Exception as error:
+            return (workspace, error_fields(error))
+
+    for workspace, fields in imap(run, workspaces, concurrency):
+        if isinstance(fields.get("result", None), list):
+            records = [{"result": item} for item in fields["result"]]
+        else:
+            records = [fields]
+        for record in records:
+            yield fetch.format_json(tag(workspace, record)) + "\n"
@@ -1,5 +1,16 @@
 import requests
+import collections
+import copy
+import email.utils
+import hashlib
 import json
+import random
+import socket
+import threading
+import time
+import zlib
+
+import urllib3
 
 cert = None  # 'charles-ssl-proxying-certificate.pem'
 
@@ -39,8 +50,152 @@ def create_headers(token=None):
 # Responses -------------------------------------
 
 
-def format_json(data):
-    return json.dumps(data, sort_keys=False)
+class RawJSON(bytes):
+    # A JSON document exactly as the server sent it. `format_json` writes it
+    # out unchanged, so passing a response through doesn't cost us a decode
+    # and an encode:
+    pass
+
+
+def format_json(data, indent=None):
+    if isinstance(data, RawJSON):
+        return data
+    if not hooks:
+        return json.dumps(data, sort_keys=False, indent=indent)
+    start = time.time()
+    text = json.dumps(data, sort_keys=False, indent=indent)
+    emit(
+        {"event": "encode", "bytes": len(text), "ms": milliseconds(time.time() - start)}
+    )
+    return text
+
+
+def decode_json(response):
+    if not hooks:
+        return response.json()
+    start = time.time()
+    data = response.json()
+    emit(
+        {
+            "event": "decode",
+            "url": response.url,
+            "bytes": len(response.content),
+            "ms": milliseconds(time.time() - start),
+        }
+    )
+    return data
+
+
+def format_json_pages(pages, indent=None):
+    # Writes a sequence of pages as a single JSON array, one page at a time
+    # (laid out like `format_json` would lay out the whole array):
+    if indent is None:
+        (separator, prefix, end) = (", ", "", "")
+    else:
+        (separator, prefix, end) = (",\n", " " * indent, "\n")
+    yield "["
+    first = True
+    for page in pages:
+        for item in page:
+            text = format_json(item, indent).replace("\n", "\n" + prefix)
+            yield (end if first else separator) + prefix + text
+            first = False
+    yield "]" if first else end + "]"
+
+
+def format_ndjson(items, buffer_size=64 * 1024):
+    # Writes one record per line, batching lines to avoid a write per record:
+    lines = []
+    size = 0
+    for item in items:
+        line = format_json(item) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= buffer_size:
+            yield "".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        yield "".join(lines)
+
+
+def format_ndjson_pages(pages):
+    return format_ndjson(item for page in pages for item in page)
+
+
+# Compression -----------------------------------
+
+# Responses are requested compressed (unless the client is created with
+# `compression=False`) and decompressed as they're read. Request bodies are
+# only gzipped if the client is given a `gzip_uploads` size, as not every
+# server accepts compressed requests.
+accept_encodings = "gzip, deflate"
+
+
+class GzipBody(bytes):
+    # A gzipped request body, which remembers its size before compression
+    # for tracing:
+    pass
+
+
+def gzip_body(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    body = GzipBody(compressor.compress(data) + compressor.flush())
+    body.uncompressed_size = len(data)
+    return body
+
+
+def encode_body(payload, headers, gzip_size=None):
+    # The body and headers for sending `payload` as JSON:
+    data = json.dumps(payload).encode("utf-8")
+    headers = dict(headers, **{"Content-Type": "application/json"})
+    if gzip_size is not None and len(data) >= gzip_size:
+        data = gzip_body(data)
+        headers["Content-Encoding"] = "gzip"
+    return (data, headers)
+
+
+class DeflateDecoder(object):
+    # "deflate" bodies should be zlib streams, but some servers send
+    # raw deflate data instead:
+    def __init__(self):
+        self.decoder = zlib.decompressobj()
+        self.started = False
+
+    def decompress(self, data):
+        if self.started or not data:
+            return self.decoder.decompress(data)
+        self.started = True
+        try:
+            return self.decoder.decompress(data)
+        except zlib.error:
+            self.decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self.decoder.decompress(data)
+
+    def flush(self):
+        return self.decoder.flush()
+
+
+def content_decoder(encoding):
+    # An incremental decompressor (with `decompress` and `flush`) for
+    # a Content-Encoding, or None if the body isn't compressed:
+    encoding = (encoding or "").strip().lower()
+    if encoding in ("gzip", "x-gzip"):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    elif encoding == "deflate":
+        return DeflateDecoder()
+    elif encoding in ("", "identity"):
+        return None
+    raise ValueError("Unsupported Content-Encoding: {}".format(encoding))
+
+
+def wire_size(response):
+    # The size of a response body as it was sent, before decompression.
+    # The asyncio engine records it, and urllib3 counts what it has read:
+    size = getattr(response, "wire_size", None)
+    if size is None and hasattr(response.raw, "tell"):
+        size = response.raw.tell()
+    return size
 
 
 # Requests -------------------------------------
@@ -64,27 +219,768 @@ def handle_http_errors(response):
         raise requests.HTTPError(msg, response=response)
 
 
-def get(url, auth, headers):
-    response = requests.get(url, headers=headers, auth=auth, verify=cert)
-    handle_http_errors(response)
-    return response
+def credential_hash(value):
+    if not isinstance(value, bytes):
+        value = value.encode("utf-8")
+    return hashlib.sha256(value).hexdigest()
+
+
+def auth_identity(auth, headers):
+    # Identifies the user a request is made on behalf of, for caching. This
+    # includes a hash of their password or token, so a wrong password can't
+    # be answered from what the right one cached:
+    identity = getattr(auth, "username", None) or ""
+    password = getattr(auth, "password", None)
+    if password is not None:
+        identity += ":" + credential_hash(password)
+    if "Authorization" in headers:
+        identity += ":" + credential_hash(headers["Authorization"])
+    return identity
+
+
+def login_token(data):
+    # Finds the session token in a response from /v1/auth/login:
+    if isinstance(data, dict):
+        if data.get("token"):
+            return data["token"]
+        credentials = data.get("credentials", None)
+        if isinstance(credentials, dict) and credentials.get("token"):
+            return credentials["token"]
+    return None
+
+
+class SessionAuth(requests.auth.AuthBase):
+    # Authenticates with a Bearer session token, logging in with the user's
+    # email and password the first time we need one. Tokens are remembered
+    # between runs. Falls back to Basic auth if the server doesn't issue one.
+    def __init__(self, client, login_url, username, password, key):
+        self.client = client
+        self.login_url = login_url
+        self.username = username
+        self.password = password
+        self.key = key
+        self.lock = threading.Lock()
+        self.token = None
+        self.fallback = False
+
+    def __call__(self, request):
+        token = self.current_token()
+        if token is None:
+            return basic_auth(self.username, self.password)(request)
+        request.headers["Authorization"] = "Bearer {}".format(token)
+        return request
+
+    def needs_login(self):
+        # Whether `current_token` would have to log in:
+        return self.token is None and not self.fallback
+
+    def current_token(self):
+        with self.lock:
+            if self.token is None and not self.fallback:
+                self.token = self.client.tokens.load(self.key) or self.login()
+            return self.token
+
+    def expire(self, request):
+        # Forgets the token used for `request` so the next call logs in again.
+        # Returns False if we weren't using a token:
+        with self.lock:
+            if self.token is None:
+                return False
+            if request.headers.get("Authorization") == "Bearer {}".format(self.token):
+                self.token = None
+                self.client.tokens.remove(self.key)
+            return True
+
+    def login(self):
+        body = {"email": self.username, "password": self.password}
+        (data, headers) = encode_body(body, {}, self.client.gzip_uploads)
+        response = self.client.session.post(
+            self.login_url,
+            data=data,
+            headers=headers,
+            verify=cert,
+            timeout=self.client.timeout,
+        )
+        handle_http_errors(response)
+        token = login_token(response.json())
+        if token is None:
+            self.fallback = True
+        else:
+            self.client.tokens.save(self.key, token)
+        return token
+
+
+# Scheduling ------------------------------------
+
+# Statuses worth retrying. The server didn't process requests that were
+# throttled (429) or refused while unavailable (503), so those are safe
+# to retry for any method. The rest are only retried for idempotent ones:
+retry_statuses = set([429, 500, 502, 503, 504])
+unprocessed_statuses = set([429, 503])
+idempotent_methods = set(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+
+
+def retry_after(response):
+    # Seconds to wait from a Retry-After header (delta-seconds or HTTP-date):
+    value = response.headers.get("Retry-After", None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        date = email.utils.parsedate_tz(value)
+        if date is None:
+            return None
+        return max(0.0, email.utils.mktime_tz(date) - time.time())
+
+
+def backoff(attempt, base=0.5, cap=30.0):
+    # Exponential backoff with "full jitter", so concurrent workers
+    # that failed together don't all retry together:
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class RateLimiter(object):
+    # A token bucket shared by every thread using the client.
+    # A `rate` of None means unlimited, but we still honour `pause`,
+    # which holds everyone back after the server tells us to slow down:
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.capacity = max(1.0, burst or rate or 1.0)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        # Takes a token if one is available and returns 0,
+        # otherwise returns the number of seconds to wait before trying again:
+        with self.lock:
+            now = time.time()
+            wait = self.paused_until - now
+            if wait > 0:
+                return wait
+            if self.rate is None:
+                return 0
+            elapsed = now - self.updated
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        # Returns the number of seconds we waited:
+        waited = 0.0
+        wait = self.reserve()
+        while wait > 0:
+            time.sleep(wait)
+            waited += wait
+            wait = self.reserve()
+        return waited
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.time() + seconds)
+
+
+# Tracing ---------------------------------------
+
+# Hooks are called with a dict describing each request the client sends,
+# and each response body it decodes or record it encodes, e.g.:
+#
+#     {"event": "request", "method": "GET", "url": "...", "status": 200,
+#      "retries": 0, "bytes_sent": 0, "bytes_received": 5120, "ms": 84.2,
+#      "phases": {"dns": 1.1, "connect": 10.3, "tls": 22.4, "wait": 40.1,
+#                 "download": 10.3}}
+#     {"event": "decode", "url": "...", "bytes": 5120, "ms": 0.9}
+#     {"event": "encode", "bytes": 312, "ms": 0.1}
+#
+# Times are in milliseconds. "dns", "connect" and "tls" only appear when the
+# request opened a new connection, "throttle" is time spent waiting for the
+# rate limiter and "backoff" time spent waiting between retries. Streamed
+# responses are reported once the caller has read (or closed) the body,
+# with the time that took as "download".
+# Byte counts are of bodies as sent over the network. Compressed bodies
+# also have "encoding_sent" or "encoding_received" (e.g. "gzip") and
+# "bytes_sent_uncompressed" or "bytes_received_decoded".
+# Hooks may be called from several threads at once.
+hooks = []
+
+# The phases of the request being sent on this thread (None if not tracing):
+timings = threading.local()
+
+
+def add_hook(hook):
+    hooks.append(hook)
+
+
+def remove_hook(hook):
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+def emit(event):
+    for hook in list(hooks):
+        hook(event)
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+def record_phase(name, seconds):
+    phases = getattr(timings, "phases", None)
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+def open_socket(connection, base):
+    # Resolves the host ourselves so DNS and TCP can be timed separately,
+    # then tries each address in turn as urllib3 would:
+    if getattr(timings, "phases", None) is None:
+        return base._new_conn(connection)
+
+    host = getattr(connection, "_dns_host", connection.host)
+    start = time.time()
+    try:
+        addresses = socket.getaddrinfo(
+            host,
+            connection.port,
+            urllib3.util.connection.allowed_gai_family(),
+            socket.SOCK_STREAM,
+        )
+    except socket.error:
+        # Let urllib3 report the failure the way it usually does:
+        return base._new_conn(connection)
+    resolved = time.time()
+    record_phase("dns", resolved - start)
+
+    error = None
+    sock = None
+    try:
+        for address in addresses:
+            connection._dns_host = address[4][0]
+            try:
+                sock = base._new_conn(connection)
+                break
+            except urllib3.exceptions.ConnectTimeoutError as e:
+                error = e
+    finally:
+        connection._dns_host = host
+    if sock is None:
+        raise error
+
+    connected = time.time()
+    record_phase("connect", connected - resolved)
+    connection.dialled = connected - start
+    return sock
+
+
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def _new_conn(self):
+        return open_socket(self, urllib3.connection.HTTPConnection)
+
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def _new_conn(self):
+        return open_socket(self, urllib3.connection.HTTPSConnection)
+
+    def connect(self):
+        self.dialled = 0.0
+        start = time.time()
+        urllib3.connection.HTTPSConnection.connect(self)
+        record_phase("tls", time.time() - start - self.dialled)
+
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(requests.adapters.HTTPAdapter):
+    # Opens connections that record how long DNS, TCP and TLS took:
+    def init_poolmanager(self, *args, **kwargs):
+        requests.adapters.HTTPAdapter.init_poolmanager(self, *args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class RequestTrace(object):
+    # Collects the timings of one call to `Client.send`, across retries,
+    # and emits them when it's done:
+    def __init__(self, method, url, data, stream):
+        self.method = method
+        self.url = url
+        self.bytes_sent = len(data or "")
+        self.uncompressed = getattr(data, "uncompressed_size", None)
+        self.stream = stream
+        self.started = time.time()
+        self.waits = {}
+        self.phases = {}
+        self.seconds = 0.0
+
+    def wait(self, name, seconds):
+        if seconds:
+            self.waits[name] = self.waits.get(name, 0.0) + seconds
+
+    def run(self, attempt):
+        timings.phases = {}
+        start = time.time()
+        try:
+            return attempt()
+        finally:
+            self.record(timings.phases, time.time() - start)
+            timings.phases = None
+
+    def record(self, phases, seconds):
+        # The phases of the latest attempt:
+        self.phases = phases
+        self.seconds = seconds
+
+    def finish(self, retries, response=None, error=None):
+        phases = dict(self.waits)
+        phases.update(self.phases)
+        event = {
+            "event": "request",
+            "method": self.method,
+            "url": self.url,
+            "status": None,
+            "retries": retries,
+            "bytes_sent": self.bytes_sent,
+            "bytes_received": None,
+            "ms": milliseconds(time.time() - self.started),
+        }
+        if self.uncompressed is not None:
+            event["encoding_sent"] = "gzip"
+            event["bytes_sent_uncompressed"] = self.uncompressed
+        if error is not None:
+            event["error"] = str(error)
+        if response is None:
+            self.report(event, phases)
+            return
+
+        event["status"] = response.status_code
+        if "wait" not in phases:
+            # `elapsed` runs until the headers arrive, including any
+            # time spent opening the connection:
+            headers = response.elapsed.total_seconds()
+            setup = sum(phases.get(name, 0.0) for name in ["dns", "connect", "tls"])
+            phases["wait"] = max(0.0, headers - setup)
+            if not self.stream:
+                phases["download"] = max(0.0, self.seconds - headers)
+        encoding = response.headers.get("Content-Encoding", None)
+        if encoding:
+            event["encoding_received"] = encoding
+
+        def received(size, decoded):
+            if encoding:
+                event["bytes_received"] = size
+                event["bytes_received_decoded"] = decoded
+            else:
+                event["bytes_received"] = decoded
+
+        if not self.stream:
+            received(wire_size(response), len(response.content))
+            self.report(event, phases)
+            return
+
+        # The body of a streamed response hasn't been read yet,
+        # so the event waits until it has (or the response is closed):
+        def done(seconds, decoded):
+            phases["download"] = seconds
+            received(wire_size(response), decoded)
+            event["ms"] = milliseconds(time.time() - self.started)
+            self.report(event, phases)
+
+        watch_body(response, done)
+
+    def report(self, event, phases):
+        event["phases"] = dict(
+            (name, milliseconds(seconds)) for (name, seconds) in phases.items()
+        )
+        emit(event)
+
+
+def watch_body(response, done):
+    # Calls `done(seconds, decoded bytes)` once a streamed response's body
+    # has been read, or once the response is closed if that's sooner:
+    iter_content = response.iter_content
+    close = response.close
+    started = time.time()
+    state = {"decoded": 0, "done": False}
+
+    def finish():
+        if not state["done"]:
+            state["done"] = True
+            done(time.time() - started, state["decoded"])
+
+    def watched_iter_content(*args, **kwargs):
+        for chunk in iter_content(*args, **kwargs):
+            state["decoded"] += len(chunk)
+            yield chunk
+        finish()
+
+    def watched_close():
+        finish()
+        close()
+
+    response.iter_content = watched_iter_content
+    response.close = watched_close
+
+
+class NoTrace(object):
+    # Stands in for `RequestTrace` when nobody is listening:
+    def wait(self, name, seconds):
+        pass
+
+    def run(self, attempt):
+        return attempt()
+
+    def record(self, phases, seconds):
+        pass
+
+    def finish(self, retries, response=None, error=None):
+        pass
+
+
+no_trace = NoTrace()
+
+
+def request_trace(method, url, data, stream):
+    if hooks:
+        return RequestTrace(method, url, data, stream)
+    return no_trace
+
+
+# Memoization -----------------------------------
+
+# Batches and fan-outs often repeat a GET (e.g. `module read` for the same
+# module in every workspace). Identical requests share one response: a
+# request that's already in flight is waited for rather than sent again,
+# and finished responses are kept until the memo is full. Emits "memo"
+# events, with the milliseconds spent waiting for the shared request:
+#
+#     {"event": "memo", "url": "...", "bytes": 5120, "ms": 0.0}
+
+
+class InFlight(object):
+    # A request that other threads are waiting for:
+    def __init__(self):
+        self.finished = threading.Event()
+        self.response = None
+        self.error = None
+
+    def finish(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.finished.set()
+
+    def wait(self):
+        self.finished.wait()
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class Memo(object):
+    # Successful GET responses, keyed by URL, user and headers. The least
+    # recently used are dropped when their bodies add up to more than
+    # `max_size` bytes. `clear` forgets everything, including requests in
+    # flight, e.g. after a request that may have changed data:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.responses = collections.OrderedDict()
+        self.size = 0
+        self.in_flight = {}
+        self.generation = 0
+
+    def key(self, url, auth, headers):
+        return (url, auth_identity(auth, headers), tuple(sorted(headers.items())))
+
+    def get(self, key, send):
+        # Returns the response to the request `send` makes, sending it
+        # only if nobody has already:
+        start = time.time()
+        with self.lock:
+            response = self.responses.pop(key, None)
+            if response is not None:
+                self.responses[key] = response
+                (call, leader) = (None, False)
+            else:
+                call = self.in_flight.get(key, None)
+                leader = call is None
+                if leader:
+                    call = self.in_flight[key] = InFlight()
+        if leader:
+            return self.send(key, call, send)
+        if call is not None:
+            response = call.wait()
+        if hooks:
+            emit(
+                {
+                    "event": "memo",
+                    "url": key[0],
+                    "bytes": len(response.content),
+                    "ms": milliseconds(time.time() - start),
+                }
+            )
+        # Callers get their own copy, which shares the (immutable) body:
+        return copy.copy(response)
+
+    def send(self, key, call, send):
+        generation = self.generation
+        try:
+            response = send()
+            if response.status_code == 200:
+                # While we're still in flight, so an identical request
+                # finds one or the other and is never sent twice:
+                self.store(key, response, generation)
+        except BaseException as error:
+            # Including Ctrl-C, so nobody waits for us forever:
+            call.finish(error=error)
+            raise
+        else:
+            call.finish(response)
+        finally:
+            with self.lock:
+                if self.in_flight.get(key, None) is call:
+                    del self.in_flight[key]
+        return response
+
+    def store(self, key, response, generation):
+        size = len(response.content)
+        with self.lock:
+            if generation != self.generation or size > self.max_size:
+                return
+            if key in self.responses:
+                self.size -= len(self.responses.pop(key).content)
+            self.responses[key] = response
+            self.size += size
+            while self.size > self.max_size:
+                (old_key, old) = self.responses.popitem(last=False)
+                self.size -= len(old.content)
+
+    def clear(self):
+        with self.lock:
+            self.responses.clear()
+            self.in_flight.clear()
+            self.size = 0
+            self.generation += 1
+
+
+class Client(object):
+    def __init__(
+        self,
+        pool_size=10,
+        keep_alive=True,
+        connect_timeout=None,
+        read_timeout=None,
+        cache=None,
+        tokens=None,
+        profile=None,
+        retries=0,
+        rate_limit=None,
+        memo_size=0,
+        compression=True,
+        gzip_uploads=None,
+    ):
+        adapter = TimedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+        # Only the encodings we (and the asyncio engine) can decompress:
+        self.session.headers["Accept-Encoding"] = (
+            accept_encodings if compression else "identity"
+        )
+        self.gzip_uploads = gzip_uploads
+        self.timeout = (connect_timeout, read_timeout)
+        self.cache = cache
+        self.tokens = tokens
+        self.profile = profile
+        self.auths = {}
+        self.auths_lock = threading.Lock()
+        self.retries = retries or 0
+        self.limiter = RateLimiter(rate_limit)
+        self.memo = Memo(memo_size) if memo_size else None
+
+    def token_key(self, scheme, host, email):
+        return "{}:{}://{}:{}".format(self.profile, scheme, host, email)
+
+    def user_auth(self, scheme, host, email, password):
+        if self.tokens is None or email is None:
+            return basic_auth(email, password)
+        key = self.token_key(scheme, host, email)
+        with self.auths_lock:
+            auth = self.auths.get(key, None)
+            if auth is None or auth.password != password:
+                login_url = create_url(scheme, host, "/v1/auth/login", {})
+                auth = SessionAuth(self, login_url, email, password, key)
+                self.auths[key] = auth
+        return auth
+
+    def remember_token(self, scheme, host, email, data):
+        token = login_token(data)
+        if self.tokens is not None and token is not None:
+            self.tokens.save(self.token_key(scheme, host, email), token)
+
+    def send(self, method, url, auth, headers, data=None, stream=False):
+        if method != "GET" and self.memo is not None:
+            # The request may change what the memoized GETs would return:
+            self.memo.clear()
+
+        def attempt():
+            return self.session.request(
+                method,
+                url,
+                headers=headers,
+                auth=auth,
+                verify=cert,
+                data=data,
+                timeout=self.timeout,
+                stream=stream,
+            )
+
+        trace = request_trace(method, url, data, stream)
+        idempotent = method in idempotent_methods
+        retry = 0
+        relogged = False
+        while True:
+            trace.wait("throttle", self.limiter.acquire())
+            try:
+                response = trace.run(attempt)
+            except (requests.ConnectionError, requests.Timeout) as error:
+                if not idempotent or retry >= self.retries:
+                    trace.finish(retry, error=error)
+                    raise
+                delay = backoff(retry)
+                trace.wait("backoff", delay)
+                time.sleep(delay)
+                retry += 1
+                continue
+
+            # If our session token has expired, log in again and retry once:
+            if response.status_code == 401 and isinstance(auth, SessionAuth):
+                if not relogged and auth.expire(response.request):
+                    relogged = True
+                    response.close()
+                    continue
+
+            status = response.status_code
+            if (
+                retry >= self.retries
+                or status not in retry_statuses
+                or not (idempotent or status in unprocessed_statuses)
+            ):
+                trace.finish(retry, response)
+                return response
+
+            delay = retry_after(response)
+            if delay is None:
+                delay = backoff(retry)
+            if status == 429:
+                # Everyone sharing the client is being throttled, not just us:
+                self.limiter.pause(delay)
+            response.close()
+            trace.wait("backoff", delay)
+            time.sleep(delay)
+            retry += 1
+
+    def request(self, method, url, auth, headers, payload=None, stream=False):
+        if payload is None:
+            data = None
+        else:
+            (data, headers) = encode_body(payload, headers, self.gzip_uploads)
+        response = self.send(method, url, auth, headers, data, stream)
+        handle_http_errors(response)
+        return response
+
+    def get(self, url, auth, headers, stream=False, cache=False, memo=True):
+        # Pass `memo=False` for responses that aren't worth sharing (e.g. tiles,
+        # which are each fetched once and would push out everything else):
+        if self.memo is None or stream or not memo:
+            return self.send_get(url, auth, headers, stream, cache)
+        key = self.memo.key(url, auth, headers)
+        return self.memo.get(
+            key, lambda: self.send_get(url, auth, headers, stream, cache)
+        )
+
+    def send_get(self, url, auth, headers, stream=False, cache=False):
+        if cache and self.cache is not None and not stream:
+            return self.cached_get(url, auth, headers)
+        else:
+            return self.request("GET", url, auth, headers, stream=stream)
+
+    def cached_get(self, url, auth, headers):
+        key = self.cache.key(url, auth_identity(auth, headers))
+        entry = self.cache.load(key)
+
+        if entry is None:
+            response = self.request("GET", url, auth, headers)
+        else:
+            (meta, body) = entry
+            if self.cache.is_fresh(meta):
+                return self.cache.response(url, meta, body)
+
+            headers = dict(headers, **self.cache.validators(meta))
+            response = self.send("GET", url, auth, headers)
+            if response.status_code == 304:
+                self.cache.refresh(key, meta, body)
+                return self.cache.response(url, meta, body)
+            handle_http_errors(response)
+
+        if response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+client = None
+
+
+def get_client():
+    global client
+    if client is None:
+        client = Client()
+    return client
+
+
+def set_client(new_client):
+    global client
+    client = new_client
+
+
+def get(url, auth, headers, stream=False, cache=False, memo=True):
+    return get_client().get(url, auth, headers, stream, cache, memo)
 
 
 def post(url, auth, headers, payload):
-    response = requests.post(
-        url, headers=headers, auth=auth, verify=cert, data=json.dumps(payload)
-    )
-    handle_http_errors(response)
-    return response
+    return get_client().request("POST", url, auth, headers, payload)
 
 
 def put(url, auth, headers, payload):
-    response = requests.put(
-        url, headers=headers, auth=auth, verify=cert, data=json.dumps(payload)
-    )
-    handle_http_errors(response)
-    return response
+    return get_client().request("PUT", url, auth, headers, payload)
 
 
 def basic_auth(email, password):
     return requests.auth.HTTPBasicAuth(email, password)
+
+
+def user_auth(scheme, host, email, password):
+    return get_client().user_auth(scheme, host, email, password)
+
+
+def remember_token(scheme, host, email, data):
+    get_client().remember_token(scheme, host, email, data)
@@ -0,0 +1,427 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from cartographer.cache import ensure_dir
+import cartographer.spatial as spatial
+
+
+def default_path():
+    base = os.getenv("XDG_DATA_HOME") or os.path.join(
+        os.getenv("HOME"), ".local", "share"
+    )
+    return os.path.join(base, "cartographer", "mirror.sqlite")
+
+
+def field(record, path):
+    # Reads a dotted path like "data.updated" from a record:
+    value = record
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key, None)
+    return value
+
+
+def parse_order(order):
+    # "updated-desc" => ("updated", True):
+    if order is None:
+        return (None, False)
+    for (suffix, descending) in [("-desc", True), ("-asc", False)]:
+        if order.endswith(suffix):
+            return (order[: -len(suffix)], descending)
+    return (order, False)
+
+
+def is_newest_first(order, time_field):
+    # Incremental syncs stop at the first survey older than the last one,
+    # which is only safe if `order` lists the newest surveys first:
+    return parse_order(order) == (time_field, True)
+
+
+def escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def like_pattern(q):
+    # Case-insensitive substring match:
+    return "%" + escape_like(q) + "%"
+
+
+def local_store(path):
+    path = path or default_path()
+    if not os.path.exists(path):
+        sys.exit("No local mirror at {}. Run `cartographer mirror` first".format(path))
+    return Store(path)
+
+
+class Store(object):
+    # A local SQLite copy of survey, user and feature data, with a high-water
+    # mark per workspace/module recording how far we have synced surveys:
+    def __init__(self, path):
+        ensure_dir(os.path.dirname(os.path.abspath(path)))
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS surveys (
+                workspace TEXT NOT NULL,
+                module TEXT NOT NULL,
+                id TEXT NOT NULL,
+                timestamp TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (workspace, module, id)
+            );
+            CREATE INDEX IF NOT EXISTS surveys_timestamp
+                ON surveys (workspace, module, timestamp);
+            CREATE TABLE IF NOT EXISTS users (
+                workspace TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (workspace, id)
+            );
+            CREATE TABLE IF NOT EXISTS user_roles (
+                workspace TEXT NOT NULL,
+                user_id TEXT NOT NULL,
+                role TEXT NOT NULL,
+                PRIMARY KEY (workspace, user_id, role)
+            );
+            CREATE INDEX IF NOT EXISTS user_roles_role
+                ON user_roles (workspace, role);
+            CREATE TABLE IF NOT EXISTS features (
+                workspace TEXT NOT NULL,
+                layer TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (workspace, layer, position)
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                kind TEXT NOT NULL,
+                workspace TEXT NOT NULL,
+                scope TEXT NOT NULL,
+                high_water TEXT,
+                synced_at REAL,
+                PRIMARY KEY (kind, workspace, scope)
+            );
+            """
+        )
+        # Mirrors created before we recorded the timestamp field:
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(sync_state)")]
+        if "field" not in columns:
+            self.db.execute("ALTER TABLE sync_state ADD COLUMN field TEXT")
+        # The bounding box of each feature, keyed by its rowid in `features`.
+        # An R*Tree if SQLite was built with one, otherwise a plain table
+        # (slower on big layers, but the queries are the same):
+        try:
+            self.db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS feature_bounds"
+                " USING rtree(id, min_x, max_x, min_y, max_y)"
+            )
+        except sqlite3.OperationalError:
+            self.db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS feature_bounds (
+                    id INTEGER PRIMARY KEY,
+                    min_x REAL, max_x REAL, min_y REAL, max_y REAL
+                );
+                CREATE INDEX IF NOT EXISTS feature_bounds_x
+                    ON feature_bounds (min_x, max_x);
+                """
+            )
+
+    # Sync state --------------------------------
+
+    def high_water(self, kind, workspace, scope):
+        row = self.db.execute(
+            "SELECT high_water FROM sync_state"
+            " WHERE kind = ? AND workspace = ? AND scope = ?",
+            (kind, workspace or "", scope),
+        ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def set_high_water(self, kind, workspace, scope, value, field=None):
+        self.db.execute(
+            "INSERT OR REPLACE INTO sync_state"
+            " (kind, workspace, scope, high_water, synced_at, field)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (kind, workspace or "", scope, json.dumps(value), time.time(), field),
+        )
+
+    def time_field(self, kind, workspace, scope):
+        row = self.db.execute(
+            "SELECT field FROM sync_state"
+            " WHERE kind = ? AND workspace = ? AND scope = ?",
+            (kind, workspace or "", scope),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    # Surveys -----------------------------------
+
+    def upsert_surveys(self, workspace, module, rows):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO surveys VALUES (?, ?, ?, ?, ?)",
+            [
+                (workspace or "", module, id, timestamp, json.dumps(record))
+                for (id, timestamp, record) in rows
+            ],
+        )
+
+    def count_surveys(self, workspace, module):
+        return self.db.execute(
+            "SELECT COUNT(*) FROM surveys WHERE workspace = ? AND module = ?",
+            (workspace or "", module),
+        ).fetchone()[0]
+
+    def search_surveys(self, workspace, module, q, order, skip, limit):
+        sql = "SELECT data FROM surveys WHERE workspace = ? AND module = ?"
+        args = [workspace or "", module]
+        if q:
+            sql += " AND data LIKE ? ESCAPE '\\'"
+            args.append(like_pattern(q))
+
+        # Ordering by the mirrored timestamp uses the index.
+        # Any other field is sorted in memory:
+        (order_field, descending) = parse_order(order)
+        if order_field is not None and order_field == self.time_field(
+            "surveys", workspace, module
+        ):
+            sql += " ORDER BY timestamp" + (" DESC" if descending else "") + ", id"
+            return self.select(sql, args, skip, limit)
+        else:
+            sql += " ORDER BY id"
+            return self.select(sql, args, skip, limit, order_field, descending)
+
+    # Users -------------------------------------
+
+    def replace_users(self, workspace, pages):
+        # Users have no timestamp, so we swap the whole workspace
+        # in a single transaction:
+        workspace = workspace or ""
+        self.db.execute("DELETE FROM users WHERE workspace = ?", (workspace,))
+        self.db.execute("DELETE FROM user_roles WHERE workspace = ?", (workspace,))
+        count = 0
+        for page in pages:
+            count += len(page)
+            self.db.executemany(
+                "INSERT OR REPLACE INTO users VALUES (?, ?, ?)",
+                [(workspace, user["id"], json.dumps(user)) for user in page],
+            )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO user_roles VALUES (?, ?, ?)",
+                [
+                    (workspace, user["id"], role)
+                    for user in page
+                    for role in user.get("roles") or []
+                ],
+            )
+        self.set_high_water("users", workspace, "", None)
+        self.commit()
+        return count
+
+    def search_users(self, workspace, q, role, order, skip, limit):
+        sql = "SELECT data FROM users WHERE workspace = ?"
+        args = [workspace or ""]
+        if q:
+            sql += " AND data LIKE ? ESCAPE '\\'"
+            args.append(like_pattern(q))
+        if role:
+            # Match "role" exactly, or any qualified "role:workspace":
+            sql += (
+                " AND id IN (SELECT user_id FROM user_roles"
+                " WHERE workspace = ? AND (role = ? OR role LIKE ? ESCAPE '\\'))"
+            )
+            args.extend([workspace or "", role, escape_like(role) + ":%"])
+
+        sql += " ORDER BY id"
+        (order_field, descending) = parse_order(order)
+        return self.select(sql, args, skip, limit, order_field, descending)
+
+    # Features ----------------------------------
+
+    def replace_features(self, workspace, layer, collection, state=None):
+        # Swaps in a new copy of a layer and its spatial index. `state` records
+        # the version we have (see `sync_features`):
+        workspace = workspace or ""
+        features = collection.get("features") or []
+        self.db.execute(
+            "DELETE FROM feature_bounds WHERE id IN"
+            " (SELECT rowid FROM features WHERE workspace = ? AND layer = ?)",
+            (workspace, layer),
+        )
+        self.db.execute(
+            "DELETE FROM features WHERE workspace = ? AND layer = ?",
+            (workspace, layer),
+        )
+
+        # We choose the rowids so we can index features as we insert them:
+        start = self.db.execute("SELECT COALESCE(MAX(rowid), 0) FROM features")
+        start = start.fetchone()[0] + 1
+        self.db.executemany(
+            "INSERT INTO features (rowid, workspace, layer, position, data)"
+            " VALUES (?, ?, ?, ?, ?)",
+            [
+                (start + position, workspace, layer, position, json.dumps(feature))
+                for (position, feature) in enumerate(features)
+            ],
+        )
+        rows = []
+        for (position, feature) in enumerate(features):
+            box = spatial.bounds(feature.get("geometry", None))
+            if box is not None:
+                (min_x, min_y, max_x, max_y) = box
+                rows.append((start + position, min_x, max_x, min_y, max_y))
+        self.db.executemany("INSERT INTO feature_bounds VALUES (?, ?, ?, ?, ?)", rows)
+
+        self.set_high_water("features", workspace, layer, state)
+        self.commit()
+        return len(features)
+
+    def count_features(self, workspace, layer):
+        return self.db.execute(
+            "SELECT COUNT(*) FROM features WHERE workspace = ? AND layer = ?",
+            (workspace or "", layer),
+        ).fetchone()[0]
+
+    def read_features(self, workspace, layer):
+        return self.select(
+            "SELECT data FROM features WHERE workspace = ? AND layer = ?"
+            " ORDER BY position",
+            [workspace or "", layer],
+            None,
+            None,
+        )
+
+    def query_features(self, workspace, layer, box=None, point=None):
+        # Features intersecting `box` (min_x, min_y, max_x, max_y) or
+        # containing `point` (x, y). The index finds the features whose
+        # bounds overlap, then we test their geometry. (CROSS JOIN makes
+        # SQLite search the index first, rather than scanning the layer.)
+        if point is not None:
+            box = (point[0], point[1], point[0], point[1])
+        (min_x, min_y, max_x, max_y) = box
+        candidates = self.select(
+            "SELECT features.data FROM feature_bounds"
+            " CROSS JOIN features ON features.rowid = feature_bounds.id"
+            " WHERE features.workspace = ? AND features.layer = ?"
+            " AND feature_bounds.max_x >= ? AND feature_bounds.min_x <= ?"
+            " AND feature_bounds.max_y >= ? AND feature_bounds.min_y <= ?"
+            " ORDER BY features.position",
+            [workspace or "", layer, min_x, max_x, min_y, max_y],
+            None,
+            None,
+        )
+        if point is not None:
+            return [
+                c for c in candidates if spatial.contains_point(c["geometry"], point)
+            ]
+        return [c for c in candidates if spatial.intersects_box(c["geometry"], box)]
+
+    # Helpers -----------------------------------
+
+    def select(self, sql, args, skip, limit, order_field=None, descending=False):
+        if order_field is None or order_field == "id":
+            if descending:
+                sql = sql.replace(" ORDER BY id", " ORDER BY id DESC")
+            if skip or limit is not None:
+                sql += " LIMIT ? OFFSET ?"
+                args = list(args) + [-1 if limit is None else limit, skip or 0]
+            return [json.loads(row[0]) for row in self.db.execute(sql, args)]
+
+        records = [json.loads(row[0]) for row in self.db.execute(sql, args)]
+        present = [r for r in records if field(r, order_field) is not None]
+        missing = [r for r in records if field(r, order_field) is None]
+        present.sort(key=lambda r: field(r, order_field), reverse=descending)
+        records = present + missing
+        start = skip or 0
+        return records[start:] if limit is None else records[start : start + limit]
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+
+def sync_surveys(store, workspace, module, pages, incremental, id_field, time_field):
+    # Upserts `pages` of surveys, one transaction per page. When `incremental`,
+    # pages must be newest first (see `is_newest_first`) and we stop at the
+    # first page that reaches back to the previous high-water mark. The new mark is only
+    # saved once we get there (or run out of pages): if the sync is
+    # interrupted, the next run has to fetch the pages we missed again.
+    previous = store.high_water("surveys", workspace, module)
+    high_water = previous
+    fetched = 0
+    page_count = 0
+
+    for page in pages:
+        page_count += 1
+        fetched += len(page)
+        rows = []
+        for record in page:
+            timestamp = field(record, time_field)
+            rows.append((field(record, id_field), timestamp, record))
+            if timestamp is not None and (high_water is None or timestamp > high_water):
+                high_water = timestamp
+
+        store.upsert_surveys(workspace, module, rows)
+        store.commit()
+
+        if incremental and previous is not None:
+            stamps = [timestamp for (id, timestamp, record) in rows]
+            if any(stamp is not None and stamp <= previous for stamp in stamps):
+                break
+
+    store.set_high_water("surveys", workspace, module, high_water, time_field)
+    store.commit()
+
+    return {
+        "workspace": workspace,
+        "module": module,
+        "pages": page_count,
+        "fetched": fetched,
+        "high_water": high_water,
+        "total": store.count_surveys(workspace, module),
+    }
+
+
+def sync_features(store, client, workspace, layer, revalidate=True):
+    # Re-downloads a layer only if it has changed since we last mirrored it:
+    # we send the ETag/Last-Modified we saw last time, and if the server
+    # doesn't support those we compare a hash of the body before re-indexing.
+    # Without `revalidate`, a layer we already have is used as it is:
+    import cartographer.fetch as fetch
+
+    state = store.high_water("features", workspace, layer)
+    state = state if isinstance(state, dict) else {}
+    unchanged = {
+        "workspace": workspace,
+        "layer": layer,
+        "changed": False,
+        "total": store.count_features(workspace, layer),
+    }
+    if state and not revalidate:
+        return unchanged
+
+    response = client.feature_search_since(
+        layer, workspace, state.get("etag", None), state.get("modified", None)
+    )
+    if response is None:
+        return unchanged
+
+    new_state = {
+        "etag": response.headers.get("ETag", None),
+        "modified": response.headers.get("Last-Modified", None),
+        "sha256": hashlib.sha256(response.content).hexdigest(),
+    }
+    if new_state["sha256"] == state.get("sha256", None):
+        store.set_high_water("features", workspace, layer, new_state)
+        store.commit()
+        return unchanged
+
+    collection = fetch.decode_json(response)
+    total = store.replace_features(workspace, layer, collection, new_state)
+    return {"workspace": workspace, "layer": layer, "changed": True, "total": total}
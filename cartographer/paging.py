@@ -0,0 +1,68 @@
+from cartographer.workers import imap_ordered
+import cartographer.fetch as fetch
+
+default_page_size = 100
+default_concurrency = 4
+
+
+def windows(skip, limit, page_size):
+    start = skip or 0
+    end = None if limit is None else start + limit
+    while end is None or start < end:
+        size = page_size if end is None else min(page_size, end - start)
+        yield (start, size)
+        start += size
+
+
+def fetch_pages(
+    page_url,
+    auth,
+    headers,
+    skip,
+    limit,
+    page_size,
+    concurrency,
+    engine=None,
+    client=None,
+):
+    page_size = page_size or default_page_size
+    concurrency = concurrency or default_concurrency
+    client = client or fetch.get_client()
+
+    def fetch_page(window):
+        (start, size) = window
+        # Each page is only fetched once, so isn't worth memoizing:
+        response = client.get(page_url(start, size), auth, headers, memo=False)
+        return (size, fetch.decode_json(response))
+
+    if engine == "asyncio":
+        import cartographer.aio as aio
+
+        def window_url(window):
+            (start, size) = window
+            return page_url(start, size)
+
+        def read_page(result):
+            ((start, size), response) = result
+            fetch.handle_http_errors(response)
+            return (size, fetch.decode_json(response))
+
+        results = (
+            read_page(result)
+            for result in aio.imap_get(
+                window_url,
+                windows(skip, limit, page_size),
+                auth,
+                headers,
+                concurrency,
+                ordered=True,
+                client=client,
+            )
+        )
+    else:
+        results = imap_ordered(fetch_page, windows(skip, limit, page_size), concurrency)
+
+    for (size, page) in results:
+        yield page
+        if len(page) < size:
+            break
@@ -1,6 +1,11 @@
 import os
+import sys
 import copy
-import ConfigParser
+
+try:
+    import ConfigParser
+except ImportError:
+    import configparser as ConfigParser
 
 profile_whitelist = {
     'scheme': 'string',
@@ -8,14 +13,34 @@ profile_whitelist = {
     'email': 'string',
     'password': 'string',
     'legacy_urls': 'string',
-    'legacy_json': 'boolean'
+    'legacy_json': 'boolean',
+    'pool_size': 'integer',
+    'keep_alive': 'boolean',
+    'connect_timeout': 'float',
+    'read_timeout': 'float',
+    'cache': 'boolean',
+    'cache_ttl': 'float',
+    'cache_size': 'integer',
+    'memo_size': 'integer',
+    'token_cache': 'boolean',
+    'compression': 'boolean',
+    'gzip_uploads': 'integer',
+    'retries': 'integer',
+    'rate_limit': 'float',
+    'engine': 'string'
 }
 
 profile_defaults = {
     'scheme': 'https',
     'host': 'api.cartographer.io',
     'legacy_urls': 'no',
-    'legacy_json': 'no'
+    'legacy_json': 'no',
+    'pool_size': '10',
+    'keep_alive': 'yes',
+    'cache': 'no',
+    'token_cache': 'yes',
+    'compression': 'yes',
+    'retries': '0'
 }
 
 
@@ -44,7 +69,28 @@ def read_profile(profile_name=None):
             profile[key] = config.get(profile_name, key)
         elif type == 'boolean':
             profile[key] = config.getboolean(profile_name, key)
+        elif type == 'integer':
+            profile[key] = config.getint(profile_name, key)
+        elif type == 'float':
+            profile[key] = config.getfloat(profile_name, key)
         else:
             sys.stderr.write('Skipping config key: {}'.format(key))
 
     return profile
+
+
+def build_params(args, profile):
+    params = {}
+
+    for key in profile:
+        params[key] = profile.get(key, None)
+
+    for key in args:
+        value = args.get(key, None)
+        # Unset options (and switches left off) fall back to the profile.
+        # Numeric zeros given on the command line are kept:
+        if value is None or value is False:
+            value = profile.get(key, None)
+        params[key] = value
+
+    return params
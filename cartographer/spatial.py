@@ -0,0 +1,170 @@
+import sys
+
+# Geometry tests for `feature query`. Coordinates are GeoJSON [x, y]
+# (longitude, latitude) pairs, treated as planar: good enough for finding
+# features in a bounding box, but not for shapes crossing the antimeridian.
+
+
+def parse_point(text):
+    try:
+        (x, y) = [float(part) for part in text.split(",")]
+    except ValueError:
+        sys.exit("Point must be LONGITUDE,LATITUDE: {}".format(text))
+    return (x, y)
+
+
+# Geometries ====================================
+
+
+def positions(geometry):
+    # Every [x, y] in a geometry, at any depth of nesting:
+    kind = geometry.get("type", None)
+    if kind == "GeometryCollection":
+        for part in geometry.get("geometries") or []:
+            for position in positions(part):
+                yield position
+    else:
+        stack = [geometry.get("coordinates") or []]
+        while stack:
+            coords = stack.pop()
+            if coords and isinstance(coords[0], (int, float)):
+                yield coords
+            else:
+                stack.extend(coords)
+
+
+def bounds(geometry):
+    # (min_x, min_y, max_x, max_y), or None for an empty or missing geometry:
+    if not geometry:
+        return None
+    xs = []
+    ys = []
+    for position in positions(geometry):
+        xs.append(position[0])
+        ys.append(position[1])
+    if not xs:
+        return None
+    return (min(xs), min(ys), max(xs), max(ys))
+
+
+def parts(geometry):
+    # Splits a geometry into ("point", [x, y]), ("line", [positions])
+    # and ("polygon", [rings]) parts:
+    kind = geometry.get("type", None)
+    coords = geometry.get("coordinates") or []
+    if kind == "Point":
+        return [("point", coords)] if coords else []
+    elif kind == "MultiPoint":
+        return [("point", point) for point in coords]
+    elif kind == "LineString":
+        return [("line", coords)]
+    elif kind == "MultiLineString":
+        return [("line", line) for line in coords]
+    elif kind == "Polygon":
+        return [("polygon", coords)]
+    elif kind == "MultiPolygon":
+        return [("polygon", polygon) for polygon in coords]
+    elif kind == "GeometryCollection":
+        return [
+            part for child in geometry.get("geometries") or [] for part in parts(child)
+        ]
+    return []
+
+
+def segments(line):
+    for index in range(len(line) - 1):
+        yield (line[index], line[index + 1])
+
+
+# Tests =========================================
+
+
+def in_box(point, box):
+    (min_x, min_y, max_x, max_y) = box
+    return min_x <= point[0] <= max_x and min_y <= point[1] <= max_y
+
+
+def cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def on_segment(point, a, b):
+    return cross(a, b, point) == 0 and in_box(
+        point,
+        (min(a[0], b[0]), min(a[1], b[1]), max(a[0], b[0]), max(a[1], b[1])),
+    )
+
+
+def segments_cross(a, b, c, d):
+    # Whether segment ab touches segment cd:
+    d1 = cross(c, d, a)
+    d2 = cross(c, d, b)
+    d3 = cross(a, b, c)
+    d4 = cross(a, b, d)
+    if ((d1 > 0 and d2 < 0) or (d1 < 0 and d2 > 0)) and (
+        (d3 > 0 and d4 < 0) or (d3 < 0 and d4 > 0)
+    ):
+        return True
+    return (
+        on_segment(a, c, d)
+        or on_segment(b, c, d)
+        or on_segment(c, a, b)
+        or on_segment(d, a, b)
+    )
+
+
+def segment_touches_box(a, b, box):
+    if in_box(a, box) or in_box(b, box):
+        return True
+    (min_x, min_y, max_x, max_y) = box
+    corners = [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]
+    return any(segments_cross(a, b, c, d) for (c, d) in segments(corners + corners[:1]))
+
+
+def in_polygon(point, rings):
+    # Even-odd ray casting, so holes (the second and later rings) are excluded.
+    # Points on an edge count as inside:
+    (x, y) = (point[0], point[1])
+    inside = False
+    for ring in rings:
+        for (a, b) in segments(ring):
+            if on_segment(point, a, b):
+                return True
+            if (a[1] > y) != (b[1] > y):
+                if x < (b[0] - a[0]) * (y - a[1]) / float(b[1] - a[1]) + a[0]:
+                    inside = not inside
+    return inside
+
+
+def contains_point(geometry, point):
+    for (kind, coords) in parts(geometry):
+        if kind == "point":
+            if coords[0] == point[0] and coords[1] == point[1]:
+                return True
+        elif kind == "line":
+            if any(on_segment(point, a, b) for (a, b) in segments(coords)):
+                return True
+        elif in_polygon(point, coords):
+            return True
+    return False
+
+
+def intersects_box(geometry, box):
+    (min_x, min_y, max_x, max_y) = box
+    for (kind, coords) in parts(geometry):
+        if kind == "point":
+            if in_box(coords, box):
+                return True
+        elif kind == "line":
+            if len(coords) == 1 and in_box(coords[0], box):
+                return True
+            if any(segment_touches_box(a, b, box) for (a, b) in segments(coords)):
+                return True
+        else:
+            edges = (edge for ring in coords for edge in segments(ring))
+            if any(segment_touches_box(a, b, box) for (a, b) in edges):
+                return True
+            # The box may lie entirely inside the polygon:
+            if coords and in_polygon((min_x, min_y), coords):
+                return True
+    return False
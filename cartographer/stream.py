@@ -0,0 +1,132 @@
+import codecs
+import json
+import re
+
+chunk_size = 64 * 1024
+
+structure_chars = re.compile(r'["\[\]{},]')
+string_chars = re.compile(r'["\\]')
+
+
+def json_items(chunks, key=None):
+    # Incrementally parses the elements of a JSON array without holding
+    # the whole document in memory. By default the array is the top-level
+    # value. If `key` is given, it is the array stored under that key
+    # in a top-level object (e.g. "features" in a GeoJSON FeatureCollection).
+    # Raises ValueError if the document is cut short (or isn't an array).
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    depth = 0
+    target = None if key else 1
+    done = False
+    in_string = False
+    escaped = False
+    item = None
+    label = None
+    last_label = None
+
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        pos = 0
+        start = 0
+        size = len(text)
+
+        while pos < size:
+            if escaped:
+                escaped = False
+                pos += 1
+                continue
+
+            if in_string:
+                match = string_chars.search(text, pos)
+                if match is None:
+                    break
+                pos = match.end()
+                if match.group() == "\\":
+                    escaped = True
+                else:
+                    in_string = False
+                    if label is not None:
+                        label.append(text[start : pos - 1])
+                        last_label = "".join(label)
+                        label = None
+                continue
+
+            match = structure_chars.search(text, pos)
+            if match is None:
+                break
+            char = match.group()
+            pos = match.end()
+
+            if char == '"':
+                in_string = True
+                if depth == 1 and target is None:
+                    start = pos
+                    label = []
+            elif char in "[{":
+                depth += 1
+                if char == "[" and depth == 2 and target is None:
+                    if last_label == key and not done:
+                        target = 2
+                if depth == target and char == "[" and item is None and not done:
+                    start = pos
+                    item = []
+            elif char in "]}":
+                if depth == target and item is not None:
+                    item.append(text[start : pos - 1])
+                    raw = "".join(item).strip()
+                    if raw:
+                        yield json.loads(raw)
+                    item = None
+                    done = True
+                    if key:
+                        target = -1
+                depth -= 1
+            elif char == "," and depth == target and item is not None:
+                item.append(text[start : pos - 1])
+                yield json.loads("".join(item))
+                item = []
+                start = pos
+
+        if item is not None:
+            item.append(text[start:])
+            start = 0
+        if label is not None:
+            label.append(text[start:])
+            start = 0
+
+    decoder.decode(b"", True)
+    if in_string or depth != 0:
+        raise ValueError("Incomplete JSON document")
+    if key is None and not done:
+        raise ValueError("Expected a JSON array")
+
+
+def response_items(response, key=None):
+    try:
+        for item in json_items(response.iter_content(chunk_size), key):
+            yield item
+    finally:
+        response.close()
+
+
+def response_chunks(response, size=chunk_size):
+    try:
+        for chunk in response.iter_content(size):
+            if chunk:
+                yield chunk
+    finally:
+        response.close()
+
+
+def redirect(ans, path):
+    # Writes command output to `path` instead of stdout, if one is given:
+    if path is None:
+        return ans
+    if isinstance(ans, (str, bytes)):
+        ans = [ans]
+    with open(path, "wb") as file:
+        for chunk in ans:
+            if not isinstance(chunk, bytes):
+                chunk = chunk.encode("utf-8")
+            file.write(chunk)
+    return b""
@@ -0,0 +1,233 @@
+import hashlib
+import math
+import os
+import sqlite3
+import sys
+import time
+import zipfile
+
+max_latitude = 85.0511287798
+
+extensions = {
+    "application/json": "json",
+    "application/geo+json": "geojson",
+    "application/vnd.mapbox-vector-tile": "pbf",
+    "application/x-protobuf": "pbf",
+    "image/png": "png",
+    "image/jpeg": "jpg",
+}
+
+
+# Tile coordinates ------------------------------
+
+
+def parse_bbox(text):
+    try:
+        (west, south, east, north) = [float(part) for part in text.split(",")]
+    except ValueError:
+        sys.exit("Bounding box must be WEST,SOUTH,EAST,NORTH: {}".format(text))
+    return (west, south, east, north)
+
+
+def tile_xy(lon, lat, zoom):
+    lat = max(-max_latitude, min(max_latitude, lat))
+    n = 2 ** zoom
+    x = int((lon + 180.0) / 360.0 * n)
+    rad = math.radians(lat)
+    y = int((1.0 - math.log(math.tan(rad) + 1.0 / math.cos(rad)) / math.pi) / 2.0 * n)
+    return (min(max(x, 0), n - 1), min(max(y, 0), n - 1))
+
+
+def tile_range(bbox, zoom):
+    (west, south, east, north) = bbox
+    (min_x, min_y) = tile_xy(west, north, zoom)
+    (max_x, max_y) = tile_xy(east, south, zoom)
+    return (min_x, min_y, max_x, max_y)
+
+
+def count_tiles(bbox, min_zoom, max_zoom):
+    total = 0
+    for zoom in range(min_zoom, max_zoom + 1):
+        (min_x, min_y, max_x, max_y) = tile_range(bbox, zoom)
+        total += (max_x - min_x + 1) * (max_y - min_y + 1)
+    return total
+
+
+def enumerate_tiles(bbox, min_zoom, max_zoom):
+    for zoom in range(min_zoom, max_zoom + 1):
+        (min_x, min_y, max_x, max_y) = tile_range(bbox, zoom)
+        for x in range(min_x, max_x + 1):
+            for y in range(min_y, max_y + 1):
+                yield (zoom, x, y)
+
+
+def tile_extension(content_type, default="tile"):
+    if content_type:
+        content_type = content_type.split(";")[0].strip().lower()
+    return extensions.get(content_type, default)
+
+
+# Sinks -----------------------------------------
+
+
+class DirectorySink(object):
+    def __init__(self, path):
+        self.path = path
+
+    def summary(self):
+        return {}
+
+    def write(self, z, x, y, extension, data):
+        folder = os.path.join(self.path, str(z), str(x))
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                if not os.path.isdir(folder):
+                    raise
+        with open(os.path.join(folder, "{}.{}".format(y, extension)), "wb") as file:
+            file.write(data)
+
+    def close(self):
+        pass
+
+
+class ZipSink(object):
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+
+    def summary(self):
+        return {}
+
+    def write(self, z, x, y, extension, data):
+        self.archive.writestr("{}/{}/{}.{}".format(z, x, y, extension), data)
+
+    def close(self):
+        self.archive.close()
+
+
+class MBTilesSink(object):
+    # Writes tiles to an MBTiles (SQLite) file. Tile data is stored once
+    # per distinct SHA-1 hash, so repeated tiles (empty tiles, ocean tiles)
+    # only take up space once. Writing to an existing file reuses its images,
+    # and drops any that no tile refers to any more on close.
+    def __init__(self, path, metadata, batch_size=1000):
+        self.db = sqlite3.connect(path)
+        self.metadata = metadata
+        self.batch_size = batch_size
+        self.pending = 0
+        self.seen = set()
+        self.unique = 0
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS metadata (name TEXT, value TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS metadata_name ON metadata (name);
+            CREATE TABLE IF NOT EXISTS map (
+                zoom_level INTEGER,
+                tile_column INTEGER,
+                tile_row INTEGER,
+                tile_id TEXT
+            );
+            CREATE UNIQUE INDEX IF NOT EXISTS map_index
+                ON map (zoom_level, tile_column, tile_row);
+            CREATE TABLE IF NOT EXISTS images (tile_data BLOB, tile_id TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS images_id ON images (tile_id);
+            CREATE VIEW IF NOT EXISTS tiles AS
+                SELECT
+                    map.zoom_level AS zoom_level,
+                    map.tile_column AS tile_column,
+                    map.tile_row AS tile_row,
+                    images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+            """
+        )
+        self.seen.update(
+            row[0] for row in self.db.execute("SELECT tile_id FROM images")
+        )
+
+    def summary(self):
+        return {"unique": self.unique}
+
+    def write(self, z, x, y, extension, data):
+        tile_id = hashlib.sha1(data).hexdigest()
+        if tile_id not in self.seen:
+            self.seen.add(tile_id)
+            cursor = self.db.execute(
+                "INSERT OR IGNORE INTO images (tile_data, tile_id) VALUES (?, ?)",
+                (sqlite3.Binary(data), tile_id),
+            )
+            self.unique += cursor.rowcount
+        # MBTiles uses TMS row numbering, which counts from the bottom:
+        self.db.execute(
+            "INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)",
+            (z, x, (2 ** z) - 1 - y, tile_id),
+        )
+        self.metadata.setdefault("format", extension)
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)",
+            [(name, str(value)) for (name, value) in self.metadata.items()],
+        )
+        # Images of tiles that were overwritten with different data:
+        self.db.execute(
+            "DELETE FROM images WHERE tile_id NOT IN (SELECT tile_id FROM map)"
+        )
+        self.db.commit()
+        self.db.close()
+
+
+# Progress --------------------------------------
+
+
+class Progress(object):
+    def __init__(self, total, interval=1.0, out=None):
+        self.total = total
+        self.interval = interval
+        self.out = out or sys.stderr
+        self.done = 0
+        self.written = 0
+        self.bytes = 0
+        self.started = time.time()
+        self.reported = self.started
+
+    def update(self, size):
+        self.done += 1
+        if size:
+            self.written += 1
+            self.bytes += size
+        now = time.time()
+        if now - self.reported >= self.interval:
+            self.reported = now
+            self.report(now)
+
+    def report(self, now):
+        elapsed = max(now - self.started, 1e-6)
+        end = "\r" if self.out.isatty() else "\n"
+        self.out.write(
+            "{}/{} tiles ({} written), {:.1f} tiles/s, {:.1f} kB/s{}".format(
+                self.done,
+                self.total,
+                self.written,
+                self.done / elapsed,
+                self.bytes / elapsed / 1024.0,
+                end,
+            )
+        )
+        self.out.flush()
+
+    def finish(self):
+        now = time.time()
+        self.report(now)
+        if self.out.isatty():
+            self.out.write("\n")
+        return {
+            "tiles": self.done,
+            "written": self.written,
+            "bytes": self.bytes,
+            "seconds": round(now - self.started, 3),
+        }
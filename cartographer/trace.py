@@ -0,0 +1,136 @@
+import json
+import math
+import sys
+import threading
+
+import cartographer.fetch as fetch
+
+# The order of rows in the summary table:
+phase_names = [
+    "throttle",
+    "dns",
+    "connect",
+    "tls",
+    "wait",
+    "download",
+    "backoff",
+    "decode",
+    "encode",
+]
+
+
+def percentile(samples, fraction):
+    # Nearest-rank percentile of sorted `samples`:
+    index = int(math.ceil(fraction * len(samples))) - 1
+    return samples[max(0, min(len(samples) - 1, index))]
+
+
+def format_bytes(count):
+    if count < 1024:
+        return "{} B".format(count)
+    for unit in ["KB", "MB", "GB"]:
+        count /= 1024.0
+        if count < 1024 or unit == "GB":
+            return "{:.1f} {}".format(count, unit)
+
+
+class Recorder(object):
+    # A `fetch` hook for --trace. Writes each request as a line of JSON
+    # to `out` and keeps totals for a summary table. Encoding happens once
+    # per record, so encode events only go in the summary:
+    def __init__(self, out):
+        self.out = out
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        # The same, before compression:
+        self.bytes_uncompressed = 0
+        self.bytes_decoded = 0
+        self.samples = dict((name, []) for name in phase_names)
+        self.elapsed = []
+
+    def __call__(self, event):
+        with self.lock:
+            kind = event["event"]
+            if kind == "request":
+                self.requests += 1
+                self.retries += event["retries"]
+                if event.get("error") or (event["status"] or 0) >= 400:
+                    self.errors += 1
+                self.bytes_sent += event["bytes_sent"]
+                self.bytes_received += event["bytes_received"] or 0
+                self.bytes_uncompressed += event.get(
+                    "bytes_sent_uncompressed", event["bytes_sent"]
+                )
+                self.bytes_decoded += event.get(
+                    "bytes_received_decoded", event["bytes_received"] or 0
+                )
+                self.elapsed.append(event["ms"])
+                for (name, ms) in event["phases"].items():
+                    self.samples.setdefault(name, []).append(ms)
+            else:
+                self.samples.setdefault(kind, []).append(event["ms"])
+
+            if kind != "encode":
+                self.out.write(json.dumps(event, sort_keys=True) + "\n")
+                self.out.flush()
+
+    def summary(self):
+        sent = "{} sent".format(format_bytes(self.bytes_sent))
+        if self.bytes_uncompressed != self.bytes_sent:
+            sent += " ({} uncompressed)".format(format_bytes(self.bytes_uncompressed))
+        received = "{} received".format(format_bytes(self.bytes_received))
+        if self.bytes_decoded != self.bytes_received:
+            received += " ({} decoded)".format(format_bytes(self.bytes_decoded))
+        lines = [
+            "{} requests, {} retries, {} errors, {}, {}".format(
+                self.requests, self.retries, self.errors, sent, received
+            ),
+            "{:<10}{:>8}{:>12}{:>10}{:>10}{:>10}{:>10}".format(
+                "phase", "count", "total ms", "mean ms", "p50 ms", "p95 ms", "max ms"
+            ),
+        ]
+        rows = [(name, self.samples[name]) for name in phase_names]
+        rows += [
+            (name, samples)
+            for (name, samples) in sorted(self.samples.items())
+            if name not in phase_names
+        ]
+        rows.append(("request", self.elapsed))
+        for (name, samples) in rows:
+            if not samples:
+                continue
+            samples = sorted(samples)
+            total = sum(samples)
+            lines.append(
+                "{:<10}{:>8}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>10.1f}".format(
+                    name,
+                    len(samples),
+                    total,
+                    total / len(samples),
+                    percentile(samples, 0.5),
+                    percentile(samples, 0.95),
+                    samples[-1],
+                )
+            )
+        return "\n".join(lines) + "\n"
+
+
+def start(path):
+    # Starts tracing to `path` ("-" for stderr):
+    out = sys.stderr if path == "-" else open(path, "w")
+    recorder = Recorder(out)
+    fetch.add_hook(recorder)
+    return recorder
+
+
+def finish(recorder):
+    # Stops tracing and, for bulk jobs, prints the summary table to stderr:
+    fetch.remove_hook(recorder)
+    if recorder.out is not sys.stderr:
+        recorder.out.close()
+    if recorder.requests > 1:
+        sys.stderr.write(recorder.summary())
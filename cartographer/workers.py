@@ -0,0 +1,74 @@
+from collections import deque
+from multiprocessing.pool import ThreadPool
+import sys
+
+try:
+    from queue import Queue, Empty
+except ImportError:
+    from Queue import Queue, Empty
+
+
+def wait_for(result):
+    # Wait in short steps so Ctrl-C still interrupts us on Python 2:
+    while not result.ready():
+        result.wait(0.1)
+    return result.get()
+
+
+def imap_ordered(func, items, concurrency):
+    # Like `ThreadPool.imap`, but only reads `items` as fast as we consume
+    # results, so it is safe to pass long or infinite generators:
+    concurrency = max(1, concurrency or 1)
+    pool = ThreadPool(concurrency)
+    pending = deque()
+
+    try:
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= concurrency:
+                yield wait_for(pending.popleft())
+
+        while pending:
+            yield wait_for(pending.popleft())
+    finally:
+        pool.terminate()
+
+
+def imap_unordered(func, items, concurrency):
+    # Like `imap_ordered`, but yields results as soon as they complete,
+    # so one slow item doesn't hold up the rest:
+    concurrency = max(1, concurrency or 1)
+    pool = ThreadPool(concurrency)
+    completed = Queue()
+    in_flight = 0
+
+    def run(item):
+        try:
+            return (True, func(item))
+        except Exception:
+            return (False, sys.exc_info()[1])
+
+    def next_result():
+        while True:
+            try:
+                (ok, result) = completed.get(True, 0.1)
+            except Empty:
+                continue
+            if ok:
+                return result
+            else:
+                raise result
+
+    try:
+        for item in items:
+            pool.apply_async(run, (item,), callback=completed.put)
+            in_flight += 1
+            if in_flight >= concurrency * 2:
+                in_flight -= 1
+                yield next_result()
+
+        while in_flight > 0:
+            in_flight -= 1
+            yield next_result()
+    finally:
+        pool.terminate()
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import cartographer.attachments as attachments
+import cartographer.commands as commands
+import cartographer.fetch as fetch
+from benchmarks.mock_server import Options, attachment, start_server
+
+
+class LocalPathsTest(unittest.TestCase):
+    def test_duplicate_names_get_a_suffix(self):
+        items = [
+            {"filename": "photo.jpg"},
+            {"filename": "photo.jpg"},
+            {"filename": "photo.jpg", "folder": "raw"},
+            {"filename": "photo.jpg"},
+            {"filename": "notes"},
+            {"filename": "notes"},
+        ]
+        paths = attachments.local_paths("out", "s1", items)
+        self.assertEqual(
+            paths,
+            [
+                os.path.join("out", "s1", "photo.jpg"),
+                os.path.join("out", "s1", "photo-2.jpg"),
+                os.path.join("out", "s1", "raw", "photo.jpg"),
+                os.path.join("out", "s1", "photo-3.jpg"),
+                os.path.join("out", "s1", "notes"),
+                os.path.join("out", "s1", "notes-2"),
+            ],
+        )
+
+    def test_names_stay_inside_the_directory(self):
+        items = [{"filename": "x", "folder": ".."}, {"name": "../../etc/passwd"}]
+        self.assertEqual(
+            attachments.local_paths("out", "..", items),
+            [os.path.join("out", "_", "_", "x"), os.path.join("out", "_", "passwd")],
+        )
+
+
+class AttachmentUrlTest(unittest.TestCase):
+    def url(self, item):
+        return attachments.attachment_url("https", "api.example.com", "s1", item)
+
+    def api_url(self, path):
+        return fetch.create_url("https", "api.example.com", path)
+
+    def test_urls_on_the_api_host_get_credentials(self):
+        self.assertEqual(
+            self.url({"filename": "a.jpg", "folder": "f"}),
+            (self.api_url("/v1/attachment/s1/f/a.jpg"), True),
+        )
+        self.assertEqual(
+            self.url({"url": "/files/a.jpg"}), (self.api_url("/files/a.jpg"), True)
+        )
+        self.assertEqual(
+            self.url({"url": "https://api.example.com/files/a.jpg"}),
+            ("https://api.example.com/files/a.jpg", True),
+        )
+
+    def test_other_hosts_do_not(self):
+        for url in [
+            "https://files.example.com/a.jpg",
+            "https://api.example.com.evil.com/a.jpg",
+            "https://api.example.com:8443/a.jpg",
+            "http://api.example.com/a.jpg",
+        ]:
+            self.assertEqual(self.url({"href": url}), (url, False))
+
+
+class DownloadTest(unittest.TestCase):
+    size = 1000
+
+    def setUp(self):
+        self.start(Options(attachment_size=self.size))
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "s1", "photo.jpg")
+        self.data = attachment("s1", 0, self.size)
+        self.url = "http://127.0.0.1:{}/v1/attachment/s1/0".format(self.port)
+        fetch.set_client(fetch.Client())
+
+    def start(self, options):
+        self.server = start_server(options)
+        self.port = self.server.server_address[1]
+
+    def tearDown(self):
+        fetch.get_client().close()
+        fetch.set_client(None)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def download(self, size=size, md5=True):
+        checksum = hashlib.md5(self.data).hexdigest() if md5 else None
+        return attachments.download(self.url, None, {}, self.path, size, checksum)
+
+    def write_part(self, data):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path + ".part", "wb") as file:
+            file.write(data)
+
+    def read(self):
+        with open(self.path, "rb") as file:
+            return file.read()
+
+    def ranges(self):
+        return [sent for (path, sent, auth) in self.server.attachment_requests]
+
+    def test_download_then_skip(self):
+        self.assertEqual(self.download(), "downloaded")
+        self.assertEqual(self.read(), self.data)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertEqual(self.download(), "skipped")
+        self.assertEqual(len(self.server.attachment_requests), 1)
+
+    def test_resume(self):
+        self.write_part(self.data[:300])
+        self.assertEqual(self.download(), "resumed")
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(self.ranges(), ["bytes=300-"])
+
+    def test_resume_a_complete_part_file(self):
+        # The server answers 416, as there's nothing left to send:
+        self.write_part(self.data)
+        self.assertEqual(self.download(), "resumed")
+        self.assertEqual(self.read(), self.data)
+
+    def test_a_part_file_that_does_not_match_is_replaced(self):
+        self.write_part(b"x" * 300)
+        with self.assertRaises(ValueError):
+            self.download()
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertEqual(self.download(), "downloaded")
+        self.assertEqual(self.read(), self.data)
+
+    def test_wrong_size(self):
+        # Too short may be a dropped connection, so the part file is kept:
+        with self.assertRaises(ValueError):
+            self.download(self.size + 100, md5=False)
+        self.assertEqual(os.path.getsize(self.path + ".part"), self.size)
+        self.assertFalse(os.path.exists(self.path))
+        # Too long can't be resumed:
+        with self.assertRaises(ValueError):
+            self.download(self.size - 100, md5=False)
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_checksum_mismatch(self):
+        self.data = b"something else"
+        with self.assertRaises(ValueError):
+            self.download()
+        self.assertFalse(os.path.exists(self.path + ".part"))
+        self.assertFalse(os.path.exists(self.path))
+
+
+class IgnoredRangeTest(DownloadTest):
+    # A server that always sends the whole file, with a 200:
+    def start(self, options):
+        options.ranges = False
+        DownloadTest.start(self, options)
+
+    def test_resume(self):
+        self.write_part(self.data[:300])
+        self.assertEqual(self.download(), "downloaded")
+        self.assertEqual(self.read(), self.data)
+        self.assertEqual(self.ranges(), ["bytes=300-"])
+
+    def test_resume_a_complete_part_file(self):
+        self.write_part(self.data)
+        self.assertEqual(self.download(), "downloaded")
+        self.assertEqual(self.read(), self.data)
+
+    def test_a_part_file_that_does_not_match_is_replaced(self):
+        self.write_part(b"x" * 300)
+        self.assertEqual(self.download(), "downloaded")
+        self.assertEqual(self.read(), self.data)
+
+
+class AttachmentDownloadTest(unittest.TestCase):
+    # `attachment download` against the mock server:
+    def setUp(self):
+        self.server = start_server(Options(attachment_size=500))
+        self.dir = tempfile.mkdtemp()
+        surveys = os.path.join(self.dir, "surveys.json")
+        with open(surveys, "w") as file:
+            file.write(json.dumps(["s1", "s2"]))
+        self.params = {
+            "scheme": "http",
+            "host": "127.0.0.1:{}".format(self.server.server_address[1]),
+            "email": "a@b.c",
+            "password": "pw",
+            "workspace": None,
+            "module": "mod",
+            "folder": None,
+            "out": os.path.join(self.dir, "out"),
+            "concurrency": 2,
+            "surveys": surveys,
+            "engine": None,
+            "pretty": None,
+        }
+        fetch.set_client(fetch.Client())
+
+    def tearDown(self):
+        fetch.get_client().close()
+        fetch.set_client(None)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def run_command(self):
+        return json.loads(commands.attachment_download(self.params))
+
+    def test_download(self):
+        summary = self.run_command()
+        self.assertEqual(
+            summary,
+            {"downloaded": 6, "resumed": 0, "skipped": 0, "failed": 0, "errors": []},
+        )
+        for survey in ["s1", "s2"]:
+            directory = os.path.join(self.params["out"], survey)
+            self.assertEqual(
+                sorted(os.listdir(directory)),
+                ["notes.txt", "photo-2.jpg", "photo.jpg"],
+            )
+            with open(os.path.join(directory, "photo-2.jpg"), "rb") as file:
+                self.assertEqual(file.read(), attachment(survey, 1, 500))
+
+        self.assertEqual(self.run_command()["skipped"], 6)
+
+    def test_credentials_only_go_to_the_api_host(self):
+        self.run_command()
+        sent = dict((path, auth) for (path, _, auth) in self.server.attachment_requests)
+        self.assertEqual(len(sent), 6)
+        for (path, auth) in sent.items():
+            if path.endswith("/2"):
+                self.assertIsNone(auth, path)
+            else:
+                self.assertTrue(auth.startswith("Basic "), path)
+
+
+if __name__ == "__main__":
+    unittest.main()
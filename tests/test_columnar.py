@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import cartographer.columnar as columnar
+
+
+def flat(record):
+    # What `Reader.records` gives back: flattened, without nulls:
+    if not isinstance(record, dict):
+        record = {"value": record}
+    flattened = columnar.flatten(record)
+    return dict(
+        (name, value) for (name, value) in flattened.items() if value is not None
+    )
+
+
+class RoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "records.col")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def round_trip(self, records):
+        summary = columnar.write(self.path, records)
+        self.assertEqual(summary["bytes"], os.path.getsize(self.path))
+        reader = columnar.Reader(self.path)
+        self.addCleanup(reader.close)
+        self.assertEqual(reader.rows, summary["rows"])
+        self.assertEqual(list(reader.records()), [flat(r) for r in records])
+        return reader
+
+    def test_types_and_nulls(self):
+        records = [
+            {"id": 1, "ok": True, "score": 0.5, "name": "ä", "note": None},
+            {"id": None, "ok": False, "score": None, "name": None},
+            {"id": -(2 ** 63), "ok": None, "score": -1.25, "name": ""},
+            {"id": 2 ** 63 - 1},
+        ]
+        reader = self.round_trip(records)
+        types = dict((name, reader.type(name)) for name in reader.names())
+        self.assertEqual(
+            types,
+            {
+                "id": "int64",
+                "ok": "bool",
+                "score": "float64",
+                "name": "string",
+                "note": "string",
+            },
+        )
+        self.assertEqual(reader.column("note"), [None] * 4)
+        self.assertEqual(reader.column("ok"), [True, False, None, None])
+
+    def test_mixed_types(self):
+        records = [
+            {"number": 1, "mixed": 1, "big": 1},
+            {"number": 2.5, "mixed": "two", "big": 2 ** 64},
+            {"number": None, "mixed": [3, {"x": None}], "big": None},
+            {"mixed": {}},
+            {"mixed": False},
+        ]
+        reader = self.round_trip(records)
+        self.assertEqual(reader.type("number"), "float64")
+        self.assertEqual(reader.column("number"), [1.0, 2.5, None, None, None])
+        self.assertEqual(reader.type("mixed"), "json")
+        self.assertEqual(reader.type("big"), "json")
+
+    def test_nested_records_are_flattened(self):
+        records = [
+            {"id": "a", "data": {"name": "x", "geo": {"lat": 1.5}, "tags": ["t"]}},
+            {"id": "b", "data": {"name": "y", "empty": {}}},
+            {"id": "c", "data": None},
+            "not a record",
+        ]
+        reader = self.round_trip(records)
+        self.assertEqual(
+            sorted(reader.names()),
+            [
+                "data",
+                "data.empty",
+                "data.geo.lat",
+                "data.name",
+                "data.tags",
+                "id",
+                "value",
+            ],
+        )
+        self.assertEqual(reader.column("data.geo.lat"), [1.5, None, None, None])
+        self.assertEqual(reader.column("data.tags"), [["t"], None, None, None])
+        self.assertEqual(reader.column("value"), [None, None, None, "not a record"])
+
+    def test_string_dictionary(self):
+        statuses = ["open", "closed", None, "open", "", "closed", "open", "open"]
+        ids = ["id-{}".format(i) for i in range(len(statuses))]
+        records = [{"status": s, "id": i} for (s, i) in zip(statuses, ids)]
+        reader = self.round_trip(records)
+        self.assertEqual(reader.index["status"]["encoding"], "dictionary")
+        self.assertEqual(reader.index["id"]["encoding"], "plain")
+        self.assertEqual(reader.column("status"), statuses)
+        self.assertEqual(reader.column("id"), ids)
+
+        # Each distinct value is stored once, in the order first seen:
+        data = bytes(reader.buffer("status", "data"))
+        self.assertEqual(data, b"openclosed")
+        indices = struct.unpack("<8i", bytes(reader.buffer("status", "indices")))
+        self.assertEqual(indices, (0, 1, -1, 0, 2, 1, 0, 0))
+
+    def test_json_dictionary(self):
+        records = [{"tags": ["a", "b"]}, {"tags": ["a", "b"]}, {"tags": None}]
+        reader = self.round_trip(records)
+        self.assertEqual(reader.index["tags"]["encoding"], "dictionary")
+
+    def test_no_records(self):
+        reader = self.round_trip([])
+        self.assertEqual((reader.rows, reader.names()), (0, []))
+
+    def test_not_a_columnar_file(self):
+        for data in [b"", b"x" * 100]:
+            with open(self.path, "wb") as file:
+                file.write(data)
+            with self.assertRaises(ValueError):
+                columnar.Reader(self.path)
+
+        columnar.write(self.path, [{"a": 1}])
+        with open(self.path, "rb+") as file:
+            file.truncate(os.path.getsize(self.path) - 1)
+        with self.assertRaises(ValueError):
+            columnar.Reader(self.path)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+import email.utils
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+import cartographer.fetch as fetch
+from cartographer.profile import read_profile
+
+
+def response(status, headers=None):
+    result = requests.Response()
+    result.status_code = status
+    result.headers.update(headers or {})
+    result._content = b"{}"
+    result._content_consumed = True
+    return result
+
+
+class FakeSession(object):
+    # Answers requests with `responses` in turn, recording the methods:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.methods = []
+
+    def request(self, method, url, **kwargs):
+        self.methods.append(method)
+        return self.responses.pop(0)
+
+
+class RetryAfterTest(unittest.TestCase):
+    def test_seconds(self):
+        self.assertEqual(fetch.retry_after(response(429, {"Retry-After": "3"})), 3.0)
+        self.assertEqual(fetch.retry_after(response(429, {"Retry-After": "-1"})), 0.0)
+
+    def test_http_date(self):
+        date = email.utils.formatdate(time.time() + 10, usegmt=True)
+        delay = fetch.retry_after(response(503, {"Retry-After": date}))
+        self.assertTrue(8 <= delay <= 10.5, delay)
+
+    def test_missing_or_invalid(self):
+        self.assertIsNone(fetch.retry_after(response(503)))
+        self.assertIsNone(fetch.retry_after(response(503, {"Retry-After": "soon"})))
+
+
+class BackoffTest(unittest.TestCase):
+    def test_jitter_stays_under_the_cap(self):
+        for attempt in range(12):
+            for _ in range(20):
+                delay = fetch.backoff(attempt)
+                self.assertTrue(0 <= delay <= min(30.0, 0.5 * 2 ** attempt), delay)
+
+
+class RateLimiterTest(unittest.TestCase):
+    def test_unlimited(self):
+        limiter = fetch.RateLimiter()
+        self.assertEqual([limiter.reserve() for _ in range(100)], [0] * 100)
+
+    def test_burst_then_wait(self):
+        limiter = fetch.RateLimiter(rate=10, burst=2)
+        self.assertEqual([limiter.reserve(), limiter.reserve()], [0, 0])
+        wait = limiter.reserve()
+        self.assertTrue(0 < wait <= 0.1, wait)
+
+    def test_pause_holds_everyone_back(self):
+        limiter = fetch.RateLimiter()
+        limiter.pause(5)
+        self.assertTrue(4.5 < limiter.reserve() <= 5)
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.backoff = fetch.backoff
+        fetch.backoff = lambda attempt: 0.0
+
+    def tearDown(self):
+        fetch.backoff = self.backoff
+
+    def send(self, method, responses, retries=3):
+        client = fetch.Client(retries=retries)
+        client.session = FakeSession(responses)
+        status = client.send(method, "http://example.com/", None, {}).status_code
+        return (status, client.session.methods, client)
+
+    def test_no_retries_by_default(self):
+        (home, os.environ["HOME"]) = (os.environ.get("HOME"), tempfile.mkdtemp())
+        try:
+            retries = read_profile()["retries"]
+        finally:
+            shutil.rmtree(os.environ["HOME"])
+            os.environ["HOME"] = home
+        (status, methods, client) = self.send("GET", [response(503)], retries)
+        self.assertEqual((retries, status, len(methods)), (0, 503, 1))
+
+    def test_get_is_retried_on_500(self):
+        (status, methods, client) = self.send("GET", [response(500), response(200)])
+        self.assertEqual((status, len(methods)), (200, 2))
+
+    def test_post_is_not_retried_on_500(self):
+        (status, methods, client) = self.send("POST", [response(500), response(200)])
+        self.assertEqual((status, len(methods)), (500, 1))
+
+    def test_post_is_retried_when_unprocessed(self):
+        responses = [response(503), response(429, {"Retry-After": "0.01"})]
+        (status, methods, client) = self.send("POST", responses + [response(200)])
+        self.assertEqual((status, len(methods)), (200, 3))
+
+    def test_gives_up_after_retries(self):
+        responses = [response(502) for _ in range(4)]
+        (status, methods, client) = self.send("GET", responses, retries=2)
+        self.assertEqual((status, len(methods)), (502, 3))
+
+    def test_throttling_pauses_the_client(self):
+        start = time.time()
+        responses = [response(429, {"Retry-After": "0.05"}), response(200)]
+        (status, methods, client) = self.send("GET", responses)
+        self.assertEqual(status, 200)
+        self.assertTrue(client.limiter.paused_until >= start + 0.05)
+        self.assertTrue(time.time() - start >= 0.05)
+
+
+class MemoTest(unittest.TestCase):
+    def test_requests_in_flight_are_shared(self):
+        memo = fetch.Memo(1024 * 1024)
+        release = threading.Event()
+        sent = []
+
+        def send():
+            sent.append(1)
+            release.wait(5)
+            return response(200)
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(memo.get("key", send)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((len(sent), len(results)), (1, 8))
+        self.assertEqual(set(result.status_code for result in results), set([200]))
+
+    def test_other_methods_clear_it(self):
+        client = fetch.Client(memo_size=1024)
+        client.session = FakeSession([response(200) for _ in range(3)])
+        for _ in range(3):
+            client.get("http://example.com/a", None, {})
+        client.send("POST", "http://example.com/b", None, {})
+        client.get("http://example.com/a", None, {})
+        self.assertEqual(client.session.methods, ["GET", "POST", "GET"])
+
+    def test_memo_false_skips_it(self):
+        client = fetch.Client(memo_size=1024)
+        client.session = FakeSession([response(200) for _ in range(3)])
+        client.get("http://example.com/a", None, {})
+        client.get("http://example.com/a", None, {}, memo=False)
+        client.get("http://example.com/a", None, {})
+        self.assertEqual(client.session.methods, ["GET", "GET"])
+
+    def test_other_credentials_do_not_share_it(self):
+        client = fetch.Client(memo_size=1024)
+        client.session = FakeSession([response(200) for _ in range(4)])
+        for password in ["right", "wrong", "right"]:
+            auth = fetch.basic_auth("a@b.c", password)
+            client.get("http://example.com/a", auth, {})
+        for token in ["one", "two"]:
+            headers = fetch.create_headers(token)
+            client.get("http://example.com/a", None, headers)
+        self.assertEqual(client.session.methods, ["GET"] * 4)
+
+
+class AuthIdentityTest(unittest.TestCase):
+    def test_credentials_are_hashed(self):
+        identity = fetch.auth_identity(fetch.basic_auth("a@b.c", "secret"), {})
+        self.assertTrue(identity.startswith("a@b.c:"))
+        self.assertNotIn("secret", identity)
+        headers = fetch.create_headers("token")
+        self.assertNotIn("token", fetch.auth_identity(None, headers))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cartographer.fetch as fetch
+import cartographer.mirror as mirror
+from benchmarks.mock_server import Options, start_server
+from cartographer.client import CartographerClient
+
+
+def survey(id, updated, version):
+    return {"id": id, "updated": updated, "data": {"version": version}}
+
+
+def newest_first(surveys, page_size=1):
+    surveys = sorted(surveys, key=lambda record: record["updated"], reverse=True)
+    return [surveys[i : i + page_size] for i in range(0, len(surveys), page_size)]
+
+
+def interrupted(pages, count):
+    # Yields the first `count` pages, then fails like a dropped connection:
+    for page in pages[:count]:
+        yield page
+    raise IOError("Connection lost")
+
+
+class SyncSurveysTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.store = mirror.Store(os.path.join(self.dir, "mirror.sqlite"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+
+    def sync(self, pages, incremental=True):
+        return mirror.sync_surveys(
+            self.store, "w1", "mod", pages, incremental, "id", "updated"
+        )
+
+    def versions(self):
+        records = self.store.search_surveys("w1", "mod", None, None, None, None)
+        return dict((record["id"], record["data"]["version"]) for record in records)
+
+    def test_interrupted_sync_is_resumed(self):
+        server = [
+            survey("a", "2020-01-01", 1),
+            survey("b", "2020-01-02", 1),
+            survey("c", "2020-01-03", 1),
+        ]
+        self.sync(newest_first(server))
+
+        # "d" is new and "c" changes, so they're the first two pages:
+        server = [
+            survey("a", "2020-01-01", 1),
+            survey("b", "2020-01-02", 1),
+            survey("c", "2020-02-01", 2),
+            survey("d", "2020-02-02", 1),
+        ]
+        with self.assertRaises(IOError):
+            self.sync(interrupted(newest_first(server), 1))
+        self.assertEqual(self.versions()["c"], 1)
+        self.assertEqual(self.store.high_water("surveys", "w1", "mod"), "2020-01-03")
+
+        summary = self.sync(newest_first(server))
+        self.assertEqual(summary["pages"], 3)
+        self.assertEqual(summary["high_water"], "2020-02-02")
+        self.assertEqual(self.versions(), {"a": 1, "b": 1, "c": 2, "d": 1})
+
+    def test_sync_stops_at_previous_high_water(self):
+        server = [
+            survey(id, "2020-01-0{}".format(n), 1) for (n, id) in enumerate("abc", 1)
+        ]
+        self.sync(newest_first(server))
+        server.append(survey("d", "2020-01-04", 1))
+        summary = self.sync(newest_first(server))
+        self.assertEqual(summary["pages"], 2)
+        self.assertEqual(summary["total"], 4)
+
+    def test_ascending_order_is_fetched_in_full(self):
+        # Oldest first, a sync can't stop at the previous high-water mark:
+        self.assertTrue(mirror.is_newest_first("updated-desc", "updated"))
+        for order in [None, "updated", "updated-asc", "created-desc"]:
+            self.assertFalse(mirror.is_newest_first(order, "updated"), order)
+
+        server = [
+            survey("a", "2020-01-01", 1),
+            survey("b", "2020-01-02", 1),
+            survey("c", "2020-01-03", 1),
+        ]
+        self.sync(newest_first(server)[::-1])
+        server[0] = survey("a", "2020-02-01", 2)
+        server.append(survey("d", "2020-02-02", 1))
+        pages = newest_first(server)[::-1]
+        summary = self.sync(pages, mirror.is_newest_first("updated-asc", "updated"))
+        self.assertEqual(summary["pages"], 4)
+        self.assertEqual(self.versions(), {"a": 2, "b": 1, "c": 1, "d": 1})
+
+
+class LocalUserSearchTest(unittest.TestCase):
+    # `user search --local` should find the same users as the server:
+    def setUp(self):
+        self.server = start_server(Options(records=60, record_size=0))
+        host = "127.0.0.1:{}".format(self.server.server_address[1])
+        self.client = CartographerClient("http", host, "a@b.c", "pw", fetch.Client())
+        self.dir = tempfile.mkdtemp()
+        self.store = mirror.Store(os.path.join(self.dir, "mirror.sqlite"))
+        pages = self.client.user_search_pages("workspace-1", page_size=25)
+        self.store.replace_users("workspace-1", pages)
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.dir)
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_roles_match_the_server(self):
+        for role in ["admin", "member", "viewer", "admin:workspace-1", "admin:work"]:
+            remote = self.client.user_search("workspace-1", role=role)
+            local = self.store.search_users("workspace-1", None, role, None, None, None)
+            self.assertEqual(
+                [user["id"] for user in local], [user["id"] for user in remote], role
+            )
+            if role != "admin:work":
+                self.assertTrue(remote, role)
+
+
+if __name__ == "__main__":
+    unittest.main()
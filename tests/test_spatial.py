@@ -0,0 +1,171 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import cartographer.mirror as mirror
+import cartographer.spatial as spatial
+
+
+def square(x, y, size):
+    # A closed ring, anticlockwise from the bottom left corner:
+    return [[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]
+
+
+# A 10x10 square with a 4x4 hole in the middle:
+holed = {"type": "Polygon", "coordinates": [square(0, 0, 10), square(3, 3, 4)]}
+
+# The holed square, and a triangle off to the right:
+multi = {
+    "type": "MultiPolygon",
+    "coordinates": [
+        [square(0, 0, 10), square(3, 3, 4)],
+        [[[20, 0], [30, 0], [25, 10], [20, 0]]],
+    ],
+}
+
+line = {"type": "LineString", "coordinates": [[0, 0], [10, 10], [20, 10]]}
+
+
+def feature(id, geometry):
+    return {"type": "Feature", "id": id, "properties": {}, "geometry": geometry}
+
+
+class NoRtree(sqlite3.Connection):
+    # A connection to an SQLite built without the R*Tree module:
+    def execute(self, sql, *args):
+        if "USING rtree" in sql:
+            raise sqlite3.OperationalError("no such module: rtree")
+        return sqlite3.Connection.execute(self, sql, *args)
+
+
+class ContainsPointTest(unittest.TestCase):
+    def test_polygon_with_a_hole(self):
+        self.assertTrue(spatial.contains_point(holed, (1, 1)))
+        self.assertTrue(spatial.contains_point(holed, (8.5, 5)))
+        self.assertFalse(spatial.contains_point(holed, (5, 5)))
+        self.assertFalse(spatial.contains_point(holed, (3.5, 6.9)))
+        self.assertFalse(spatial.contains_point(holed, (11, 5)))
+        self.assertFalse(spatial.contains_point(holed, (-0.001, 5)))
+
+    def test_points_on_an_edge_are_inside(self):
+        for point in [(0, 5), (10, 5), (5, 0), (5, 10), (0, 0), (10, 10)]:
+            self.assertTrue(spatial.contains_point(holed, point), point)
+        # Including the edges of the hole:
+        for point in [(3, 5), (7, 5), (5, 3), (5, 7), (3, 3), (7, 7)]:
+            self.assertTrue(spatial.contains_point(holed, point), point)
+        # And a sloping edge of the triangle:
+        self.assertTrue(spatial.contains_point(multi, (22.5, 5)))
+        self.assertFalse(spatial.contains_point(multi, (22.4, 5)))
+
+    def test_multipolygon(self):
+        self.assertTrue(spatial.contains_point(multi, (1, 1)))
+        self.assertTrue(spatial.contains_point(multi, (25, 5)))
+        self.assertFalse(spatial.contains_point(multi, (5, 5)))
+        self.assertFalse(spatial.contains_point(multi, (15, 5)))
+        self.assertFalse(spatial.contains_point(multi, (21, 9)))
+
+    def test_points_and_lines(self):
+        point = {"type": "Point", "coordinates": [1.5, 2.5]}
+        self.assertTrue(spatial.contains_point(point, (1.5, 2.5)))
+        self.assertFalse(spatial.contains_point(point, (1.5, 2.6)))
+        self.assertTrue(spatial.contains_point(line, (5, 5)))
+        self.assertTrue(spatial.contains_point(line, (15, 10)))
+        self.assertFalse(spatial.contains_point(line, (5, 6)))
+        self.assertFalse(spatial.contains_point(line, (25, 10)))
+
+
+class IntersectsBoxTest(unittest.TestCase):
+    def test_polygon_with_a_hole(self):
+        # Inside the hole, overlapping its edge, inside the polygon:
+        self.assertFalse(spatial.intersects_box(holed, (4, 4, 6, 6)))
+        self.assertTrue(spatial.intersects_box(holed, (2, 4, 4, 6)))
+        self.assertTrue(spatial.intersects_box(holed, (1, 1, 2, 2)))
+        # Containing it, touching its corner, outside it:
+        self.assertTrue(spatial.intersects_box(holed, (-1, -1, 11, 11)))
+        self.assertTrue(spatial.intersects_box(holed, (10, 10, 12, 12)))
+        self.assertFalse(spatial.intersects_box(holed, (11, 11, 12, 12)))
+
+    def test_multipolygon(self):
+        self.assertTrue(spatial.intersects_box(multi, (24, 4, 26, 6)))
+        self.assertFalse(spatial.intersects_box(multi, (12, 0, 18, 10)))
+        # Inside the triangle's bounds, but not the triangle:
+        self.assertFalse(spatial.intersects_box(multi, (20, 8, 21, 10)))
+
+    def test_lines_crossing_without_an_end_inside(self):
+        self.assertFalse(spatial.intersects_box(line, (3, 6, 5, 8)))
+        self.assertTrue(spatial.intersects_box(line, (4, 4, 6, 6)))
+        self.assertTrue(spatial.intersects_box(line, (14, 9, 16, 11)))
+
+    def test_bounds(self):
+        self.assertEqual(spatial.bounds(multi), (0, 0, 30, 10))
+        collection = {"type": "GeometryCollection", "geometries": [line, holed]}
+        self.assertEqual(spatial.bounds(collection), (0, 0, 20, 10))
+        self.assertIsNone(spatial.bounds(None))
+        self.assertIsNone(spatial.bounds({"type": "Polygon", "coordinates": []}))
+
+
+class QueryFeaturesTest(unittest.TestCase):
+    # The same queries, with and without SQLite's R*Tree module:
+    features = [
+        feature(1, holed),
+        feature(2, multi),
+        feature(3, line),
+        feature(4, {"type": "Point", "coordinates": [5, 5]}),
+        feature(5, None),
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def store(self, factory=sqlite3.Connection):
+        connect = sqlite3.connect
+        sqlite3.connect = lambda path: connect(path, factory=factory)
+        try:
+            store = mirror.Store(os.path.join(self.dir, factory.__name__))
+        finally:
+            sqlite3.connect = connect
+        self.addCleanup(store.close)
+        store.replace_features("w", "l", {"features": self.features})
+        return store
+
+    def query(self, store, box=None, point=None):
+        features = store.query_features("w", "l", box=box, point=point)
+        return [feature["id"] for feature in features]
+
+    def check_queries(self, store):
+        self.assertEqual(self.query(store, point=(5, 5)), [3, 4])
+        self.assertEqual(self.query(store, point=(2, 1)), [1, 2])
+        self.assertEqual(self.query(store, point=(3, 5)), [1, 2])
+        self.assertEqual(self.query(store, point=(25, 5)), [2])
+        self.assertEqual(self.query(store, box=(4, 4, 6, 6)), [3, 4])
+        self.assertEqual(self.query(store, box=(-5, -5, 40, 40)), [1, 2, 3, 4])
+        self.assertEqual(self.query(store, box=(12, 0, 18, 9)), [])
+
+    def table_sql(self, store):
+        sql = "SELECT sql FROM sqlite_master WHERE name = 'feature_bounds'"
+        return store.db.execute(sql).fetchone()[0]
+
+    def test_rtree(self):
+        self.check_queries(self.store())
+
+    def test_without_rtree(self):
+        store = self.store(NoRtree)
+        self.assertNotIn("VIRTUAL", self.table_sql(store).upper())
+        self.check_queries(store)
+
+        # Replacing the layer replaces its bounds:
+        self.features = [feature(6, {"type": "Point", "coordinates": [100, 0]})]
+        store.replace_features("w", "l", {"features": self.features})
+        self.assertEqual(self.query(store, box=(-5, -5, 40, 40)), [])
+        self.assertEqual(self.query(store, point=(100, 0)), [6])
+        count = store.db.execute("SELECT COUNT(*) FROM feature_bounds").fetchone()
+        self.assertEqual(count[0], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
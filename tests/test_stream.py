@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import unittest
+
+from cartographer.stream import json_items
+
+
+def splits(data):
+    # `data` in two chunks, split at every offset, then one byte at a time:
+    for index in range(len(data) + 1):
+        yield [data[:index], data[index:]]
+    yield [data[index : index + 1] for index in range(len(data))]
+
+
+class JsonItemsTest(unittest.TestCase):
+    def assertItems(self, document, key=None):
+        # Whichever way the document is split, we get the whole array:
+        data = document.encode("utf-8")
+        expected = json.loads(document)
+        if key is not None:
+            expected = expected[key]
+        for chunks in splits(data):
+            self.assertEqual(list(json_items(chunks, key)), expected, chunks)
+
+    def test_values(self):
+        self.assertItems('[1, -2.5e3, true, false, null, "a", {"b": 1}]')
+
+    def test_strings_with_escapes_and_structure(self):
+        self.assertItems(
+            r'["a\"b", "{[,]}", "\\", "\\\"", "x\\\\", "é😀",'
+            r' {"k\"}": "v,]"}, "\/"]'
+        )
+
+    def test_unicode_split_inside_a_character(self):
+        self.assertItems('["café", {"地図": "\U0001f5fa"}]')
+
+    def test_nested_arrays(self):
+        self.assertItems('[[1, [2, 3]], [], [[[]]], {"a": [4, {"b": [5]}]}]')
+
+    def test_empty_arrays(self):
+        self.assertItems("[]")
+        self.assertItems(" [ \n ] ")
+        self.assertItems('{"features": []}', "features")
+
+    def test_array_under_a_key(self):
+        self.assertItems(
+            '{"type": "FeatureCollection", "name": "features", "bbox": [0, 1],'
+            ' "nested": {"features": [9]}, "features": [{"id": 1}, {"id": 2}],'
+            ' "after": [3]}',
+            "features",
+        )
+
+    def test_truncated_input_raises(self):
+        document = '[{"a": "x,y"}, [1, 2], "z"]'.encode("utf-8")
+        for end in range(len(document)):
+            with self.assertRaises(ValueError):
+                list(json_items([document[:end]]))
+
+        # Cut off inside a character:
+        with self.assertRaises(ValueError):
+            list(json_items(['["é"]'.encode("utf-8")[:3]]))
+
+        with self.assertRaises(ValueError):
+            list(json_items([b'{"features": [{"id": 1}, '], "features"))
+
+    def test_other_documents_raise(self):
+        for document in [b"", b"{}", b'{"features": [1]}', b'"[1]"', b"1"]:
+            with self.assertRaises(ValueError):
+                list(json_items([document]))
+
+    def test_items_arrive_before_the_end(self):
+        chunks = iter([b'[{"id": 1}, {"id"', b": 2}, "])
+        items = json_items(chunks)
+        self.assertEqual(next(items), {"id": 1})
+        self.assertEqual(next(items), {"id": 2})
+        with self.assertRaises(ValueError):
+            next(items)
+
+
+if __name__ == "__main__":
+    unittest.main()